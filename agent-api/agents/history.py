@@ -0,0 +1,44 @@
+import json
+from typing import Any, Dict, List, Optional
+
+from agno.agent import Agent
+from agno.memory.agent import AgentMemory, AgentRun
+
+from db.storage import SessionStorage
+
+
+def get_chat_history(agent: Agent, num_chats: Optional[int] = None) -> str:
+    """Use this function to get the chat history between the user and agent.
+
+    Args:
+        num_chats: The number of chats to return.
+            Each chat contains 2 messages. One from the user and one from the agent.
+            Default: None
+
+    Returns:
+        str: A JSON of a list of dictionaries representing the chat history.
+
+    Example:
+        - To get the last chat, use num_chats=1.
+        - To get the last 5 chats, use num_chats=5.
+        - To get all chats, use num_chats=None.
+        - To get the first chat, use num_chats=None and pick the first message.
+    """
+    # Replaces agno's read_chat_history tool, which only sees the runs loaded in memory. Agents load only their
+    # history window, so older runs are read from the storage.
+    runs: List[AgentRun] = list(agent.memory.runs) if isinstance(agent.memory, AgentMemory) else []
+    if isinstance(agent.storage, SessionStorage) and agent.session_id is not None:
+        loaded_run_ids = {run.response.run_id for run in runs if run.response is not None}
+        limit = None if num_chats is None else num_chats + len(runs)
+        saved_runs = [AgentRun.model_validate(run) for run in agent.storage.read_runs(agent.session_id, limit=limit)]
+        runs = [run for run in saved_runs if run.response is None or run.response.run_id not in loaded_run_ids] + runs
+
+    chats = AgentMemory(runs=runs).get_message_pairs()
+    if num_chats is not None:
+        chats = chats[-num_chats:] if num_chats > 0 else []
+
+    history: List[Dict[str, Any]] = []
+    for user_message, agent_message in chats:
+        history.append(user_message.to_dict())
+        history.append(agent_message.to_dict())
+    return json.dumps(history) if history else ""
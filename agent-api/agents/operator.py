@@ -1,8 +1,12 @@
+import hashlib
+import json
 from enum import Enum
-from typing import List, Optional
+from typing import Dict, List, Optional, Tuple
 
-from agents.sage import get_sage
-from agents.scholar import get_scholar
+from agno.agent import Agent
+
+from agents.pool import AgentPool
+from agents.settings import agent_settings
 
 
 class AgentType(Enum):
@@ -15,6 +19,35 @@ def get_available_agents() -> List[str]:
     return [agent.value for agent in AgentType]
 
 
+def build_agent(
+    key: Tuple[AgentType, str],
+    user_id: Optional[str] = None,
+    session_id: Optional[str] = None,
+    debug_mode: bool = True,
+) -> Agent:
+    """Builds a new agent for an (agent_id, model_id) pool key.
+
+    Agent modules import their tools, eg: DuckDuckGo, so they are imported when the first agent is built.
+    """
+    agent_id, model_id = key
+    if agent_id == AgentType.SAGE:
+        from agents.sage import get_sage
+
+        return get_sage(model_id=model_id, user_id=user_id, session_id=session_id, debug_mode=debug_mode)
+    else:
+        from agents.scholar import get_scholar
+
+        return get_scholar(model_id=model_id, user_id=user_id, session_id=session_id, debug_mode=debug_mode)
+
+
+# Pool of agents shared by all requests in this process
+agent_pool = AgentPool(
+    builder=build_agent,
+    max_size=agent_settings.pool_max_size,
+    idle_timeout=agent_settings.pool_idle_timeout,
+)
+
+
 def get_agent(
     model_id: str = "gpt-4o",
     agent_id: Optional[AgentType] = None,
@@ -22,7 +55,50 @@ def get_agent(
     session_id: Optional[str] = None,
     debug_mode: bool = True,
 ):
-    if agent_id == AgentType.SAGE:
-        return get_sage(model_id=model_id, user_id=user_id, session_id=session_id, debug_mode=debug_mode)
+    """Returns an agent bound to the user_id and session_id.
+
+    When the agent pool is enabled, the agent must be returned using `release_agent()` once the run completes.
+    """
+    key: Tuple[AgentType, str] = (agent_id or AgentType.SCHOLAR, model_id)
+    if not agent_settings.pool_enabled:
+        return build_agent(key, user_id=user_id, session_id=session_id, debug_mode=debug_mode)
+    return agent_pool.checkout(key, user_id=user_id, session_id=session_id, debug_mode=debug_mode)
+
+
+def release_agent(agent: Agent, failed: bool = False) -> None:
+    """Returns an agent from `get_agent()` to the pool. Agents from a failed run are discarded."""
+    if not agent_settings.pool_enabled:
+        return
+    if failed:
+        agent_pool.discard(agent)
     else:
-        return get_scholar(model_id=model_id, user_id=user_id, session_id=session_id, debug_mode=debug_mode)
+        agent_pool.release(agent)
+
+
+# Instructions version of each (agent_id, model_id), computed once per process
+_instructions_versions: Dict[Tuple[AgentType, str], str] = {}
+
+
+def get_instructions_version(agent_id: AgentType, model_id: str = "gpt-4o") -> str:
+    """Returns a hash of the parts of an agent's prompt that do not depend on the request.
+
+    The version changes whenever the description, instructions, expected output or tools of the agent change,
+    so responses cached for a previous version are not served.
+    """
+    key: Tuple[AgentType, str] = (agent_id, model_id)
+    if key not in _instructions_versions:
+        agent = get_agent(model_id=model_id, agent_id=agent_id, debug_mode=False)
+        try:
+            prompt = {
+                "description": agent.description,
+                "goal": agent.goal,
+                "instructions": agent.instructions,
+                "expected_output": agent.expected_output,
+                "tools": [getattr(tool, "name", type(tool).__name__) for tool in agent.tools or []],
+            }
+            _instructions_versions[key] = hashlib.sha256(
+                json.dumps(prompt, sort_keys=True, default=str).encode("utf-8")
+            ).hexdigest()[:16]
+        finally:
+            release_agent(agent)
+    return _instructions_versions[key]
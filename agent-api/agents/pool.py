@@ -0,0 +1,176 @@
+import time
+from collections import OrderedDict
+from dataclasses import asdict, dataclass
+from threading import Lock
+from typing import Any, Callable, Dict, Hashable, Optional, Tuple
+
+from agno.agent import Agent
+
+from utils.log import logger
+
+
+@dataclass
+class AgentPoolStats:
+    """Counters describing how the agent pool is being used"""
+
+    # Checkouts served by an idle agent from the pool
+    hits: int = 0
+    # Checkouts that had to build a new agent
+    misses: int = 0
+    # Idle agents dropped because of the size limit or the idle timeout
+    evictions: int = 0
+    # Total seconds spent building new agents
+    build_seconds_total: float = 0.0
+    # Agents currently checked out
+    in_use: int = 0
+    # Agents currently idle in the pool
+    idle: int = 0
+
+
+def get_user_context(user_id: Optional[str]) -> str:
+    """Returns the additional context that tells an agent which user it is interacting with."""
+    if not user_id:
+        return ""
+    return f"<context>You are interacting with the user: {user_id}</context>"
+
+
+def bind_agent(
+    agent: Agent,
+    user_id: Optional[str] = None,
+    session_id: Optional[str] = None,
+    debug_mode: bool = True,
+) -> Agent:
+    """Binds a pooled agent to a request, clearing any state left over from a previous session."""
+    agent.user_id = user_id
+    agent.session_id = session_id
+    agent.additional_context = get_user_context(user_id)
+    agent.debug_mode = debug_mode
+    agent.set_debug()
+
+    # Session state is read from storage again on the next run
+    agent.agent_session = None
+    agent.session_name = None
+    agent.session_state = None
+    agent.extra_data = None
+    agent.images = None
+    agent.videos = None
+    agent.audio = None
+    agent.run_id = None
+    agent.run_response = None
+    agent.run_messages = None
+    # A run sets these from its stream arguments and they stick to the agent
+    agent.stream = None
+    agent.stream_intermediate_steps = False
+    if agent.memory is not None:
+        agent.memory.clear()
+
+    # Tools are bound to the session_id (eg: get_chat_history), so they are rebuilt on the next run
+    agent._tools_for_model = None
+    agent._functions_for_model = None
+    agent._tool_instructions = None
+    if agent.model is not None:
+        agent.model.clear()
+    return agent
+
+
+class AgentPool:
+    """A pool of reusable agents keyed by (agent_id, model_id).
+
+    Building an agent creates its model, tools, storage and knowledge base, and every storage opens its own
+    connection pool. The pool keeps idle agents around so requests only pay for binding the user_id/session_id.
+    An agent is used by a single run at a time: it is removed from the pool on checkout and added back on release.
+    """
+
+    def __init__(
+        self,
+        builder: Callable[[Any], Agent],
+        max_size: int = 32,
+        idle_timeout: float = 300,
+    ):
+        self.builder = builder
+        self.max_size = max_size
+        self.idle_timeout = idle_timeout
+
+        # Idle agents ordered from least to most recently released: id(agent) -> (key, agent, released_at)
+        self._idle: "OrderedDict[int, Tuple[Hashable, Agent, float]]" = OrderedDict()
+        # Agents currently checked out: id(agent) -> (key, agent)
+        self._in_use: Dict[int, Tuple[Hashable, Agent]] = {}
+        self._stats = AgentPoolStats()
+        self._lock = Lock()
+
+    def checkout(
+        self,
+        key: Hashable,
+        user_id: Optional[str] = None,
+        session_id: Optional[str] = None,
+        debug_mode: bool = True,
+    ) -> Agent:
+        """Returns an agent for the key bound to the user_id and session_id, building one if none are idle."""
+        agent: Optional[Agent] = None
+        with self._lock:
+            self._evict_expired()
+            # Reuse the most recently released agent for this key
+            for agent_ref, (idle_key, idle_agent, _) in reversed(self._idle.items()):
+                if idle_key == key:
+                    del self._idle[agent_ref]
+                    agent = idle_agent
+                    break
+            if agent is not None:
+                self._stats.hits += 1
+            else:
+                self._stats.misses += 1
+
+        if agent is None:
+            start = time.perf_counter()
+            agent = self.builder(key)
+            build_seconds = time.perf_counter() - start
+            logger.debug(f"Built agent for {key} in {build_seconds:.3f}s")
+            with self._lock:
+                self._stats.build_seconds_total += build_seconds
+
+        with self._lock:
+            self._in_use[id(agent)] = (key, agent)
+        return bind_agent(agent, user_id=user_id, session_id=session_id, debug_mode=debug_mode)
+
+    def release(self, agent: Agent) -> None:
+        """Returns a checked out agent to the pool."""
+        with self._lock:
+            checked_out = self._in_use.pop(id(agent), None)
+            if checked_out is None:
+                logger.warning(f"Agent {agent.agent_id} was not checked out from this pool")
+                return
+            key = checked_out[0]
+            self._idle[id(agent)] = (key, agent, time.monotonic())
+            self._evict_expired()
+            # Drop the least recently released agents once the size limit is reached
+            while len(self._idle) > self.max_size:
+                self._idle.popitem(last=False)
+                self._stats.evictions += 1
+
+    def discard(self, agent: Agent) -> None:
+        """Removes a checked out agent from the pool without reusing it, eg: after a failed run."""
+        with self._lock:
+            self._in_use.pop(id(agent), None)
+
+    def clear(self) -> None:
+        """Drops all idle agents."""
+        with self._lock:
+            self._stats.evictions += len(self._idle)
+            self._idle.clear()
+
+    def stats(self) -> AgentPoolStats:
+        """Returns a snapshot of the pool counters."""
+        with self._lock:
+            self._stats.in_use = len(self._in_use)
+            self._stats.idle = len(self._idle)
+            return AgentPoolStats(**asdict(self._stats))
+
+    def _evict_expired(self) -> None:
+        # Must be called with the lock held. Idle agents are ordered by release time, so stop at the first fresh one.
+        deadline = time.monotonic() - self.idle_timeout
+        while self._idle:
+            agent_ref, (_, _, released_at) = next(iter(self._idle.items()))
+            if released_at > deadline:
+                break
+            del self._idle[agent_ref]
+            self._stats.evictions += 1
@@ -3,11 +3,29 @@ from typing import Optional
 
 from agno.agent import Agent, AgentKnowledge
 from agno.models.openai import OpenAIChat
-from agno.storage.agent.postgres import PostgresAgentStorage
 from agno.tools.duckduckgo import DuckDuckGoTools
-from agno.vectordb.pgvector import PgVector, SearchType
+from agno.vectordb.pgvector import SearchType
 
-from db.session import db_url
+from agents.history import get_chat_history
+from agents.pool import get_user_context
+from db.embedding_cache import get_cached_embedder
+from db.knowledge import KnowledgeVectorDb
+from db.session import db_async_engine, db_engine
+from db.storage import get_session_storage
+
+
+def get_sage_knowledge() -> AgentKnowledge:
+    """Returns the knowledge base of Sage. Large corpora are loaded with `python -m db.ingestion`."""
+    return AgentKnowledge(
+        vector_db=KnowledgeVectorDb(
+            table_name="sage_knowledge",
+            db_engine=db_engine,
+            async_engine=db_async_engine,
+            search_type=SearchType.hybrid,
+            # Recurring queries and documents are embedded once
+            embedder=get_cached_embedder(),
+        )
+    )
 
 
 def get_sage(
@@ -16,12 +34,6 @@ def get_sage(
     session_id: Optional[str] = None,
     debug_mode: bool = True,
 ) -> Agent:
-    additional_context = ""
-    if user_id:
-        additional_context += "<context>"
-        additional_context += f"You are interacting with the user: {user_id}"
-        additional_context += "</context>"
-
     return Agent(
         name="Sage",
         agent_id="sage",
@@ -29,13 +41,11 @@ def get_sage(
         session_id=session_id,
         model=OpenAIChat(id=model_id),
         # Tools available to the agent
-        tools=[DuckDuckGoTools()],
-        # Storage for the agent
-        storage=PostgresAgentStorage(table_name="sage_sessions", db_url=db_url),
+        tools=[DuckDuckGoTools(), get_chat_history],
+        # Storage for the agent, loading only the runs sent as history
+        storage=get_session_storage(table_name="sage_sessions", num_history_runs=3),
         # Knowledge base for the agent
-        knowledge=AgentKnowledge(
-            vector_db=PgVector(table_name="sage_knowledge", db_url=db_url, search_type=SearchType.hybrid)
-        ),
+        knowledge=get_sage_knowledge(),
         # Description of the agent
         description=dedent("""\
             You are Sage, an advanced Knowledge Agent designed to deliver accurate, context-rich, engaging responses.
@@ -83,7 +93,7 @@ def get_sage(
 
             7. In case of any uncertainties, clarify limitations and encourage follow-up queries.\
         """),
-        additional_context=additional_context,
+        additional_context=get_user_context(user_id),
         # Format responses using markdown
         markdown=True,
         # Add the current date and time to the instructions
@@ -91,8 +101,6 @@ def get_sage(
         # Send the last 3 messages from the chat history
         add_history_to_messages=True,
         num_history_responses=3,
-        # Add a tool to read the chat history if needed
-        read_chat_history=True,
         # Show debug logs
         debug_mode=debug_mode,
     )
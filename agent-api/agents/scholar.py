@@ -3,10 +3,11 @@ from typing import Optional
 
 from agno.agent import Agent
 from agno.models.openai import OpenAIChat
-from agno.storage.agent.postgres import PostgresAgentStorage
 from agno.tools.duckduckgo import DuckDuckGoTools
 
-from db.session import db_url
+from agents.history import get_chat_history
+from agents.pool import get_user_context
+from db.storage import get_session_storage
 
 
 def get_scholar(
@@ -15,12 +16,6 @@ def get_scholar(
     session_id: Optional[str] = None,
     debug_mode: bool = True,
 ) -> Agent:
-    additional_context = ""
-    if user_id:
-        additional_context += "<context>"
-        additional_context += f"You are interacting with the user: {user_id}"
-        additional_context += "</context>"
-
     return Agent(
         name="Scholar",
         agent_id="scholar",
@@ -28,9 +23,9 @@ def get_scholar(
         session_id=session_id,
         model=OpenAIChat(id=model_id),
         # Tools available to the agent
-        tools=[DuckDuckGoTools()],
-        # Storage for the agent
-        storage=PostgresAgentStorage(table_name="scholar_sessions", db_url=db_url),
+        tools=[DuckDuckGoTools(), get_chat_history],
+        # Storage for the agent, loading only the runs sent as history
+        storage=get_session_storage(table_name="scholar_sessions", num_history_runs=3),
         # Description of the agent
         description=dedent("""\
             You are Scholar, a cutting-edge Answer Engine built to deliver precise, context-rich, and engaging responses.
@@ -72,7 +67,7 @@ def get_scholar(
 
             4. In case of any uncertainties, clarify limitations and encourage follow-up queries.\
             """),
-        additional_context=additional_context,
+        additional_context=get_user_context(user_id),
         # Format responses using markdown
         markdown=True,
         # Add the current date and time to the instructions
@@ -80,8 +75,6 @@ def get_scholar(
         # Send the last 3 messages from the chat history
         add_history_to_messages=True,
         num_history_responses=3,
-        # Add a tool to read the chat history if needed
-        read_chat_history=True,
         # Show debug logs
         debug_mode=debug_mode,
     )
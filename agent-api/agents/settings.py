@@ -0,0 +1,19 @@
+from pydantic_settings import BaseSettings
+
+
+class AgentSettings(BaseSettings):
+    """Agent settings that can be set using environment variables.
+
+    Reference: https://pydantic-docs.helpmanual.io/usage/settings/
+    """
+
+    # Reuse agent instances across requests instead of building a new Agent per run
+    pool_enabled: bool = True
+    # Maximum number of idle agents kept across all (agent_id, model_id) keys
+    pool_max_size: int = 32
+    # Seconds an idle agent is kept in the pool before it is evicted
+    pool_idle_timeout: float = 300
+
+
+# Create an AgentSettings object
+agent_settings = AgentSettings()
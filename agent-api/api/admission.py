@@ -0,0 +1,189 @@
+import asyncio
+import math
+import time
+from collections import deque
+from dataclasses import asdict, dataclass
+from typing import Deque, Dict, Optional
+
+from api.settings import api_settings
+from utils.log import logger
+
+######################################################
+## Admission control for agent runs
+######################################################
+
+
+class AdmissionRejected(Exception):
+    """Raised when a run cannot be admitted because the wait queue is full or the wait timed out"""
+
+    def __init__(self, message: str, retry_after: int):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+@dataclass
+class AdmissionStats:
+    """Counters for the runs of a single model"""
+
+    # Runs currently running
+    in_flight: int = 0
+    # Runs currently waiting for a slot
+    queue_depth: int = 0
+    # Runs that got a slot
+    admitted: int = 0
+    # Runs rejected because the wait queue was full
+    rejected: int = 0
+    # Runs rejected because they waited longer than the timeout
+    timed_out: int = 0
+    # Total and maximum seconds admitted runs waited for a slot
+    wait_seconds_total: float = 0.0
+    wait_seconds_max: float = 0.0
+
+
+class AdmissionTicket:
+    """A slot held by an admitted run. Release it once the run, including any stream, has finished.
+
+    Releasing is idempotent. Streaming runs also release it in the background task of their response, which runs
+    even when the stream never started.
+    """
+
+    def __init__(self, limiter: "ModelLimiter"):
+        self._limiter = limiter
+        self._started_at = time.monotonic()
+        self._released = False
+
+    def release(self) -> None:
+        if self._released:
+            return
+        self._released = True
+        self._limiter.release(time.monotonic() - self._started_at)
+
+
+class ModelLimiter:
+    """Limits the in-flight runs of a single model, with a bounded FIFO queue of waiting runs."""
+
+    def __init__(self, model_id: str, max_in_flight: int, max_queued: int, timeout: float):
+        self.model_id = model_id
+        self.max_in_flight = max_in_flight
+        self.max_queued = max_queued
+        self.timeout = timeout
+
+        self.stats = AdmissionStats()
+        self._waiters: Deque[asyncio.Future] = deque()
+        # Moving average of run durations, used to estimate Retry-After
+        self._average_run_seconds: float = 1.0
+
+    def retry_after(self) -> int:
+        """Seconds until a slot is likely to be free for a new run."""
+        runs_ahead = len(self._waiters) + 1
+        return max(1, math.ceil(self._average_run_seconds * runs_ahead / self.max_in_flight))
+
+    async def acquire(self) -> AdmissionTicket:
+        if self.stats.in_flight < self.max_in_flight and not self._waiters:
+            self.stats.in_flight += 1
+            self.stats.admitted += 1
+            return AdmissionTicket(self)
+
+        if len(self._waiters) >= self.max_queued:
+            self.stats.rejected += 1
+            raise AdmissionRejected(f"Too many queued runs for model {self.model_id}", self.retry_after())
+
+        waiter: asyncio.Future = asyncio.get_running_loop().create_future()
+        self._waiters.append(waiter)
+        self.stats.queue_depth = len(self._waiters)
+        start = time.monotonic()
+        try:
+            await asyncio.wait_for(asyncio.shield(waiter), timeout=self.timeout)
+        except asyncio.TimeoutError:
+            # The slot may have been handed to this run just as the wait timed out
+            if not waiter.done():
+                self._abandon(waiter)
+                self.stats.timed_out += 1
+                raise AdmissionRejected(
+                    f"Timed out waiting for a run slot for model {self.model_id}", self.retry_after()
+                )
+        except BaseException:
+            # The request was cancelled while waiting, give back the slot if it was already handed over
+            if waiter.done():
+                self.release(0)
+            else:
+                self._abandon(waiter)
+            raise
+
+        wait_seconds = time.monotonic() - start
+        self.stats.admitted += 1
+        self.stats.wait_seconds_total += wait_seconds
+        self.stats.wait_seconds_max = max(self.stats.wait_seconds_max, wait_seconds)
+        return AdmissionTicket(self)
+
+    def _abandon(self, waiter: asyncio.Future) -> None:
+        waiter.cancel()
+        self._waiters.remove(waiter)
+        self.stats.queue_depth = len(self._waiters)
+
+    def release(self, run_seconds: float) -> None:
+        if run_seconds > 0:
+            self._average_run_seconds = 0.9 * self._average_run_seconds + 0.1 * run_seconds
+        # Hand the slot to the next waiting run, otherwise free it
+        while self._waiters:
+            waiter = self._waiters.popleft()
+            if not waiter.done():
+                waiter.set_result(True)
+                self.stats.queue_depth = len(self._waiters)
+                return
+        self.stats.in_flight -= 1
+        self.stats.queue_depth = 0
+
+
+class AdmissionController:
+    """Admits agent runs with a separate in-flight limit and wait queue per model.
+
+    Runs wait in FIFO order for a slot. When a model's queue is full, or a run waits longer than the timeout,
+    the run is rejected with AdmissionRejected, which carries an estimated Retry-After.
+    """
+
+    def __init__(
+        self,
+        max_in_flight: Dict[str, int],
+        default_max_in_flight: int,
+        max_queued: int,
+        timeout: float,
+    ):
+        self.max_in_flight = max_in_flight
+        self.default_max_in_flight = default_max_in_flight
+        self.max_queued = max_queued
+        self.timeout = timeout
+        self._limiters: Dict[str, ModelLimiter] = {}
+
+    def get_limiter(self, model_id: str) -> ModelLimiter:
+        limiter: Optional[ModelLimiter] = self._limiters.get(model_id)
+        if limiter is None:
+            limiter = ModelLimiter(
+                model_id=model_id,
+                max_in_flight=self.max_in_flight.get(model_id, self.default_max_in_flight),
+                max_queued=self.max_queued,
+                timeout=self.timeout,
+            )
+            self._limiters[model_id] = limiter
+        return limiter
+
+    async def acquire(self, model_id: str) -> AdmissionTicket:
+        """Waits for a run slot for the model."""
+        try:
+            return await self.get_limiter(model_id).acquire()
+        except AdmissionRejected as e:
+            logger.warning(f"Run rejected: {e}")
+            raise
+
+    def stats(self) -> Dict[str, AdmissionStats]:
+        """Returns a snapshot of the counters for each model."""
+        return {model_id: AdmissionStats(**asdict(limiter.stats)) for model_id, limiter in self._limiters.items()}
+
+
+# Admission controller shared by all agent runs in this process
+run_admission = AdmissionController(
+    max_in_flight=api_settings.max_in_flight_runs,
+    default_max_in_flight=api_settings.default_max_in_flight_runs,
+    max_queued=api_settings.max_queued_runs,
+    timeout=api_settings.admission_timeout,
+)
@@ -0,0 +1,129 @@
+import asyncio
+from dataclasses import asdict, dataclass
+from threading import Lock
+from typing import Any, Dict, Optional
+
+from agno.agent import Agent
+from agno.memory.agent import AgentMemory, AgentRun
+from agno.run.response import RunEvent
+from fastapi import Request
+
+from utils.log import logger
+
+######################################################
+## Cancelling agent runs when the client disconnects
+######################################################
+
+
+@dataclass
+class RunTokenStats:
+    """Token counters used to size the savings from cancelling runs on disconnect"""
+
+    # Runs that streamed to completion
+    completed_runs: int = 0
+    # Runs cancelled because the client disconnected
+    cancelled_runs: int = 0
+    # Tokens used by completed runs
+    completed_tokens: int = 0
+    # Tokens used by cancelled runs before they were cancelled
+    wasted_tokens: int = 0
+    # Estimated tokens not spent because runs were cancelled, based on the average completed run
+    saved_tokens: int = 0
+
+
+class RunTokenCounter:
+    """Counts tokens spent by completed and cancelled runs."""
+
+    def __init__(self):
+        self._stats = RunTokenStats()
+        self._lock = Lock()
+
+    def record_completed(self, total_tokens: int) -> None:
+        with self._lock:
+            self._stats.completed_runs += 1
+            self._stats.completed_tokens += total_tokens
+
+    def record_cancelled(self, wasted_tokens: int) -> None:
+        with self._lock:
+            self._stats.cancelled_runs += 1
+            self._stats.wasted_tokens += wasted_tokens
+            if self._stats.completed_runs > 0:
+                average_run_tokens = self._stats.completed_tokens // self._stats.completed_runs
+                self._stats.saved_tokens += max(average_run_tokens - wasted_tokens, 0)
+
+    def stats(self) -> RunTokenStats:
+        """Returns a snapshot of the counters."""
+        with self._lock:
+            return RunTokenStats(**asdict(self._stats))
+
+
+# Token counters shared by all streaming runs in this process
+run_token_counter = RunTokenCounter()
+
+
+def get_run_tokens(agent: Agent) -> int:
+    """Returns the tokens used by the agent's current run.
+
+    Model calls that completed (eg: before a tool call) report their usage on the assistant messages. Streamed
+    content has no usage until the model call completes, so it is estimated at ~4 characters per token.
+    """
+    total_tokens = 0
+    if agent.run_messages is not None:
+        for message in agent.run_messages.messages:
+            if message.role == "assistant" and message.metrics is not None:
+                total_tokens += message.metrics.total_tokens
+
+    if agent.run_response is not None and isinstance(agent.run_response.content, str):
+        total_tokens += len(agent.run_response.content) // 4
+    return total_tokens
+
+
+def record_completed_run(agent: Agent) -> None:
+    """Adds the tokens used by a completed run to the counters."""
+    metrics: Dict[str, Any] = (agent.run_response.metrics or {}) if agent.run_response is not None else {}
+    total_tokens = metrics.get("total_tokens")
+    run_token_counter.record_completed(sum(total_tokens) if isinstance(total_tokens, list) else get_run_tokens(agent))
+
+
+def persist_cancelled_run(agent: Agent, session_id: Optional[str] = None, user_id: Optional[str] = None) -> None:
+    """Saves the partial response of a cancelled run to storage and records the tokens it used.
+
+    The run is added to memory without messages, so it is kept in the session but not sent to the model as history.
+    The storage write blocks, call it in a thread from async code.
+    """
+    run_token_counter.record_cancelled(get_run_tokens(agent))
+
+    # The run was cancelled before the session was read from storage, so there is nothing to save
+    run_response = agent.run_response
+    if run_response is None or agent.run_messages is None:
+        return
+    run_response.event = RunEvent.run_cancelled.value
+    session_id = session_id or run_response.session_id or agent.session_id
+    if session_id is None:
+        return
+
+    try:
+        if isinstance(agent.memory, AgentMemory):
+            user_message = agent.run_messages.user_message if agent.run_messages is not None else None
+            agent.memory.add_run(AgentRun(message=user_message, response=run_response))
+        agent.write_to_storage(session_id=session_id, user_id=user_id or agent.user_id)
+        logger.info(f"Run {run_response.run_id} cancelled, saved partial response for session {session_id}")
+    except Exception as e:
+        logger.warning(f"Could not save cancelled run {run_response.run_id}: {e}")
+
+
+async def close_run_stream(run_stream: Any) -> None:
+    """Closes the async generator of a streaming run, which closes the model stream it is reading from."""
+    try:
+        await run_stream.aclose()
+    except RuntimeError:
+        # The generator is still running a cancelled step, which closes it once the cancellation is delivered
+        pass
+    except Exception as e:
+        logger.debug(f"Error closing run stream: {e}")
+
+
+async def wait_for_disconnect(request: Request, poll_interval: float = 0.5) -> None:
+    """Returns once the client of the request has disconnected."""
+    while not await request.is_disconnected():
+        await asyncio.sleep(poll_interval)
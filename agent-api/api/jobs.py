@@ -0,0 +1,426 @@
+import asyncio
+from datetime import datetime, timedelta, timezone
+from enum import Enum
+from typing import Any, Dict, List, Optional, Tuple
+from uuid import uuid4
+
+import anyio
+from fastapi.encoders import jsonable_encoder
+from sqlalchemy import select, update
+
+from agents.operator import AgentType, get_agent, release_agent
+from api.admission import AdmissionRejected, AdmissionTicket, run_admission
+from api.metrics import JOBS_RUNNING, record_run_metrics
+from api.session_locks import SessionBusy, SessionLockTicket, lock_session
+from api.settings import api_settings
+from api.streaming import RunEventMapper, SseEvent
+from db.session import AsyncSessionLocal
+from db.tables import Job, JobEvent
+from teams.operator import TeamType, get_team
+from utils.log import logger
+from workflows.operator import WorkflowType, get_workflow
+
+######################################################
+## Jobs for long agent, team and workflow runs
+######################################################
+
+
+class JobKind(str, Enum):
+    agent = "agent"
+    team = "team"
+    workflow = "workflow"
+
+
+class JobStatus(str, Enum):
+    queued = "queued"
+    running = "running"
+    succeeded = "succeeded"
+    failed = "failed"
+
+
+class JobEventType:
+    """Job events sent in addition to the run events in `SseEvent`"""
+
+    # The last event of a job, with its final status
+    job_finished = "job_finished"
+
+
+def get_job_payload(job: Job) -> Dict[str, Any]:
+    """Returns the fields of a job that are sent to the client."""
+    return {
+        "job_id": job.id,
+        "kind": job.kind,
+        "target_id": job.target_id,
+        "status": job.status,
+        "result": job.result,
+        "error": job.error,
+        "created_at": job.created_at,
+        "started_at": job.started_at,
+        "finished_at": job.finished_at,
+    }
+
+
+async def create_job(kind: JobKind, target_id: str, job_input: Dict[str, Any]) -> Dict[str, Any]:
+    """Saves a new queued job."""
+    async with AsyncSessionLocal() as db:
+        job = Job(id=str(uuid4()), kind=kind.value, target_id=target_id, status=JobStatus.queued.value, input=job_input)
+        db.add(job)
+        await db.commit()
+        await db.refresh(job)
+        return get_job_payload(job)
+
+
+async def get_job(job_id: str) -> Optional[Dict[str, Any]]:
+    async with AsyncSessionLocal() as db:
+        job = await db.get(Job, job_id)
+        return get_job_payload(job) if job is not None else None
+
+
+async def get_job_events(job_id: str, offset: int = 0, limit: int = 500) -> List[Dict[str, Any]]:
+    """Returns the events of a job starting at the `offset` sequence number."""
+    async with AsyncSessionLocal() as db:
+        events = await db.scalars(
+            select(JobEvent)
+            .where(JobEvent.job_id == job_id, JobEvent.seq >= offset)
+            .order_by(JobEvent.seq)
+            .limit(limit)
+        )
+        return [{"seq": e.seq, "event": e.event, "data": e.data} for e in events]
+
+
+async def claim_job() -> Optional[Tuple[str, str, str, Dict[str, Any]]]:
+    """Marks the oldest queued job as running and returns its (id, kind, target_id, input).
+
+    Queued jobs locked by another worker are skipped, so workers in any number of processes can claim jobs.
+    """
+    async with AsyncSessionLocal() as db:
+        job = (
+            await db.scalars(
+                select(Job)
+                .where(Job.status == JobStatus.queued.value)
+                .order_by(Job.created_at)
+                .limit(1)
+                .with_for_update(skip_locked=True)
+            )
+        ).first()
+        if job is None:
+            return None
+        now = datetime.now(timezone.utc)
+        job.status = JobStatus.running.value
+        job.started_at = now
+        job.updated_at = now
+        claimed = (job.id, job.kind, job.target_id, dict(job.input))
+        await db.commit()
+        return claimed
+
+
+async def append_job_events(job_id: str, events: List[Tuple[int, str, Any]]) -> None:
+    """Adds (seq, event, data) events to the log of a job and marks the job as alive."""
+    async with AsyncSessionLocal() as db:
+        db.add_all(JobEvent(job_id=job_id, seq=seq, event=event, data=data) for seq, event, data in events)
+        await db.execute(update(Job).where(Job.id == job_id).values(updated_at=datetime.now(timezone.utc)))
+        await db.commit()
+
+
+async def finish_job(job_id: str, status: JobStatus, result: Any = None, error: Optional[str] = None) -> None:
+    async with AsyncSessionLocal() as db:
+        now = datetime.now(timezone.utc)
+        await db.execute(
+            update(Job)
+            .where(Job.id == job_id)
+            .values(status=status.value, result=result, error=error, updated_at=now, finished_at=now)
+        )
+        await db.commit()
+
+
+async def fail_stale_jobs(stale_seconds: float) -> int:
+    """Fails running jobs that were not updated for `stale_seconds`, eg: because their process was stopped."""
+    async with AsyncSessionLocal() as db:
+        now = datetime.now(timezone.utc)
+        stale = await db.execute(
+            update(Job)
+            .where(Job.status == JobStatus.running.value, Job.updated_at < now - timedelta(seconds=stale_seconds))
+            .values(status=JobStatus.failed.value, error="Job worker stopped", updated_at=now, finished_at=now)
+        )
+        await db.commit()
+        return stale.rowcount
+
+
+class JobEventWriter:
+    """Buffers the events of a running job and appends them to its event log in batches.
+
+    Consecutive content deltas are merged into one event, so the log stays small for long streamed responses.
+    Buffered events are written every `flush_interval` seconds, which also marks the job as alive.
+    """
+
+    def __init__(self, job_id: str, flush_interval: float = 0.5):
+        self.job_id = job_id
+        self.flush_interval = flush_interval
+
+        self._next_seq: int = 0
+        self._pending: List[Tuple[str, Any]] = []
+        self._flush_task: Optional[asyncio.Task] = None
+
+    def add(self, event: str, data: Any) -> None:
+        data = jsonable_encoder(data)
+        if event == SseEvent.content_delta and self._pending:
+            last_event, last_data = self._pending[-1]
+            if (
+                last_event == SseEvent.content_delta
+                and isinstance(last_data["content"], str)
+                and isinstance(data["content"], str)
+            ):
+                self._pending[-1] = (last_event, {"content": last_data["content"] + data["content"]})
+                return
+        self._pending.append((event, data))
+
+    async def flush(self) -> None:
+        events = [(self._next_seq + i, event, data) for i, (event, data) in enumerate(self._pending)]
+        self._pending = []
+        self._next_seq += len(events)
+        await append_job_events(self.job_id, events)
+        if events:
+            job_worker_pool.notify()
+
+    async def _flush_periodically(self) -> None:
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            try:
+                await self.flush()
+            except Exception as e:
+                logger.warning(f"Could not write events for job {self.job_id}: {e}")
+
+    def start(self) -> None:
+        self._flush_task = asyncio.create_task(self._flush_periodically())
+
+    async def close(self) -> None:
+        """Stops the periodic flush and writes the remaining events."""
+        if self._flush_task is not None:
+            self._flush_task.cancel()
+            try:
+                await self._flush_task
+            except asyncio.CancelledError:
+                pass
+        await self.flush()
+
+
+async def acquire_run_slot(model_id: str) -> AdmissionTicket:
+    """Waits for a run slot for the model. Jobs are not rejected when the model is busy, they retry later."""
+    while True:
+        try:
+            return await run_admission.acquire(model_id)
+        except AdmissionRejected as e:
+            await asyncio.sleep(e.retry_after)
+
+
+async def acquire_session_lock(session_id: Optional[str]) -> Optional[SessionLockTicket]:
+    """Waits for the lock of the session of a run. Jobs are not rejected when the session is busy, they retry later."""
+    while True:
+        try:
+            return await lock_session(session_id)
+        except SessionBusy as e:
+            await asyncio.sleep(e.retry_after)
+
+
+async def run_agent_job(writer: JobEventWriter, agent_id: str, job_input: Dict[str, Any]) -> Any:
+    model_id: str = job_input.get("model") or "gpt-4o"
+    session_ticket = await acquire_session_lock(job_input.get("session_id"))
+    try:
+        ticket = await acquire_run_slot(model_id)
+        try:
+            agent = get_agent(
+                model_id=model_id,
+                agent_id=AgentType(agent_id),
+                user_id=job_input.get("user_id"),
+                session_id=job_input.get("session_id"),
+                debug_mode=False,
+            )
+            failed = True
+            try:
+                mapper = RunEventMapper()
+                run_response = await agent.arun(job_input["message"], stream=True, stream_intermediate_steps=True)
+                async for chunk in run_response:
+                    for event, data in mapper.map(chunk):
+                        writer.add(event, data)
+                failed = False
+                record_run_metrics(agent.run_response, agent_id=agent_id, model=model_id, streamed=True)
+                return agent.run_response.content if agent.run_response is not None else None
+            finally:
+                release_agent(agent, failed=failed)
+        finally:
+            ticket.release()
+    finally:
+        if session_ticket is not None:
+            session_ticket.release()
+
+
+async def run_team_job(writer: JobEventWriter, team_id: str, job_input: Dict[str, Any]) -> Any:
+    team = get_team(TeamType(team_id))
+    mapper = RunEventMapper()
+    run_response = await team.arun(
+        job_input["message"],
+        stream=True,
+        stream_intermediate_steps=True,
+        user_id=job_input.get("user_id"),
+        session_id=job_input.get("session_id"),
+    )
+    async for chunk in run_response:  # type: ignore
+        for event, data in mapper.map(chunk):
+            writer.add(event, data)
+    return team.run_response.content if team.run_response is not None else None
+
+
+async def run_workflow_job(writer: JobEventWriter, workflow_id: str, job_input: Dict[str, Any]) -> Any:
+    workflow = get_workflow(WorkflowType(workflow_id))
+    workflow.user_id = job_input.get("user_id")
+    if job_input.get("session_id"):
+        workflow.session_id = job_input["session_id"]
+
+    # Workflows run synchronously, so they run in a thread and their stream is read one chunk at a time
+    mapper = RunEventMapper()
+    result = await asyncio.to_thread(workflow.run, **(job_input.get("input") or {}))
+    if result is not None and not hasattr(result, "event"):
+        while True:
+            chunk = await asyncio.to_thread(next, result, None)
+            if chunk is None:
+                break
+            for event, data in mapper.map(chunk):
+                writer.add(event, data)
+    elif result is not None:
+        for event, data in mapper.map(result):
+            writer.add(event, data)
+    return workflow.run_response.content if workflow.run_response is not None else None
+
+
+async def run_job(job_id: str, kind: str, target_id: str, job_input: Dict[str, Any]) -> None:
+    """Runs a claimed job, writing its events to the event log and its result to the jobs table."""
+    logger.info(f"Running job {job_id}: {kind} {target_id}")
+    writer = JobEventWriter(job_id, flush_interval=api_settings.job_event_flush_interval)
+    writer.start()
+    JOBS_RUNNING.labels(kind).inc()
+    status, result, error = JobStatus.failed, None, None
+    try:
+        if kind == JobKind.agent.value:
+            result = await run_agent_job(writer, target_id, job_input)
+        elif kind == JobKind.team.value:
+            result = await run_team_job(writer, target_id, job_input)
+        else:
+            result = await run_workflow_job(writer, target_id, job_input)
+        status = JobStatus.succeeded
+    except Exception as e:
+        logger.error(f"Job {job_id} failed: {e}")
+        error = str(e)
+        writer.add(SseEvent.error, {"message": error, "type": type(e).__name__})
+    except BaseException:
+        # The worker is stopping
+        error = "Job cancelled"
+        raise
+    finally:
+        # Shield the final writes from the cancellation of the worker
+        with anyio.CancelScope(shield=True):
+            writer.add(JobEventType.job_finished, {"status": status.value, "error": error})
+            try:
+                await writer.close()
+                await finish_job(job_id, status, jsonable_encoder(result), error)
+            except Exception as e:
+                logger.error(f"Could not save the result of job {job_id}: {e}")
+            job_worker_pool.notify()
+        JOBS_RUNNING.labels(kind).dec()
+
+
+class JobWorkerPool:
+    """Runs queued jobs on a fixed number of asyncio workers in this process.
+
+    Workers claim jobs from the jobs table, so a job submitted to any process can be run by any other. Workers are
+    woken up when a job is submitted in this process and poll the table every `poll_interval` seconds otherwise.
+    Every `stale_seconds`, running jobs not updated for `stale_seconds` are failed, as their process stopped.
+    """
+
+    def __init__(self, workers: int = 4, poll_interval: float = 1.0, stale_seconds: float = 300):
+        self.workers = workers
+        self.poll_interval = poll_interval
+        self.stale_seconds = stale_seconds
+
+        self._tasks: List[asyncio.Task] = []
+        self._job_submitted: Optional[asyncio.Event] = None
+        # Replaced on every notify(), so waiters only see updates after they started waiting
+        self._job_updated: Optional[asyncio.Event] = None
+
+    async def start(self) -> None:
+        self._job_submitted = asyncio.Event()
+        self._job_updated = asyncio.Event()
+        if self.workers == 0:
+            return
+        await self._fail_stale_jobs()
+        self._tasks = [asyncio.create_task(self._work()) for _ in range(self.workers)]
+        self._tasks.append(asyncio.create_task(self._fail_stale_jobs_periodically()))
+
+    async def stop(self) -> None:
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+    async def submit(self, kind: JobKind, target_id: str, job_input: Dict[str, Any]) -> Dict[str, Any]:
+        """Queues a job and wakes up a worker."""
+        job = await create_job(kind, target_id, job_input)
+        if self._job_submitted is not None:
+            self._job_submitted.set()
+        return job
+
+    def notify(self) -> None:
+        """Wakes up everything waiting for a job update in this process."""
+        if self._job_updated is not None:
+            self._job_updated.set()
+            self._job_updated = asyncio.Event()
+
+    async def wait_for_update(self, timeout: float) -> None:
+        """Waits until a job in this process is updated, or for `timeout` seconds."""
+        if self._job_updated is None:
+            await asyncio.sleep(timeout)
+            return
+        try:
+            await asyncio.wait_for(self._job_updated.wait(), timeout=timeout)
+        except asyncio.TimeoutError:
+            pass
+
+    async def _fail_stale_jobs(self) -> None:
+        try:
+            stale_jobs = await fail_stale_jobs(self.stale_seconds)
+            if stale_jobs:
+                logger.warning(f"Failed {stale_jobs} jobs of stopped workers")
+        except Exception as e:
+            logger.warning(f"Could not check for stale jobs: {e}")
+
+    async def _fail_stale_jobs_periodically(self) -> None:
+        """Fails the jobs left running by the workers of other processes that stopped, while this process runs."""
+        while True:
+            await asyncio.sleep(max(self.stale_seconds, self.poll_interval))
+            await self._fail_stale_jobs()
+
+    async def _work(self) -> None:
+        while True:
+            try:
+                claimed = await claim_job()
+            except Exception as e:
+                logger.warning(f"Could not claim a job: {e}")
+                claimed = None
+
+            if claimed is None:
+                assert self._job_submitted is not None
+                try:
+                    await asyncio.wait_for(self._job_submitted.wait(), timeout=self.poll_interval)
+                except asyncio.TimeoutError:
+                    pass
+                self._job_submitted.clear()
+                continue
+
+            await run_job(*claimed)
+
+
+# Job workers shared by all requests in this process
+job_worker_pool = JobWorkerPool(
+    workers=api_settings.job_workers,
+    poll_interval=api_settings.job_poll_interval,
+    stale_seconds=api_settings.job_stale_seconds,
+)
@@ -1,8 +1,32 @@
+import asyncio
+from contextlib import asynccontextmanager
+
 from fastapi import FastAPI
 from starlette.middleware.cors import CORSMiddleware
 
+from api.jobs import job_worker_pool
+from api.metrics import MetricsMiddleware
+from api.routes.metrics import metrics_router
 from api.routes.v1_router import v1_router
 from api.settings import api_settings
+from db.partitions import create_future_partitions
+from db.session import db_engine
+from db.settings import db_settings
+from db.storage import session_write_queue
+from utils.log import logger
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """Creates upcoming session partitions and starts the job workers, on shutdown stops them and writes sessions"""
+    try:
+        await asyncio.to_thread(create_future_partitions, db_engine, db_settings.session_partition_months_ahead)
+    except Exception as e:
+        logger.warning(f"Could not create session table partitions: {e}")
+    await job_worker_pool.start()
+    yield
+    await job_worker_pool.stop()
+    await asyncio.to_thread(session_write_queue.stop)
 
 
 def create_app() -> FastAPI:
@@ -15,11 +39,16 @@ def create_app() -> FastAPI:
         docs_url="/docs" if api_settings.docs_enabled else None,
         redoc_url="/redoc" if api_settings.docs_enabled else None,
         openapi_url="/openapi.json" if api_settings.docs_enabled else None,
+        lifespan=lifespan,
     )
 
     # Add v1 router
     app.include_router(v1_router)
 
+    # Add the Prometheus metrics endpoint at /metrics
+    if api_settings.metrics_enabled:
+        app.include_router(metrics_router)
+
     # Add Middlewares
     app.add_middleware(
         CORSMiddleware,
@@ -28,6 +57,8 @@ def create_app() -> FastAPI:
         allow_methods=["*"],
         allow_headers=["*"],
     )
+    if api_settings.metrics_enabled:
+        app.add_middleware(MetricsMiddleware)
 
     return app
 
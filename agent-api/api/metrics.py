@@ -0,0 +1,226 @@
+import time
+from dataclasses import asdict
+from typing import Any, Dict, Iterator, List, Optional, Set
+
+from prometheus_client import Gauge, Histogram
+from prometheus_client.core import REGISTRY, CounterMetricFamily, GaugeMetricFamily
+from prometheus_client.registry import Collector
+from sqlalchemy.engine import Engine
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+from agents.operator import agent_pool, get_available_agents
+from api.admission import run_admission
+from api.cancellation import run_token_counter
+from api.response_cache import response_cache
+from api.session_locks import session_locks
+from db.embedding_cache import embedding_cache
+from db.knowledge import hybrid_search_cache
+from db.session import db_async_engine, db_engine, get_db_pool_stats
+from db.session_cache import session_cache
+from db.storage import session_write_queue
+from utils.log import logger
+
+######################################################
+## Prometheus metrics
+######################################################
+
+# Labels are limited to values from a known set: route templates, agent ids, model ids and tool names.
+# Values from the request, like session ids or unknown agent ids, are never used as labels.
+
+REQUEST_DURATION = Histogram(
+    "agent_api_request_duration_seconds",
+    "Time to send the complete response, including streamed responses",
+    ["method", "route", "agent_id", "status_code"],
+)
+TIME_TO_FIRST_TOKEN = Histogram(
+    "agent_api_stream_time_to_first_token_seconds",
+    "Time from the start of a model call to its first streamed token",
+    ["agent_id", "model"],
+    buckets=(0.1, 0.25, 0.5, 0.75, 1, 1.5, 2, 3, 5, 10, 20),
+)
+TOKENS_PER_SECOND = Histogram(
+    "agent_api_stream_tokens_per_second",
+    "Output tokens per second of streamed model calls, after the first token",
+    ["agent_id", "model"],
+    buckets=(5, 10, 20, 30, 40, 50, 75, 100, 150, 200, 300),
+)
+TOOL_CALL_DURATION = Histogram(
+    "agent_api_tool_call_duration_seconds",
+    "Time to run a tool call",
+    ["tool_name"],
+    buckets=(0.01, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60),
+)
+DB_POOL_CHECKOUT_WAIT = Histogram(
+    "agent_api_db_pool_checkout_wait_seconds",
+    "Time to check out a connection from a database connection pool, including connecting",
+    ["pool"],
+    buckets=(0.0005, 0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 5, 30),
+)
+JOBS_RUNNING = Gauge("agent_api_jobs_running", "Jobs currently running in this process", ["kind"])
+
+
+def get_agent_label(agent_id: Optional[str]) -> str:
+    """Returns the agent_id label, with unknown agent ids grouped as "other"."""
+    if not agent_id:
+        return ""
+    return agent_id if agent_id in get_available_agents() else "other"
+
+
+def get_metric_values(metrics: Optional[Dict[str, Any]], name: str) -> List[float]:
+    """Returns the per model call values of a RunResponse metric."""
+    values = (metrics or {}).get(name) or []
+    return [v for v in (values if isinstance(values, list) else [values]) if isinstance(v, (int, float))]
+
+
+def record_run_metrics(run_response: Any, agent_id: Optional[str], model: Optional[str], streamed: bool) -> None:
+    """Records the tool call latency and, for streamed runs, the time to first token and tokens/sec of a run."""
+    if run_response is None:
+        return
+    agent_label, model_label = get_agent_label(agent_id), model or ""
+
+    for tool in run_response.tools or []:
+        tool_metrics = tool.get("metrics")
+        tool_seconds = (
+            tool_metrics.get("time") if isinstance(tool_metrics, dict) else getattr(tool_metrics, "time", None)
+        )
+        if tool.get("tool_name") and tool_seconds is not None:
+            TOOL_CALL_DURATION.labels(tool["tool_name"]).observe(tool_seconds)
+
+    if not streamed:
+        return
+    for ttft in get_metric_values(run_response.metrics, "time_to_first_token"):
+        TIME_TO_FIRST_TOKEN.labels(agent_label, model_label).observe(ttft)
+    output_tokens = sum(get_metric_values(run_response.metrics, "output_tokens"))
+    generation_seconds = sum(get_metric_values(run_response.metrics, "time")) - sum(
+        get_metric_values(run_response.metrics, "time_to_first_token")
+    )
+    if output_tokens > 0 and generation_seconds > 0:
+        TOKENS_PER_SECOND.labels(agent_label, model_label).observe(output_tokens / generation_seconds)
+
+
+def instrument_engine_pool(engine: Engine, pool_name: str) -> None:
+    """Times connection checkouts from the connection pool of an engine.
+
+    SQLAlchemy has no event for the start of a checkout, its checkout event fires once a connection was handed
+    out, so the pool's private checkout method is wrapped. Pools without it are left as they are, with a warning.
+    """
+    pool: Any = engine.pool
+    do_get = getattr(pool, "_do_get", None)
+    if not callable(do_get):
+        logger.warning(f"Not timing connection checkouts of the {pool_name} pool, {type(pool).__name__} has no _do_get")
+        return
+
+    def timed_do_get():
+        start = time.perf_counter()
+        try:
+            return do_get()
+        finally:
+            DB_POOL_CHECKOUT_WAIT.labels(pool_name).observe(time.perf_counter() - start)
+
+    pool._do_get = timed_do_get
+
+
+class StatsCollector(Collector):
+    """Exposes the counters kept by the agent pool, admission control, token counter, caches, db pools and queues.
+
+    The counters are read when metrics are scraped, so the request path does not pay for them.
+    """
+
+    # Fields of the stats snapshots that are gauges, all other fields are counters
+    gauge_fields: Set[str] = {
+        "in_use",
+        "idle",
+        "in_flight",
+        "queue_depth",
+        "wait_seconds_max",
+        "memory_entries",
+        "size",
+        "checked_out",
+        "checked_in",
+        "overflow",
+        "pending",
+        "entries",
+        "bytes",
+        "hit_ratio",
+        "held",
+        "waiting",
+    }
+
+    def get_families(self, prefix: str, stats: Any, labels: Optional[Dict[str, str]] = None) -> Iterator[Any]:
+        label_names = list(labels or {})
+        label_values = list((labels or {}).values())
+        for field, value in asdict(stats).items():
+            name = f"agent_api_{prefix}_{field}"
+            documentation = f"{prefix.replace('_', ' ').capitalize()} {field.replace('_', ' ')}"
+            if field in self.gauge_fields:
+                family: Any = GaugeMetricFamily(name, documentation, labels=label_names)
+            else:
+                family = CounterMetricFamily(name, documentation, labels=label_names)
+            family.add_metric(label_values, value)
+            yield family
+
+    def get_labeled_families(self, prefix: str, stats_by_label: Dict[str, Any], label: str) -> Iterator[Any]:
+        """Yields one family per stats field, with a sample for each label value."""
+        families: Dict[str, Any] = {}
+        for label_value, stats in stats_by_label.items():
+            for family in self.get_families(prefix, stats, {label: label_value}):
+                if family.name in families:
+                    families[family.name].samples.extend(family.samples)
+                else:
+                    families[family.name] = family
+        yield from families.values()
+
+    def collect(self) -> Iterator[Any]:
+        yield from self.get_families("agent_pool", agent_pool.stats())
+        yield from self.get_families("run_tokens", run_token_counter.stats())
+        yield from self.get_families("response_cache", response_cache.stats())
+        yield from self.get_families("session_writes", session_write_queue.stats())
+        yield from self.get_families("session_cache", session_cache.stats())
+        yield from self.get_families("session_locks", session_locks.stats())
+        yield from self.get_families("embedding_cache", embedding_cache.stats())
+        yield from self.get_families("knowledge_search", hybrid_search_cache.stats())
+
+        # Admission counters are per model and pool stats per pool, so metrics with the same name are merged
+        yield from self.get_labeled_families("admission", run_admission.stats(), "model")
+        yield from self.get_labeled_families("db_pool", get_db_pool_stats(), "pool")
+
+
+class MetricsMiddleware:
+    """Records the duration of each request, per route template and agent_id.
+
+    Streaming responses are timed until their last chunk is sent. Requests that match no route are labeled
+    "unmatched", so scanning for unknown paths does not create new label values.
+    """
+
+    def __init__(self, app: ASGIApp):
+        self.app = app
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        start = time.perf_counter()
+        status_code = 500
+
+        async def send_wrapper(message: Message) -> None:
+            nonlocal status_code
+            if message["type"] == "http.response.start":
+                status_code = message["status"]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            route = scope.get("route")
+            REQUEST_DURATION.labels(
+                scope["method"],
+                getattr(route, "path", "unmatched"),
+                get_agent_label(scope.get("path_params", {}).get("agent_id")),
+                str(status_code),
+            ).observe(time.perf_counter() - start)
+
+
+instrument_engine_pool(db_engine, "db")
+instrument_engine_pool(db_async_engine.sync_engine, "db_async")
+REGISTRY.register(StatsCollector())
@@ -0,0 +1,254 @@
+import hashlib
+import json
+import time
+import unicodedata
+from collections import OrderedDict
+from dataclasses import asdict, dataclass
+from datetime import datetime, timedelta, timezone
+from threading import Lock
+from typing import Any, Optional, Tuple
+
+from sqlalchemy import delete, func, select
+from sqlalchemy.dialects.postgresql import insert
+
+from api.settings import api_settings
+from db.session import AsyncSessionLocal
+from db.tables import ResponseCacheEntry
+from utils.log import logger
+
+######################################################
+## Response cache for non-streaming agent runs
+######################################################
+
+
+@dataclass
+class ResponseCacheStats:
+    """Counters for the response cache"""
+
+    # Lookups served from the in-memory tier
+    memory_hits: int = 0
+    # Lookups served from the Postgres tier
+    db_hits: int = 0
+    # Lookups that found no fresh entry
+    misses: int = 0
+    # Responses added to the cache
+    writes: int = 0
+    # In-memory entries dropped because of the size limit
+    evictions: int = 0
+    # In-memory entries dropped because they expired
+    expired: int = 0
+    # Postgres reads or writes that failed, which are treated as misses
+    errors: int = 0
+    # Entries currently in memory
+    memory_entries: int = 0
+
+
+@dataclass
+class CacheControl:
+    """Cache directives from the Cache-Control header of a run request"""
+
+    # Do not serve a cached response, but cache the new one
+    no_cache: bool = False
+    # Do not cache the new response
+    no_store: bool = False
+    # Only serve cached responses younger than this many seconds
+    max_age: Optional[int] = None
+    # Only serve a cached response, never run the agent
+    only_if_cached: bool = False
+
+
+def parse_cache_control(header: Optional[str]) -> CacheControl:
+    """Parses the directives of a Cache-Control request header. Unknown directives are ignored."""
+    cache_control = CacheControl()
+    if not header:
+        return cache_control
+    for directive in header.lower().split(","):
+        name, _, value = directive.strip().partition("=")
+        if name == "no-cache":
+            cache_control.no_cache = True
+        elif name == "no-store":
+            cache_control.no_store = True
+        elif name == "only-if-cached":
+            cache_control.only_if_cached = True
+        elif name == "max-age" and value.strip().strip('"').isdigit():
+            cache_control.max_age = int(value.strip().strip('"'))
+    return cache_control
+
+
+def normalize_message(message: str) -> str:
+    """Normalizes unicode and whitespace, so messages that differ only in formatting share a cache entry."""
+    return " ".join(unicodedata.normalize("NFKC", message).split())
+
+
+def get_cache_key(
+    agent_id: str, model_id: str, instructions_version: str, message: str, user_id: Optional[str] = None
+) -> str:
+    """Returns the cache key of a run.
+
+    The user is part of the key, since agents add the context of the user to their prompt, so a response is only
+    served to the user it was generated for.
+    """
+    payload = json.dumps(
+        [agent_id, model_id, instructions_version, user_id, normalize_message(message)], ensure_ascii=False
+    )
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+async def read_db_entry(key: str) -> Optional[Tuple[Any, float, float]]:
+    """Returns the (content, created_at, expires_at) of a fresh entry, marking it as recently used."""
+    async with AsyncSessionLocal() as db:
+        now = datetime.now(timezone.utc)
+        entry = (
+            await db.scalars(
+                select(ResponseCacheEntry).where(ResponseCacheEntry.key == key, ResponseCacheEntry.expires_at > now)
+            )
+        ).first()
+        if entry is None:
+            return None
+        cached = (entry.content, entry.created_at.timestamp(), entry.expires_at.timestamp())
+        entry.accessed_at = now
+        await db.commit()
+        return cached
+
+
+async def write_db_entry(key: str, agent_id: str, model_id: str, content: Any, ttl: float) -> None:
+    async with AsyncSessionLocal() as db:
+        now = datetime.now(timezone.utc)
+        values = dict(
+            key=key,
+            agent_id=agent_id,
+            model_id=model_id,
+            content=content,
+            created_at=now,
+            accessed_at=now,
+            expires_at=now + timedelta(seconds=ttl),
+        )
+        await db.execute(
+            insert(ResponseCacheEntry).values(**values).on_conflict_do_update(index_elements=["key"], set_=values)
+        )
+        await db.commit()
+
+
+async def prune_db_entries(max_rows: int) -> None:
+    """Deletes expired entries, then the least recently used entries beyond `max_rows`."""
+    async with AsyncSessionLocal() as db:
+        await db.execute(delete(ResponseCacheEntry).where(ResponseCacheEntry.expires_at <= func.now()))
+        least_recently_used = (
+            select(ResponseCacheEntry.key).order_by(ResponseCacheEntry.accessed_at.desc()).offset(max_rows)
+        )
+        await db.execute(delete(ResponseCacheEntry).where(ResponseCacheEntry.key.in_(least_recently_used)))
+        await db.commit()
+
+
+class ResponseCache:
+    """An exact-match cache of agent responses with an in-memory LRU tier backed by a Postgres table.
+
+    Entries expire `ttl` seconds after they are written. The in-memory tier holds up to `max_entries` entries and
+    the Postgres tier, which is shared by all processes, is pruned to `max_rows` rows every `prune_every` writes.
+    """
+
+    def __init__(
+        self,
+        ttl: float = 3600,
+        max_entries: int = 1024,
+        max_rows: int = 100_000,
+        prune_every: int = 100,
+    ):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.max_rows = max_rows
+        self.prune_every = prune_every
+
+        # key -> (content, created_at, expires_at), ordered from least to most recently used
+        self._entries: "OrderedDict[str, Tuple[Any, float, float]]" = OrderedDict()
+        self._stats = ResponseCacheStats()
+        self._lock = Lock()
+
+    def _get_memory_entry(self, key: str) -> Optional[Tuple[Any, float, float]]:
+        with self._lock:
+            cached = self._entries.get(key)
+            if cached is None:
+                return None
+            if cached[2] <= time.time():
+                del self._entries[key]
+                self._stats.expired += 1
+                return None
+            self._entries.move_to_end(key)
+            return cached
+
+    def _set_memory_entry(self, key: str, cached: Tuple[Any, float, float]) -> None:
+        with self._lock:
+            self._entries[key] = cached
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self._stats.evictions += 1
+
+    async def get(self, key: str, max_age: Optional[int] = None) -> Optional[Tuple[Any, float]]:
+        """Returns the (content, created_at) of a fresh entry, or None.
+
+        Args:
+            key: The cache key from `get_cache_key()`
+            max_age: Only return an entry written in the last `max_age` seconds
+        """
+        min_created_at = time.time() - max_age if max_age is not None else None
+
+        cached = self._get_memory_entry(key)
+        if cached is not None and (min_created_at is None or cached[1] >= min_created_at):
+            with self._lock:
+                self._stats.memory_hits += 1
+            return cached[0], cached[1]
+
+        try:
+            cached = await read_db_entry(key)
+        except Exception as e:
+            logger.warning(f"Could not read the response cache: {e}")
+            cached = None
+            with self._lock:
+                self._stats.errors += 1
+
+        if cached is not None and (min_created_at is None or cached[1] >= min_created_at):
+            self._set_memory_entry(key, cached)
+            with self._lock:
+                self._stats.db_hits += 1
+            return cached[0], cached[1]
+
+        with self._lock:
+            self._stats.misses += 1
+        return None
+
+    async def set(self, key: str, agent_id: str, model_id: str, content: Any) -> None:
+        """Adds a JSON serializable response to both tiers."""
+        now = time.time()
+        self._set_memory_entry(key, (content, now, now + self.ttl))
+        with self._lock:
+            self._stats.writes += 1
+            prune = self._stats.writes % self.prune_every == 0
+
+        try:
+            await write_db_entry(key, agent_id, model_id, content, self.ttl)
+            if prune:
+                await prune_db_entries(self.max_rows)
+        except Exception as e:
+            logger.warning(f"Could not write the response cache: {e}")
+            with self._lock:
+                self._stats.errors += 1
+
+    def clear(self) -> None:
+        """Drops all in-memory entries."""
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self) -> ResponseCacheStats:
+        """Returns a snapshot of the counters."""
+        with self._lock:
+            self._stats.memory_entries = len(self._entries)
+            return ResponseCacheStats(**asdict(self._stats))
+
+
+# Response cache shared by all agent runs in this process
+response_cache = ResponseCache(
+    ttl=api_settings.response_cache_ttl,
+    max_entries=api_settings.response_cache_max_entries,
+    max_rows=api_settings.response_cache_max_rows,
+)
@@ -1,13 +1,26 @@
+import asyncio
+import time
 from enum import Enum
-from typing import AsyncGenerator, List, Optional
+from typing import Any, AsyncGenerator, Dict, List, Optional
 
+import anyio
 from agno.agent import Agent
-from fastapi import APIRouter, HTTPException, status
+from fastapi import APIRouter, Header, HTTPException, Request, status
+from fastapi.encoders import jsonable_encoder
 from fastapi.responses import StreamingResponse
-from pydantic import BaseModel
+from pydantic import BaseModel, Field
+from starlette.background import BackgroundTask
 
-from agents.operator import AgentType, get_agent, get_available_agents
+from agents.operator import AgentType, get_agent, get_available_agents, get_instructions_version, release_agent
+from api.admission import AdmissionRejected, AdmissionTicket, run_admission
+from api.metrics import record_run_metrics
+from api.cancellation import close_run_stream, persist_cancelled_run, record_completed_run, wait_for_disconnect
+from api.response_cache import get_cache_key, parse_cache_control, response_cache
+from api.session_locks import SessionBusy, SessionLockTicket, lock_session
+from api.settings import api_settings
+from api.streaming import RunStreamingResponse, SseEncoder
 from utils.log import logger
+from utils.serialization import FastJSONResponse, dumps_str
 
 ######################################################
 ## Router for the Agent Interface
@@ -32,23 +45,104 @@ async def list_agents():
     return get_available_agents()
 
 
-async def chat_response_streamer(agent: Agent, message: str) -> AsyncGenerator:
+class StreamState:
+    """Shared by the stream of a run and the background task of its response."""
+
+    def __init__(self):
+        # Set once the stream starts, from then on the stream returns the agent to the pool
+        self.started = False
+
+
+async def chat_response_streamer(
+    agent: Agent,
+    message: str,
+    request: Optional[Request] = None,
+    ticket: Optional[AdmissionTicket] = None,
+    session_ticket: Optional[SessionLockTicket] = None,
+    state: Optional[StreamState] = None,
+) -> AsyncGenerator:
     """
-    Stream agent responses chunk by chunk.
+    Stream agent responses as Server-Sent Events.
+
+    If the client disconnects, the run is cancelled and its partial response is saved to storage.
 
     Args:
         agent: The agent instance to interact with
         message: User message to process
+        request: The request being streamed to, used to detect when the client disconnects
+        ticket: The admission slot held by the run, released once the stream is finished
+        session_ticket: The lock of the run's session, released once the stream is finished
+        state: Marked as started when the stream starts, see `release_run()`
 
     Yields:
-        Text chunks from the agent response
+        SSE frames for the run_started, tool_call, content_delta, run_completed and error events
     """
-    run_response = await agent.arun(message, stream=True)
-    async for chunk in run_response:
-        # chunk.content only contains the text response from the Agent.
-        # For advanced use cases, we should yield the entire chunk
-        # that contains the tool calls and intermediate steps.
-        yield chunk.content
+    if state is not None:
+        state.started = True
+    encoder = SseEncoder(
+        coalesce_ms=api_settings.stream_coalesce_ms,
+        coalesce_bytes=api_settings.stream_coalesce_bytes,
+    )
+    disconnected: Optional[asyncio.Future] = None
+    if request is not None:
+        disconnected = asyncio.ensure_future(wait_for_disconnect(request, api_settings.disconnect_poll_interval))
+
+    run_response = None
+    failed = False
+    cancelled = False
+    try:
+        run_response = await agent.arun(message, stream=True, stream_intermediate_steps=True)
+        async for frames in encoder.stream(run_response, stop=disconnected):
+            yield frames
+        cancelled = disconnected is not None and disconnected.done()
+    except Exception as e:
+        failed = True
+        logger.error(f"Error streaming run: {e}")
+        yield encoder.error(e)
+    except BaseException:
+        # The server cancels the response when the client disconnects
+        cancelled = True
+        raise
+    finally:
+        if disconnected is not None:
+            disconnected.cancel()
+        # Shield the cleanup from the cancellation of the response
+        with anyio.CancelScope(shield=True):
+            if cancelled:
+                logger.info("Client disconnected, cancelling the run")
+                if run_response is not None:
+                    await close_run_stream(run_response)
+                # The storage write blocks, run it off the event loop
+                await asyncio.to_thread(persist_cancelled_run, agent)
+            elif not failed:
+                record_completed_run(agent)
+                record_run_metrics(
+                    agent.run_response,
+                    agent_id=agent.agent_id,
+                    model=agent.model.id if agent.model is not None else None,
+                    streamed=True,
+                )
+        # Return the agent to the pool and free the run slot once the stream is finished
+        release_agent(agent, failed=failed or cancelled)
+        if ticket is not None:
+            ticket.release()
+        if session_ticket is not None:
+            session_ticket.release()
+
+
+async def release_run(
+    agent: Agent, state: StreamState, ticket: AdmissionTicket, session_ticket: Optional[SessionLockTicket]
+) -> None:
+    """Releases what a streaming run holds when its stream never started, eg: when the client disconnected.
+
+    A started stream releases the agent itself, the tickets are released if they are still held. Async, so the
+    background task runs it on the event loop which owns the waiters of the tickets, not in a thread.
+    """
+    if not state.started:
+        release_agent(agent, failed=True)
+    ticket.release()
+    if session_ticket is not None:
+        session_ticket.release()
 
 
 class RunRequest(BaseModel):
@@ -62,19 +156,82 @@ class RunRequest(BaseModel):
 
 
 @agents_router.post("/{agent_id}/runs", status_code=status.HTTP_200_OK)
-async def run_agent(agent_id: AgentType, body: RunRequest):
+async def run_agent(
+    agent_id: AgentType,
+    body: RunRequest,
+    request: Request,
+    cache_control_header: Optional[str] = Header(None, alias="Cache-Control"),
+):
     """
     Sends a message to a specific agent and returns the response.
 
+    When the response cache is enabled, non-streaming runs without a session_id are served from the cache, to the
+    same user_id only.
+    The Cache-Control request header supports `no-cache`, `no-store`, `max-age` and `only-if-cached`.
+
+    Runs with the same session_id run one at a time, later runs wait for the earlier ones. A run that waited gets
+    the X-Session-Queue-Position and X-Session-Lock-Wait headers. When too many runs wait for the session, or the
+    wait times out, the run is rejected with a 409 and a Retry-After header.
+
     Args:
         agent_id: The ID of the agent to interact with
         body: Request parameters including the message
+        request: The incoming request, used to cancel streaming runs when the client disconnects
+        cache_control_header: The Cache-Control request header
 
     Returns:
         Either a streaming response or the complete agent response
     """
     logger.debug(f"RunRequest: {body}")
 
+    # Runs that continue a session depend on its history, so only new sessions are cached
+    cache_key: Optional[str] = None
+    cache_control = parse_cache_control(cache_control_header)
+    if api_settings.response_cache_enabled and not body.stream and body.session_id is None:
+        try:
+            instructions_version = get_instructions_version(agent_id, body.model.value)
+            cache_key = get_cache_key(
+                agent_id.value, body.model.value, instructions_version, body.message, user_id=body.user_id
+            )
+        except Exception as e:
+            logger.warning(f"Response cache disabled for this run: {e}")
+
+    cache_headers: Dict[str, str] = {}
+    if cache_key is not None:
+        if not cache_control.no_cache:
+            cached = await response_cache.get(cache_key, max_age=cache_control.max_age)
+            if cached is not None:
+                content, created_at = cached
+                return FastJSONResponse(
+                    content, headers={"X-Cache": "HIT", "Age": str(int(max(time.time() - created_at, 0)))}
+                )
+        if cache_control.only_if_cached:
+            raise HTTPException(status_code=status.HTTP_504_GATEWAY_TIMEOUT, detail="No cached response")
+        cache_headers["X-Cache"] = "MISS"
+
+    # Wait for the runs of the same session, so they do not overwrite each other's history and session_state
+    try:
+        session_ticket = await lock_session(body.session_id)
+    except SessionBusy as e:
+        raise HTTPException(
+            status_code=status.HTTP_409_CONFLICT,
+            detail=str(e),
+            headers={"Retry-After": str(e.retry_after), "X-Session-Queue-Position": str(e.position)},
+        )
+    session_headers = session_ticket.get_headers() if session_ticket is not None else {}
+
+    # Wait for a run slot for the model
+    try:
+        ticket = await run_admission.acquire(body.model.value)
+    except AdmissionRejected as e:
+        if session_ticket is not None:
+            session_ticket.release()
+        raise HTTPException(
+            status_code=status.HTTP_429_TOO_MANY_REQUESTS,
+            detail=str(e),
+            headers={"Retry-After": str(e.retry_after)},
+        )
+
     try:
         agent: Agent = get_agent(
             model_id=body.model.value,
@@ -83,16 +240,166 @@ async def run_agent(agent_id: AgentType, body: RunRequest):
             session_id=body.session_id,
         )
     except Exception as e:
+        ticket.release()
+        if session_ticket is not None:
+            session_ticket.release()
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail=f"Agent not found: {str(e)}")
 
     if body.stream:
-        return StreamingResponse(
-            chat_response_streamer(agent, body.message),
+        state = StreamState()
+        return RunStreamingResponse(
+            chat_response_streamer(
+                agent, body.message, request=request, ticket=ticket, session_ticket=session_ticket, state=state
+            ),
             media_type="text/event-stream",
+            # Disable caching and proxy buffering so events are delivered as they are sent
+            headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no", **session_headers},
+            # Frees the agent, run slot and session when the stream never started, eg: when the client disconnected
+            background=BackgroundTask(release_run, agent, state, ticket, session_ticket),
         )
     else:
-        response = await agent.arun(body.message, stream=False)
+        # A run cancelled by a client disconnect leaves the agent in an unknown state, it is not reused
+        failed = True
+        try:
+            response = await agent.arun(body.message, stream=False)
+            failed = False
+        finally:
+            release_agent(agent, failed=failed)
+            ticket.release()
+            if session_ticket is not None:
+                session_ticket.release()
+        record_run_metrics(response, agent_id=agent_id.value, model=body.model.value, streamed=False)
+        if cache_key is not None and not cache_control.no_store:
+            await response_cache.set(cache_key, agent_id.value, body.model.value, jsonable_encoder(response.content))
         # response.content only contains the text response from the Agent.
         # For advanced use cases, we should yield the entire response
         # that contains the tool calls and intermediate steps.
-        return response.content
+        # The response is returned directly, so structured outputs are serialized without jsonable_encoder.
+        return FastJSONResponse(response.content, headers={**cache_headers, **session_headers})
+
+
+class BatchRunItem(BaseModel):
+    """A single message in a batch run"""
+
+    message: str
+    user_id: Optional[str] = None
+    session_id: Optional[str] = None
+
+
+class BatchRunRequest(BaseModel):
+    """Request model for running an agent on a batch of messages"""
+
+    items: List[BatchRunItem] = Field(..., min_length=1, max_length=api_settings.batch_max_items)
+    model: Model = Model.gpt_4o
+    # Maximum number of items run at the same time, capped by ApiSettings.batch_max_concurrency
+    max_concurrency: Optional[int] = Field(None, ge=1)
+
+
+async def run_batch_item(agent_id: AgentType, model_id: str, index: int, item: BatchRunItem) -> Dict[str, Any]:
+    """
+    Runs a single batch item and returns its result. Errors are returned as part of the result.
+
+    Args:
+        agent_id: The ID of the agent to run
+        model_id: The model used by the agent
+        index: Index of the item in the batch request
+        item: The message to run
+
+    Returns:
+        The result of the item, with the input index
+    """
+    try:
+        session_ticket = await lock_session(item.session_id)
+    except SessionBusy as e:
+        return {"index": index, "status": "error", "error": str(e), "retry_after": e.retry_after}
+
+    try:
+        ticket = await run_admission.acquire(model_id)
+    except AdmissionRejected as e:
+        if session_ticket is not None:
+            session_ticket.release()
+        return {"index": index, "status": "error", "error": str(e), "retry_after": e.retry_after}
+
+    try:
+        agent: Agent = get_agent(
+            model_id=model_id,
+            agent_id=agent_id,
+            user_id=item.user_id,
+            session_id=item.session_id,
+        )
+        # A cancelled item leaves the agent in an unknown state, it is not reused
+        failed = True
+        try:
+            response = await agent.arun(item.message, stream=False)
+            failed = False
+        finally:
+            release_agent(agent, failed=failed)
+        return {
+            "index": index,
+            "status": "success",
+            "run_id": response.run_id,
+            "session_id": response.session_id,
+            "content": response.content,
+        }
+    except Exception as e:
+        logger.warning(f"Batch item {index} failed: {e}")
+        return {"index": index, "status": "error", "error": str(e)}
+    finally:
+        ticket.release()
+        if session_ticket is not None:
+            session_ticket.release()
+
+
+async def batch_response_streamer(agent_id: AgentType, body: BatchRunRequest) -> AsyncGenerator:
+    """
+    Run batch items with bounded parallelism and stream their results as they finish.
+
+    Args:
+        agent_id: The ID of the agent to run
+        body: The batch run request
+
+    Yields:
+        One JSON line per item, in completion order
+    """
+    max_concurrency = min(
+        body.max_concurrency or api_settings.batch_max_concurrency, api_settings.batch_max_concurrency
+    )
+    semaphore = asyncio.Semaphore(max_concurrency)
+
+    async def run_bounded(index: int, item: BatchRunItem) -> Dict[str, Any]:
+        async with semaphore:
+            return await run_batch_item(agent_id, body.model.value, index, item)
+
+    tasks = [asyncio.create_task(run_bounded(index, item)) for index, item in enumerate(body.items)]
+    try:
+        for next_result in asyncio.as_completed(tasks):
+            result = await next_result
+            yield dumps_str(result) + "\n"
+    finally:
+        # Cancel the remaining items if the client disconnects
+        for task in tasks:
+            task.cancel()
+
+
+@agents_router.post("/{agent_id}/runs:batch", status_code=status.HTTP_200_OK)
+async def run_agent_batch(agent_id: AgentType, body: BatchRunRequest):
+    """
+    Runs an agent on a batch of independent messages.
+
+    Items run in parallel on pooled agents, up to `max_concurrency` at a time. Results are streamed as
+    newline-delimited JSON in the order they finish, and each result carries the index of its input item.
+    A failed item is returned with `status: error` and does not fail the rest of the batch.
+
+    Args:
+        agent_id: The ID of the agent to run
+        body: The batch of messages, with optional per-item user and session ids
+
+    Returns:
+        A streaming NDJSON response with one result per item
+    """
+    logger.debug(f"BatchRunRequest: {len(body.items)} items")
+
+    return StreamingResponse(
+        batch_response_streamer(agent_id, body),
+        media_type="application/x-ndjson",
+    )
@@ -0,0 +1,194 @@
+from datetime import datetime
+from typing import Any, AsyncGenerator, Dict, List, Optional
+
+from fastapi import APIRouter, Header, HTTPException, status
+from fastapi.responses import StreamingResponse
+from pydantic import BaseModel, model_validator
+
+from agents.operator import get_available_agents
+from api.jobs import JobEventType, JobKind, JobStatus, get_job, get_job_events, job_worker_pool
+from api.routes.agents import Model
+from api.settings import api_settings
+from api.streaming import format_sse
+from teams.operator import get_available_teams
+from utils.log import logger
+from workflows.operator import get_available_workflows
+
+######################################################
+## Router for Jobs
+######################################################
+
+jobs_router = APIRouter(prefix="/jobs", tags=["Jobs"])
+
+
+class JobRequest(BaseModel):
+    """Request model for submitting an agent, team or workflow run as a job"""
+
+    kind: JobKind
+    # The agent_id, team_id or workflow_id to run
+    target_id: str
+    # The message sent to an agent or team
+    message: Optional[str] = None
+    # The arguments of a workflow run, eg: {"topic": "..."} for generate-blog-post-on
+    input: Dict[str, Any] = {}
+    # The model used by an agent
+    model: Model = Model.gpt_4o
+    user_id: Optional[str] = None
+    session_id: Optional[str] = None
+
+    @model_validator(mode="after")
+    def check_message(self) -> "JobRequest":
+        if self.kind != JobKind.workflow and not self.message:
+            raise ValueError(f"A message is required for {self.kind.value} jobs")
+        return self
+
+
+class JobResponse(BaseModel):
+    """A job and, once it has finished, its result"""
+
+    job_id: str
+    kind: JobKind
+    target_id: str
+    status: JobStatus
+    result: Optional[Any] = None
+    error: Optional[str] = None
+    created_at: datetime
+    started_at: Optional[datetime] = None
+    finished_at: Optional[datetime] = None
+
+
+class JobEventsResponse(BaseModel):
+    """A page of the event log of a job"""
+
+    events: List[Dict[str, Any]]
+    # Pass as the offset of the next request to read the events that follow
+    next_offset: int
+    status: JobStatus
+
+
+def get_available_targets(kind: JobKind) -> List[str]:
+    if kind == JobKind.agent:
+        return get_available_agents()
+    elif kind == JobKind.team:
+        return get_available_teams()
+    else:
+        return get_available_workflows()
+
+
+async def get_job_or_404(job_id: str) -> Dict[str, Any]:
+    job = await get_job(job_id)
+    if job is None:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail=f"Job not found: {job_id}")
+    return job
+
+
+@jobs_router.post("", response_model=JobResponse, status_code=status.HTTP_202_ACCEPTED)
+async def submit_job(body: JobRequest):
+    """
+    Submits an agent, team or workflow run to be run in the background.
+
+    Args:
+        body: The run to submit
+
+    Returns:
+        JobResponse: The queued job. Poll it with `GET /jobs/{job_id}` or follow its events.
+    """
+    if body.target_id not in get_available_targets(body.kind):
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND, detail=f"{body.kind.value.capitalize()} not found: {body.target_id}"
+        )
+
+    job_input: Dict[str, Any] = {"user_id": body.user_id, "session_id": body.session_id}
+    if body.kind == JobKind.workflow:
+        job_input["input"] = body.input
+    else:
+        job_input["message"] = body.message
+    if body.kind == JobKind.agent:
+        job_input["model"] = body.model.value
+
+    job = await job_worker_pool.submit(body.kind, body.target_id, job_input)
+    logger.debug(f"Submitted job {job['job_id']}: {body.kind.value} {body.target_id}")
+    return job
+
+
+@jobs_router.get("/{job_id}", response_model=JobResponse)
+async def get_job_status(job_id: str):
+    """
+    Returns the status of a job, with its result once it has finished.
+
+    Args:
+        job_id: The ID of the job
+
+    Returns:
+        JobResponse: The job
+    """
+    return await get_job_or_404(job_id)
+
+
+async def job_events_streamer(job_id: str, offset: int) -> AsyncGenerator:
+    """
+    Stream the event log of a job as Server-Sent Events, following it until the job has finished.
+
+    Args:
+        job_id: The ID of the job
+        offset: The sequence number of the first event to send
+
+    Yields:
+        SSE frames with the sequence number of each event as its id
+    """
+    while True:
+        # Read the status first, so events written before the job finished are not missed
+        job = await get_job_or_404(job_id)
+        events = await get_job_events(job_id, offset, api_settings.job_events_page_size)
+        for event in events:
+            yield format_sse(event["event"], event["data"], event_id=event["seq"])
+            offset = event["seq"] + 1
+            if event["event"] == JobEventType.job_finished:
+                return
+        if len(events) == api_settings.job_events_page_size:
+            continue
+        if job["status"] in (JobStatus.succeeded.value, JobStatus.failed.value):
+            return
+        await job_worker_pool.wait_for_update(api_settings.job_poll_interval)
+
+
+@jobs_router.get("/{job_id}/events")
+async def get_job_event_log(
+    job_id: str,
+    offset: int = 0,
+    stream: bool = False,
+    last_event_id: Optional[int] = Header(None),
+):
+    """
+    Returns the event log of a job starting at `offset`.
+
+    Events carry a sequence number starting at 0, so clients can reconnect and resume from the last event they read.
+    With `stream=true` the events are sent as Server-Sent Events until the job has finished, and the
+    `Last-Event-ID` header sent by reconnecting EventSource clients takes precedence over `offset`.
+
+    Args:
+        job_id: The ID of the job
+        offset: The sequence number of the first event to return
+        stream: Whether to follow the event log as Server-Sent Events
+        last_event_id: The id of the last event received by a reconnecting client
+
+    Returns:
+        Either a streaming response or a page of events with the offset of the next page
+    """
+    job = await get_job_or_404(job_id)
+
+    if stream:
+        if last_event_id is not None:
+            offset = last_event_id + 1
+        return StreamingResponse(
+            job_events_streamer(job_id, offset),
+            media_type="text/event-stream",
+            headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+        )
+
+    events = await get_job_events(job_id, offset, api_settings.job_events_page_size)
+    return JobEventsResponse(
+        events=events,
+        next_offset=events[-1]["seq"] + 1 if events else offset,
+        status=job["status"],
+    )
@@ -0,0 +1,15 @@
+from fastapi import APIRouter, Response
+from prometheus_client import CONTENT_TYPE_LATEST, generate_latest
+
+######################################################
+## Router for Prometheus metrics
+######################################################
+
+metrics_router = APIRouter(tags=["Metrics"])
+
+
+@metrics_router.get("/metrics")
+def get_metrics():
+    """Returns the metrics of this process in the Prometheus text format"""
+
+    return Response(content=generate_latest(), media_type=CONTENT_TYPE_LATEST)
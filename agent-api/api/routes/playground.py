@@ -1,40 +1,108 @@
 from os import getenv
+from threading import Lock
+from typing import Any, Callable
 
-from agno.playground import Playground
+from agno.agent import Agent
+from agno.api.playground import PlaygroundEndpointCreate, create_playground_endpoint
+from agno.playground.async_router import get_async_playground_router
+from agno.team.team import Team
 
-from agents.sage import get_sage
-from agents.scholar import get_scholar
-from teams.finance_researcher_team import get_finance_researcher_team
-from teams.multi_language_team import get_multi_language_team
-from workflows.blog_post_generator import get_blog_post_generator
-from workflows.investment_report_generator import get_investment_report_generator
-from workspace.dev_resources import dev_fastapi
+from agents.operator import AgentType, build_agent
+from teams.operator import TeamType, get_team
+from utils.log import logger
+from workflows.operator import WorkflowType, get_workflow
 
 ######################################################
 ## Router for the Playground Interface
 ######################################################
 
+
+class LazyComponent:
+    """Stands in for a playground agent, team or workflow and builds it on first use.
+
+    Building a component creates its storages and imports its tools, so building every component at import made
+    each worker boot slow. The id is set on the stand-in, so the playground router can list and look up components
+    by id without building them. Any other attribute is read from, or set on, the built component.
+    """
+
+    def __init__(self, id_field: str, component_id: str, builder: Callable[[], Any]):
+        object.__setattr__(self, id_field, component_id)
+        object.__setattr__(self, "_builder", builder)
+        object.__setattr__(self, "_component", None)
+        object.__setattr__(self, "_lock", Lock())
+
+    def get_component(self) -> Any:
+        if self._component is None:
+            with self._lock:
+                if self._component is None:
+                    component = self._builder()
+                    initialize_component(component)
+                    object.__setattr__(self, "_component", component)
+        return self._component
+
+    def __getattr__(self, name: str) -> Any:
+        # Only called for attributes not set on the stand-in
+        return getattr(self.get_component(), name)
+
+    def __setattr__(self, name: str, value: Any) -> None:
+        setattr(self.get_component(), name, value)
+
+
+def initialize_component(component: Any) -> None:
+    """Initializes a built component the same way `agno.playground.Playground` does."""
+    if isinstance(component, Agent):
+        component.initialize_agent()
+    elif isinstance(component, Team):
+        component.initialize_team()
+        for member in component.members:
+            initialize_component(member)
+
+
 # Agents
-sage_agent = get_sage(debug_mode=True)
-scholar_agent = get_scholar(debug_mode=True)
+sage_agent = LazyComponent("agent_id", AgentType.SAGE.value, lambda: build_agent((AgentType.SAGE, "gpt-4o")))
+scholar_agent = LazyComponent("agent_id", AgentType.SCHOLAR.value, lambda: build_agent((AgentType.SCHOLAR, "gpt-4o")))
 
 # Teams
-finance_researcher_team = get_finance_researcher_team(debug_mode=True)
-multi_language_team = get_multi_language_team(debug_mode=True)
+finance_researcher_team = LazyComponent(
+    "team_id", TeamType.FINANCE_RESEARCHER.value, lambda: get_team(TeamType.FINANCE_RESEARCHER, debug_mode=True)
+)
+multi_language_team = LazyComponent(
+    "team_id", TeamType.MULTI_LANGUAGE.value, lambda: get_team(TeamType.MULTI_LANGUAGE, debug_mode=True)
+)
 
 # Workflows
-blog_post_generator = get_blog_post_generator(debug_mode=True)
-investment_report_generator = get_investment_report_generator(debug_mode=True)
-
-# Create a playground instance
-playground = Playground(
-    agents=[sage_agent, scholar_agent],
-    teams=[finance_researcher_team, multi_language_team],
-    workflows=[blog_post_generator, investment_report_generator],
+blog_post_generator = LazyComponent(
+    "workflow_id",
+    WorkflowType.BLOG_POST_GENERATOR.value,
+    lambda: get_workflow(WorkflowType.BLOG_POST_GENERATOR, debug_mode=True),
 )
+investment_report_generator = LazyComponent(
+    "workflow_id",
+    WorkflowType.INVESTMENT_REPORT_GENERATOR.value,
+    lambda: get_workflow(WorkflowType.INVESTMENT_REPORT_GENERATOR, debug_mode=True),
+)
+
+
+def create_endpoint(endpoint: str, prefix: str = "/v1") -> None:
+    """Registers the endpoint where playground routes are served with agno.com"""
+    try:
+        logger.info(f"Creating playground endpoint: {endpoint}")
+        create_playground_endpoint(
+            playground=PlaygroundEndpointCreate(endpoint=endpoint, playground_data={"prefix": prefix})
+        )
+    except Exception as e:
+        logger.error(f"Could not create playground endpoint: {e}")
+
 
 # Register the endpoint where playground routes are served with agno.com
 if getenv("RUNTIME_ENV") == "dev":
-    playground.create_endpoint(f"http://localhost:{dev_fastapi.host_port}")
+    from workspace.dev_resources import dev_fastapi
 
-playground_router = playground.get_async_router()
+    create_endpoint(f"http://localhost:{dev_fastapi.host_port}")
+
+# The playground router is created without agno.playground.Playground, which initializes every component
+playground_router = get_async_playground_router(
+    agents=[sage_agent, scholar_agent],  # type: ignore
+    teams=[finance_researcher_team, multi_language_team],  # type: ignore
+    workflows=[blog_post_generator, investment_report_generator],  # type: ignore
+)
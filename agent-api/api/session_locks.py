@@ -0,0 +1,332 @@
+import asyncio
+import math
+import time
+from collections import deque
+from dataclasses import dataclass, replace
+from typing import Deque, Dict, Optional, Set
+
+from sqlalchemy import text
+from sqlalchemy.ext.asyncio import AsyncConnection, AsyncEngine
+
+from api.settings import api_settings
+from db.session import db_async_engine
+from utils.log import logger
+
+######################################################
+## Session locks for agent runs
+######################################################
+
+# A run reads its session when it starts and writes it when it finishes, so two concurrent runs of a session
+# overwrite each other's history and session_state. A run holds the lock of its session from before the session is
+# read until it is written. Runs of a session wait in FIFO order in a process, and a Postgres advisory lock keeps
+# out the runs of the session in other processes. Runs of different sessions never wait for each other.
+
+
+class SessionBusy(Exception):
+    """Raised when a run cannot lock its session because too many runs wait for it or the wait timed out"""
+
+    def __init__(self, message: str, retry_after: int, position: int):
+        super().__init__(message)
+        self.retry_after = retry_after
+        # Runs of the session ahead of the rejected run
+        self.position = position
+
+
+@dataclass
+class SessionLockStats:
+    """Counters for the session locks of this process"""
+
+    # Sessions locked by a run
+    held: int = 0
+    # Runs waiting for the lock of their session
+    waiting: int = 0
+    # Locks acquired
+    acquired: int = 0
+    # Locks acquired after waiting for another run of the session, in this or another process
+    contended: int = 0
+    # Runs rejected because too many runs were waiting for their session
+    rejected: int = 0
+    # Runs rejected because they waited longer than the timeout
+    timed_out: int = 0
+    # Total and maximum seconds runs waited for their session
+    wait_seconds_total: float = 0.0
+    wait_seconds_max: float = 0.0
+    # Failed advisory lock statements. Sessions are then only locked in this process.
+    advisory_errors: int = 0
+
+
+class AdvisoryLocks:
+    """Holds the Postgres advisory locks of the sessions locked by this process, on a single connection.
+
+    Advisory locks belong to the connection that took them, so they are all taken on one connection, one statement
+    at a time. pg_try_advisory_lock does not block, runs waiting for a session poll. If the connection is lost,
+    Postgres releases its locks and the next statement opens a new connection.
+    """
+
+    def __init__(self, engine: AsyncEngine):
+        self.engine = engine
+        self._conn: Optional[AsyncConnection] = None
+        self._lock = asyncio.Lock()
+
+    async def try_lock(self, key: str) -> bool:
+        return await self._execute("SELECT pg_try_advisory_lock(hashtextextended(:key, 0))", key)
+
+    async def unlock(self, key: str) -> bool:
+        return await self._execute("SELECT pg_advisory_unlock(hashtextextended(:key, 0))", key)
+
+    async def _execute(self, sql: str, key: str) -> bool:
+        async with self._lock:
+            try:
+                if self._conn is None:
+                    conn = await self.engine.connect()
+                    self._conn = await conn.execution_options(isolation_level="AUTOCOMMIT")
+                return bool((await self._conn.execute(text(sql), {"key": key})).scalar())
+            except BaseException:
+                # The connection is in an unknown state, drop it and its locks
+                broken, self._conn = self._conn, None
+                if broken is not None:
+                    try:
+                        await broken.invalidate()
+                    except Exception:
+                        pass
+                raise
+
+
+class SessionLockTicket:
+    """The lock of a session held by a run. Release it once the run, including any stream, has finished.
+
+    Releasing is idempotent. Streaming runs also release it in the background task of their response, which runs
+    even when the stream never started.
+    """
+
+    def __init__(
+        self, manager: "SessionLockManager", session_id: str, position: int, waited: bool, wait_seconds: float
+    ):
+        self.session_id = session_id
+        # Runs of the session in this process ahead of this run when it arrived
+        self.position = position
+        # Whether the run waited for another run of the session, in this or another process
+        self.waited = waited
+        self.wait_seconds = wait_seconds
+        self._manager = manager
+        self._started_at = time.monotonic()
+        self._released = False
+
+    def get_headers(self) -> Dict[str, str]:
+        """Returns the response headers reporting the wait for the session, if the run waited."""
+        if not self.waited:
+            return {}
+        return {"X-Session-Queue-Position": str(self.position), "X-Session-Lock-Wait": f"{self.wait_seconds:.3f}"}
+
+    def release(self) -> None:
+        if self._released:
+            return
+        self._released = True
+        self._manager.release(self.session_id, time.monotonic() - self._started_at)
+
+
+class SessionQueue:
+    """The runs of a session in this process: the run holding its lock and the runs waiting for it."""
+
+    def __init__(self):
+        self.waiters: Deque[asyncio.Future] = deque()
+        # Whether this process holds the advisory lock of the session
+        self.advisory = False
+
+
+class SessionLockManager:
+    """Serializes the runs of each session, in this process and, with `advisory`, across processes.
+
+    Runs wait in FIFO order for the lock of their session. When a run finishes, the lock is handed to the next
+    waiting run of the process along with the advisory lock, the advisory lock is only released once no run of the
+    process waits. When `max_waiters` runs already wait for a session, or a run waits longer than `timeout`, the
+    run is rejected with SessionBusy, which carries an estimated Retry-After.
+    """
+
+    def __init__(
+        self, timeout: float, max_waiters: int, advisory: Optional[AdvisoryLocks] = None, poll_interval: float = 0.05
+    ):
+        self.timeout = timeout
+        self.max_waiters = max_waiters
+        self.advisory = advisory
+        self.poll_interval = poll_interval
+
+        self._stats = SessionLockStats()
+        # Queues of the sessions locked by a run of this process
+        self._queues: Dict[str, SessionQueue] = {}
+        # Moving average of the seconds runs hold their session, used to estimate Retry-After
+        self._average_run_seconds: float = 10.0
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._tasks: Set[asyncio.Future] = set()
+
+    def get_key(self, session_id: str) -> str:
+        return f"session:{session_id}"
+
+    def retry_after(self, runs_ahead: int) -> int:
+        """Seconds until the runs ahead of a new run of the session are likely to have finished."""
+        return max(1, math.ceil(self._average_run_seconds * runs_ahead))
+
+    async def acquire(self, session_id: str) -> SessionLockTicket:
+        """Waits for the lock of a session."""
+        self._loop = asyncio.get_running_loop()
+        start = time.monotonic()
+        position = 0
+        waited = False
+        queue = self._queues.get(session_id)
+        if queue is None:
+            queue = self._queues[session_id] = SessionQueue()
+            self._stats.held = len(self._queues)
+        else:
+            position = len(queue.waiters) + 1
+            if len(queue.waiters) >= self.max_waiters:
+                self._stats.rejected += 1
+                raise SessionBusy(
+                    f"Too many runs waiting for session {session_id}", self.retry_after(position), position
+                )
+            await self._wait_in_queue(session_id, queue, position)
+            waited = True
+
+        if self.advisory is not None and not queue.advisory:
+            try:
+                waited = await self._lock_advisory(session_id, queue, start + self.timeout) or waited
+            except BaseException:
+                self.release(session_id, 0)
+                raise
+
+        wait_seconds = time.monotonic() - start
+        self._stats.acquired += 1
+        if waited:
+            self._stats.contended += 1
+        self._stats.wait_seconds_total += wait_seconds
+        self._stats.wait_seconds_max = max(self._stats.wait_seconds_max, wait_seconds)
+        return SessionLockTicket(self, session_id, position, waited, wait_seconds)
+
+    async def _wait_in_queue(self, session_id: str, queue: SessionQueue, position: int) -> None:
+        """Waits until the lock is handed over by the run ahead."""
+        waiter: asyncio.Future = asyncio.get_running_loop().create_future()
+        queue.waiters.append(waiter)
+        self._stats.waiting += 1
+        try:
+            await asyncio.wait_for(asyncio.shield(waiter), timeout=self.timeout)
+        except asyncio.TimeoutError:
+            # The lock may have been handed to this run just as the wait timed out
+            if not waiter.done():
+                self._abandon(queue, waiter)
+                self._stats.timed_out += 1
+                raise SessionBusy(
+                    f"Timed out waiting for session {session_id}", self.retry_after(len(queue.waiters) + 1), position
+                )
+        except BaseException:
+            # The request was cancelled while waiting, hand on the lock if it was already handed over
+            if waiter.done():
+                self.release(session_id, 0)
+            else:
+                self._abandon(queue, waiter)
+            raise
+        finally:
+            self._stats.waiting -= 1
+
+    async def _lock_advisory(self, session_id: str, queue: SessionQueue, deadline: float) -> bool:
+        """Takes the advisory lock of a session, polling while a run of another process holds it.
+
+        Returns:
+            bool: Whether the run waited for a run of another process
+        """
+        assert self.advisory is not None
+        key = self.get_key(session_id)
+        interval = self.poll_interval
+        waiting = False
+        try:
+            while True:
+                # Shielded, so a cancelled run does not break the connection holding the locks of other sessions
+                task = asyncio.ensure_future(self.advisory.try_lock(key))
+                try:
+                    locked = await asyncio.shield(task)
+                except asyncio.CancelledError:
+                    task.add_done_callback(lambda t: self._unlock_if_locked(t, key))
+                    raise
+                except Exception as e:
+                    self._stats.advisory_errors += 1
+                    logger.warning(f"Could not lock session {session_id} in Postgres, locking it in this process: {e}")
+                    return waiting
+                if locked:
+                    queue.advisory = True
+                    return waiting
+                if time.monotonic() + interval > deadline:
+                    self._stats.timed_out += 1
+                    raise SessionBusy(
+                        f"Timed out waiting for session {session_id}, it is locked by another process",
+                        self.retry_after(1),
+                        1,
+                    )
+                if not waiting:
+                    waiting = True
+                    self._stats.waiting += 1
+                await asyncio.sleep(interval)
+                interval = min(interval * 2, 0.5)
+        finally:
+            if waiting:
+                self._stats.waiting -= 1
+
+    def _abandon(self, queue: SessionQueue, waiter: asyncio.Future) -> None:
+        waiter.cancel()
+        queue.waiters.remove(waiter)
+
+    def release(self, session_id: str, run_seconds: float) -> None:
+        if run_seconds > 0:
+            self._average_run_seconds = 0.9 * self._average_run_seconds + 0.1 * run_seconds
+        queue = self._queues.get(session_id)
+        if queue is None:
+            return
+        # Hand the lock to the next waiting run, otherwise unlock the session
+        while queue.waiters:
+            waiter = queue.waiters.popleft()
+            if not waiter.done():
+                waiter.set_result(True)
+                return
+        del self._queues[session_id]
+        self._stats.held = len(self._queues)
+        if queue.advisory:
+            self._unlock_later(self.get_key(session_id))
+
+    def _unlock_if_locked(self, task: asyncio.Future, key: str) -> None:
+        if not task.cancelled() and task.exception() is None and task.result():
+            self._unlock_later(key)
+
+    def _unlock_later(self, key: str) -> None:
+        """Releases an advisory lock in the background. Tickets can be released outside of the event loop."""
+        if self._loop is None or self._loop.is_closed():
+            return
+        self._loop.call_soon_threadsafe(self._start_unlock, key)
+
+    def _start_unlock(self, key: str) -> None:
+        task = asyncio.ensure_future(self._unlock(key))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def _unlock(self, key: str) -> None:
+        assert self.advisory is not None
+        try:
+            await self.advisory.unlock(key)
+        except Exception as e:
+            self._stats.advisory_errors += 1
+            logger.warning(f"Could not unlock {key} in Postgres: {e}")
+
+    def stats(self) -> SessionLockStats:
+        """Returns a snapshot of the counters."""
+        return replace(self._stats)
+
+
+# Session locks shared by all agent runs in this process
+session_locks = SessionLockManager(
+    timeout=api_settings.session_lock_timeout,
+    max_waiters=api_settings.session_lock_max_waiters,
+    advisory=AdvisoryLocks(db_async_engine) if api_settings.session_lock_advisory else None,
+)
+
+
+async def lock_session(session_id: Optional[str]) -> Optional[SessionLockTicket]:
+    """Waits for the lock of the session of a run. Runs without a session_id start a new session and are not locked."""
+    if session_id is None or not api_settings.session_lock_enabled:
+        return None
+    return await session_locks.acquire(session_id)
@@ -1,4 +1,4 @@
-from typing import List, Optional
+from typing import Dict, List, Optional
 
 from pydantic import Field, field_validator
 from pydantic_core.core_schema import FieldValidationInfo
@@ -22,6 +22,61 @@ class ApiSettings(BaseSettings):
     # Set to False to disable docs at /docs and /redoc
     docs_enabled: bool = True
 
+    # Set to False to disable Prometheus metrics at /metrics
+    metrics_enabled: bool = True
+
+    # Streamed content deltas are coalesced into one event per window (milliseconds)
+    stream_coalesce_ms: float = 20
+    # Coalesced content deltas are flushed early once they reach this many bytes
+    stream_coalesce_bytes: int = 512
+
+    # Seconds between checks for a disconnected client while streaming a run
+    disconnect_poll_interval: float = 0.5
+
+    # Maximum concurrent runs per model. Models not listed use default_max_in_flight_runs.
+    max_in_flight_runs: Dict[str, int] = {"gpt-4o": 32, "o3-mini": 16}
+    default_max_in_flight_runs: int = 16
+    # Maximum runs waiting for a slot per model, runs beyond this are rejected with a 429
+    max_queued_runs: int = 64
+    # Seconds a run waits for a slot before it is rejected with a 429
+    admission_timeout: float = 10
+
+    # Runs with the same session_id wait for each other, so concurrent runs do not overwrite the session
+    session_lock_enabled: bool = True
+    # Also lock sessions across processes with Postgres advisory locks, held on one connection per process
+    session_lock_advisory: bool = True
+    # Seconds a run waits for its session before it is rejected with a 409
+    session_lock_timeout: float = 30
+    # Maximum runs waiting for a session per process, runs beyond this are rejected with a 409
+    session_lock_max_waiters: int = 8
+
+    # Maximum number of messages in a batch run
+    batch_max_items: int = 1000
+    # Maximum number of batch items run at the same time per request
+    batch_max_concurrency: int = 8
+
+    # Number of workers running jobs in this process. Set to 0 to only accept jobs.
+    job_workers: int = 4
+    # Seconds between checks for new jobs and, when following a job, for new job events
+    job_poll_interval: float = 1.0
+    # Seconds between writes of buffered job events
+    job_event_flush_interval: float = 0.5
+    # Running jobs not updated for this many seconds are failed, at startup and then every job_stale_seconds, eg:
+    # after a process running them was stopped
+    job_stale_seconds: float = 300
+    # Maximum number of job events returned per request
+    job_events_page_size: int = 500
+
+    # Set to True to cache the responses of non-streaming agent runs that do not continue a session.
+    # Requests can bypass the cache with the Cache-Control header, eg: "no-cache" or "no-store".
+    response_cache_enabled: bool = False
+    # Seconds a cached response is served for
+    response_cache_ttl: float = 3600
+    # Maximum number of cached responses held in memory per process
+    response_cache_max_entries: int = 1024
+    # Maximum number of cached responses kept in Postgres
+    response_cache_max_rows: int = 100_000
+
     # Cors origin list to allow requests from.
     # This list is set using the set_cors_origin_list validator
     # which uses the runtime_env variable to set the
@@ -0,0 +1,226 @@
+import asyncio
+from typing import Any, AsyncIterator, Dict, List, Optional, Set, Tuple
+
+import anyio
+from agno.run.response import RunEvent, RunResponse
+from pydantic import BaseModel
+from starlette.responses import StreamingResponse
+from starlette.types import Receive, Scope, Send
+
+from utils.serialization import dumps_str
+
+######################################################
+## Server-Sent Events for agent, team and workflow runs
+######################################################
+
+
+class SseEvent:
+    """Event types sent to clients on the run stream"""
+
+    run_started = "run_started"
+    tool_call = "tool_call"
+    content_delta = "content_delta"
+    run_completed = "run_completed"
+    error = "error"
+
+
+def format_sse(event: str, data: Any, event_id: Optional[int] = None) -> str:
+    """Formats a single `text/event-stream` frame.
+
+    Args:
+        event: The event type
+        data: JSON serializable event payload, which may contain pydantic models
+        event_id: The id of the event, used by clients to track the last event received
+
+    Returns:
+        The SSE frame, terminated by a blank line
+    """
+    frame = ""
+    if event_id is not None:
+        frame += f"id: {event_id}\n"
+    frame += f"event: {event}\n"
+    frame += f"data: {dumps_str(data)}\n\n"
+    return frame
+
+
+def get_tool_call_payload(tool: Dict[str, Any]) -> Dict[str, Any]:
+    """Returns the fields of an agno tool call that are sent to the client."""
+    return {
+        "tool_call_id": tool.get("tool_call_id"),
+        "tool_name": tool.get("tool_name"),
+        "tool_args": tool.get("tool_args"),
+        "result": tool.get("content"),
+        "error": tool.get("tool_call_error"),
+    }
+
+
+class RunEventMapper:
+    """Maps the chunks of an agent, team or workflow run stream to typed events.
+
+    Chunks are mapped to (event, data) pairs: run_started, tool_call, content_delta, run_completed and error.
+    Tool calls are reported once when they start and once when they complete.
+    """
+
+    def __init__(self):
+        # Tool calls that were already reported, per status
+        self._tool_calls_sent: Dict[str, Set[str]] = {"started": set(), "completed": set()}
+
+    def get_run_payload(self, chunk: Any) -> Dict[str, Any]:
+        return {
+            "run_id": chunk.run_id,
+            "session_id": chunk.session_id,
+            "agent_id": getattr(chunk, "agent_id", None),
+            "team_id": getattr(chunk, "team_id", None),
+            "workflow_id": getattr(chunk, "workflow_id", None),
+            "model": getattr(chunk, "model", None),
+        }
+
+    def map(self, chunk: Any) -> List[Tuple[str, Dict[str, Any]]]:
+        """Returns the events for a RunResponse or TeamRunResponse chunk."""
+        events: List[Tuple[str, Dict[str, Any]]] = []
+        if chunk.event == RunEvent.run_response.value:
+            if isinstance(chunk.content, str) and chunk.content != "":
+                events.append((SseEvent.content_delta, {"content": chunk.content}))
+            elif isinstance(chunk.content, BaseModel):
+                # Structured outputs are sent whole, and serialized by the event encoder
+                events.append((SseEvent.content_delta, {"content": chunk.content}))
+        elif chunk.event in (RunEvent.run_started.value, RunEvent.workflow_started.value):
+            events.append((SseEvent.run_started, self.get_run_payload(chunk)))
+        elif chunk.event in (RunEvent.tool_call_started.value, RunEvent.tool_call_completed.value):
+            status = "started" if chunk.event == RunEvent.tool_call_started.value else "completed"
+            for tool in chunk.tools or []:
+                tool_call_id = tool.get("tool_call_id")
+                if tool_call_id is None or tool_call_id in self._tool_calls_sent[status]:
+                    continue
+                # Tool calls are completed once their metrics are set
+                if status == "completed" and tool.get("metrics") is None:
+                    continue
+                self._tool_calls_sent[status].add(tool_call_id)
+                events.append((SseEvent.tool_call, {"status": status, **get_tool_call_payload(tool)}))
+        elif chunk.event == RunEvent.workflow_completed.value:
+            # Workflows can complete with their final content, eg: a cached blog post
+            if isinstance(chunk.content, str) and chunk.content != "":
+                events.append((SseEvent.content_delta, {"content": chunk.content}))
+            events.append((SseEvent.run_completed, self.get_run_payload(chunk)))
+        elif chunk.event == RunEvent.run_completed.value:
+            events.append((SseEvent.run_completed, self.get_run_payload(chunk)))
+        elif chunk.event == RunEvent.run_error.value:
+            events.append((SseEvent.error, {"message": chunk.content}))
+        return events
+
+
+class SseEncoder:
+    """Encodes an agent run stream as typed Server-Sent Events.
+
+    Content deltas are buffered and sent as a single `content_delta` event once the buffer is `coalesce_ms` old
+    or holds `coalesce_bytes` of text. Any other event flushes the buffer first, so events keep their order.
+    Every event gets an increasing id.
+    """
+
+    def __init__(self, coalesce_ms: float = 20, coalesce_bytes: int = 512):
+        self.coalesce_seconds: float = coalesce_ms / 1000
+        self.coalesce_bytes: int = coalesce_bytes
+
+        self.mapper = RunEventMapper()
+        self._next_id: int = 0
+        self._buffer: List[str] = []
+        self._buffer_bytes: int = 0
+
+    def event(self, event: str, data: Any) -> str:
+        """Formats an event with the next event id."""
+        frame = format_sse(event, data, event_id=self._next_id)
+        self._next_id += 1
+        return frame
+
+    def error(self, exc: BaseException) -> str:
+        """Formats an error event, flushing any buffered content before it."""
+        return self.flush() + self.event(SseEvent.error, {"message": str(exc), "type": type(exc).__name__})
+
+    def flush(self) -> str:
+        """Returns the buffered content as a single `content_delta` event, or an empty string."""
+        if not self._buffer:
+            return ""
+        content = "".join(self._buffer)
+        self._buffer = []
+        self._buffer_bytes = 0
+        return self.event(SseEvent.content_delta, {"content": content})
+
+    def encode(self, chunk: RunResponse) -> str:
+        """Encodes a RunResponse chunk. Returns an empty string when the chunk is only buffered."""
+        frames = ""
+        for event, data in self.mapper.map(chunk):
+            if event == SseEvent.content_delta and isinstance(data["content"], str):
+                self._buffer.append(data["content"])
+                self._buffer_bytes += len(data["content"].encode("utf-8"))
+                if self._buffer_bytes >= self.coalesce_bytes:
+                    frames += self.flush()
+            else:
+                frames += self.flush() + self.event(event, data)
+        return frames
+
+    async def stream(
+        self, run_response: AsyncIterator[RunResponse], stop: Optional[asyncio.Future] = None
+    ) -> AsyncIterator[str]:
+        """Encodes a run stream, flushing buffered content when no new chunk arrives within the coalesce window.
+
+        Args:
+            run_response: The stream of RunResponse chunks from `agent.arun(stream=True)`
+            stop: Optional future that ends the stream early once it is done, eg: when the client disconnects
+        """
+        loop = asyncio.get_running_loop()
+        iterator = run_response.__aiter__()
+        next_chunk: Optional[asyncio.Future] = None
+        flush_at: Optional[float] = None
+        try:
+            while True:
+                if next_chunk is None:
+                    next_chunk = asyncio.ensure_future(iterator.__anext__())
+                timeout = None if flush_at is None else max(flush_at - loop.time(), 0)
+                waiting_on = {next_chunk} if stop is None else {next_chunk, stop}
+                done, _ = await asyncio.wait(waiting_on, timeout=timeout, return_when=asyncio.FIRST_COMPLETED)
+                if stop is not None and stop in done:
+                    return
+                if not done:
+                    # The coalesce window expired before the next chunk
+                    flush_at = None
+                    yield self.flush()
+                    continue
+
+                try:
+                    chunk = next_chunk.result()
+                except StopAsyncIteration:
+                    break
+                finally:
+                    next_chunk = None
+
+                frames = self.encode(chunk)
+                if frames:
+                    yield frames
+                if not self._buffer:
+                    flush_at = None
+                elif flush_at is None:
+                    flush_at = loop.time() + self.coalesce_seconds
+
+            frames = self.flush()
+            if frames:
+                yield frames
+        finally:
+            if next_chunk is not None and not next_chunk.done():
+                next_chunk.cancel()
+
+
+class RunStreamingResponse(StreamingResponse):
+    """A StreamingResponse that always runs its background task, to release what the run holds.
+
+    Starlette skips the background task when sending the response fails, eg: when the client disconnected before the
+    stream started, and the stream's own cleanup never runs if the stream never started.
+    """
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        background, self.background = self.background, None
+        try:
+            await super().__call__(scope, receive, send)
+        finally:
+            if background is not None:
+                with anyio.CancelScope(shield=True):
+                    await background()
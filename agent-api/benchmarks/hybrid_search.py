@@ -0,0 +1,174 @@
+"""Hybrid knowledge search benchmark.
+
+Compares the latency of PgVector's hybrid search, one query ordering the table by a combined vector and full-text
+score, with the fused hybrid search of KnowledgeVectorDb, a vector query and a full-text query run concurrently and
+fused with reciprocal rank fusion, in threads and on the async engine. The fused search is also timed with its
+result cache on repeated queries.
+
+Documents with random words and clustered random vectors are loaded in a scratch schema, with an HNSW index and a
+full-text GIN index. Queries are embedded by a local embedder that waits --embed-ms, like an embedding request.
+Needs the database configured by the DB_* environment variables. The scratch schema is dropped afterwards.
+
+Usage: python -m benchmarks.hybrid_search [--documents 100000] [--queries 200] [--concurrency 8] [--embed-ms 50]
+"""
+
+import argparse
+import asyncio
+import hashlib
+import time
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+import numpy as np
+from agno.embedder.base import Embedder
+from agno.vectordb.pgvector import HNSW, PgVector, SearchType
+from sqlalchemy import text
+
+from db.ingestion import format_vector
+from db.knowledge import HybridSearchCache, KnowledgeVectorDb
+from db.session import db_async_engine, db_engine
+from db.vector_index import ensure_vector_index
+
+WORDS = [
+    "agent", "session", "storage", "vector", "index", "query", "team", "workflow", "model", "memory",
+    "knowledge", "search", "latency", "recall", "embedding", "document", "chunk", "token", "stream", "cache",
+    "partition", "replica", "lighthouse", "harbor", "glacier", "canyon", "meadow", "orchard", "quarry", "summit",
+]  # fmt: skip
+
+
+@dataclass
+class BenchmarkEmbedder(Embedder):
+    """Embeds texts into random unit vectors seeded by the text, after waiting like an embedding request."""
+
+    delay_ms: float = 0
+
+    def get_embedding(self, text: str) -> List[float]:
+        time.sleep(self.delay_ms / 1000)
+        seed = int.from_bytes(hashlib.sha256(text.encode()).digest()[:8], "little")
+        vector = np.random.default_rng(seed).standard_normal(self.dimensions or 1536)
+        return [float(value) for value in vector / np.linalg.norm(vector)]
+
+    def get_embedding_and_usage(self, text: str) -> Tuple[List[float], Optional[Dict]]:
+        return self.get_embedding(text), None
+
+
+def load_documents(vector_db: KnowledgeVectorDb, schema: str, documents: int, dims: int) -> None:
+    rng = np.random.default_rng(42)
+    with db_engine.begin() as conn:
+        conn.execute(text(f"DROP SCHEMA IF EXISTS {schema} CASCADE"))
+    vector_db.create()
+    table = vector_db.table.fullname
+
+    centers = rng.standard_normal((100, dims)).astype(np.float32)
+    with db_engine.connect() as conn:
+        cursor = conn.connection.dbapi_connection.cursor()  # type: ignore[union-attr]
+        with cursor.copy(f"COPY {table} (id, name, content, content_hash, embedding) FROM STDIN") as copy:
+            for i in range(documents):
+                vector = centers[i % 100] + 0.5 * rng.standard_normal(dims).astype(np.float32)
+                content = " ".join(rng.choice(WORDS, size=40))
+                copy.write_row(
+                    [str(i), f"doc_{i}", content, str(i), format_vector((vector / np.linalg.norm(vector)).tolist())]
+                )
+        conn.commit()
+
+    ensure_vector_index(vector_db, vector_db.vector_index, concurrently=False)  # type: ignore[arg-type]
+    with db_engine.connect() as conn:
+        conn = conn.execution_options(isolation_level="AUTOCOMMIT")
+        conn.execute(
+            text(f"CREATE INDEX ON {table} USING gin (to_tsvector('{vector_db.content_language}'::regconfig, content))")
+        )
+        conn.execute(text(f"VACUUM ANALYZE {table}"))
+
+
+def summarize(latencies: List[float], seconds: float) -> Dict[str, float]:
+    latencies = sorted(latencies)
+    return {
+        "p50_ms": latencies[len(latencies) // 2] * 1000,
+        "p99_ms": latencies[min(len(latencies) - 1, int(len(latencies) * 0.99))] * 1000,
+        "qps": len(latencies) / seconds,
+    }
+
+
+def run_threads(search: Callable[[str], Any], queries: List[str], concurrency: int) -> Dict[str, float]:
+    def timed(query: str) -> float:
+        start = time.perf_counter()
+        search(query)
+        return time.perf_counter() - start
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(concurrency) as executor:
+        latencies = list(executor.map(timed, queries))
+    return summarize(latencies, time.perf_counter() - start)
+
+
+async def run_tasks(vector_db: KnowledgeVectorDb, queries: List[str], concurrency: int, limit: int) -> Dict[str, float]:
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def timed(query: str) -> float:
+        async with semaphore:
+            start = time.perf_counter()
+            await vector_db.async_hybrid_search(query, limit=limit)
+            return time.perf_counter() - start
+
+    start = time.perf_counter()
+    latencies = await asyncio.gather(*[timed(query) for query in queries])
+    return summarize(list(latencies), time.perf_counter() - start)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--documents", type=int, default=100_000)
+    parser.add_argument("--dims", type=int, default=1536)
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--embed-ms", type=float, default=50, help="Time to embed a query")
+    parser.add_argument("--limit", type=int, default=5)
+    parser.add_argument("--schema", default="benchmark")
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(7)
+    queries = [" ".join(rng.choice(WORDS, size=int(rng.integers(1, 4)))) for _ in range(args.queries)]
+    vector_db = KnowledgeVectorDb(
+        table_name="hybrid_search",
+        schema=args.schema,
+        db_engine=db_engine,
+        async_engine=db_async_engine,
+        embedder=BenchmarkEmbedder(dimensions=args.dims, delay_ms=args.embed_ms),
+        search_type=SearchType.hybrid,
+        vector_index=HNSW(),
+        search_cache=None,
+    )
+    print(f"Loading {args.documents} documents in schema {args.schema}")
+    load_documents(vector_db, args.schema, args.documents, args.dims)
+    try:
+        results: Dict[str, Dict[str, float]] = {}
+        results["pgvector hybrid"] = run_threads(
+            lambda query: PgVector.hybrid_search(vector_db, query, limit=args.limit), queries, args.concurrency
+        )
+        results["fused"] = run_threads(
+            lambda query: vector_db.hybrid_search(query, limit=args.limit), queries, args.concurrency
+        )
+        results["fused async"] = asyncio.run(run_tasks(vector_db, queries, args.concurrency, args.limit))
+
+        # Every query once to fill the cache, then timed on the second pass
+        vector_db.search_cache = HybridSearchCache(ttl=3600, max_entries=len(queries))
+        run_threads(lambda query: vector_db.hybrid_search(query, limit=args.limit), queries, args.concurrency)
+        results["fused cached"] = run_threads(
+            lambda query: vector_db.hybrid_search(query, limit=args.limit), queries, args.concurrency
+        )
+    finally:
+        with db_engine.begin() as conn:
+            conn.execute(text(f"DROP SCHEMA IF EXISTS {args.schema} CASCADE"))
+
+    print(
+        f"{args.documents} documents, {args.queries} queries, {args.concurrency} concurrent, "
+        f"{args.embed_ms:.0f}ms embeddings"
+    )
+    print(f"{'search':<16} {'p50':>10} {'p99':>10} {'qps':>8}")
+    for name, r in results.items():
+        print(f"{name:<16} {r['p50_ms']:>8.2f}ms {r['p99_ms']:>8.2f}ms {r['qps']:>8.0f}")
+
+
+if __name__ == "__main__":
+    main()
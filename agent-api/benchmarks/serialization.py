@@ -0,0 +1,108 @@
+"""Serialization micro-benchmark.
+
+Compares the JSON paths used before utils.serialization with dumps(), on payloads shaped like the blog post
+workflow's SearchResults and ScrapedArticle lists:
+  - response: FastAPI's default path, jsonable_encoder() then JSONResponse.render()
+  - workflow input: model_dump() of each article then json.dumps(indent=4)
+  - stream event: json.dumps(default=str) of a content_delta event with a structured output
+
+Usage: python -m benchmarks.serialization [--sizes 10 100 1000] [--article-kb 4]
+"""
+
+import argparse
+import json
+import timeit
+from typing import Any, Callable, Dict, List
+
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import JSONResponse
+from pydantic import BaseModel
+
+from utils.serialization import dumps, dumps_str, json_backend
+from workflows.blog_post_generator import NewsArticle, ScrapedArticle, SearchResults
+
+
+def get_search_results(size: int) -> SearchResults:
+    return SearchResults(
+        articles=[
+            NewsArticle(
+                title=f"Article {i} on the impact of open models on enterprise software",
+                url=f"https://example.com/news/{i}",
+                summary="A short summary of the article with a few sentences about the topic. " * 3,
+            )
+            for i in range(size)
+        ]
+    )
+
+
+def get_scraped_articles(size: int, article_kb: int) -> List[ScrapedArticle]:
+    paragraph = "Lorem ipsum dolor sit amet, **consectetur** adipiscing elit, sed do eiusmod tempor. ünïcødé ✨\n"
+    content = paragraph * (article_kb * 1024 // len(paragraph.encode("utf-8")))
+    return [
+        ScrapedArticle(
+            title=f"Article {i}",
+            url=f"https://example.com/news/{i}",
+            summary="A short summary of the article.",
+            content=content,
+        )
+        for i in range(size)
+    ]
+
+
+def time_call(fn: Callable[[], Any]) -> float:
+    """Returns the seconds per call of the fastest of 5 repeats."""
+    timer = timeit.Timer(fn)
+    number, _ = timer.autorange()
+    number = max(number, 1)
+    runs = timer.repeat(repeat=5, number=number)
+    return min(runs) / number
+
+
+def get_cases(size: int, article_kb: int) -> Dict[str, Dict[str, Callable[[], Any]]]:
+    search_results = get_search_results(size)
+    articles = get_scraped_articles(size, article_kb)
+    event_content: BaseModel = search_results
+
+    return {
+        f"response: SearchResults[{size}]": {
+            "current": lambda: JSONResponse(jsonable_encoder(search_results)).body,
+            "fast": lambda: dumps(search_results),
+        },
+        f"response: ScrapedArticle[{size}]": {
+            "current": lambda: JSONResponse(jsonable_encoder(articles)).body,
+            "fast": lambda: dumps(articles),
+        },
+        f"workflow input: ScrapedArticle[{size}]": {
+            "current": lambda: json.dumps(
+                {"topic": "AI", "articles": [article.model_dump() for article in articles]}, indent=4
+            ),
+            "fast": lambda: dumps_str({"topic": "AI", "articles": articles}, indent=True),
+        },
+        f"stream event: SearchResults[{size}]": {
+            "current": lambda: json.dumps({"content": event_content.model_dump(exclude_none=True)}, default=str),
+            "fast": lambda: dumps_str({"content": event_content}),
+        },
+    }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", type=int, nargs="+", default=[10, 100, 1000])
+    parser.add_argument("--article-kb", type=int, default=4)
+    args = parser.parse_args()
+
+    print(f"JSON backend: {json_backend}")
+    print(f"{'case':<40} {'current':>12} {'fast':>12} {'speedup':>9} {'bytes':>10}")
+    for size in args.sizes:
+        for name, paths in get_cases(size, args.article_kb).items():
+            current = time_call(paths["current"])
+            fast = time_call(paths["fast"])
+            output = paths["fast"]()
+            size_bytes = len(output if isinstance(output, bytes) else output.encode("utf-8"))
+            print(
+                f"{name:<40} {current * 1000:>10.3f}ms {fast * 1000:>10.3f}ms {current / fast:>8.1f}x {size_bytes:>10}"
+            )
+
+
+if __name__ == "__main__":
+    main()
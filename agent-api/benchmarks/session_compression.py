@@ -0,0 +1,202 @@
+"""Session compression benchmark.
+
+Compares storing the memory and session_data of sessions as plain JSONB with the compressed values written by
+db.compression, on sessions read from a session table or on synthetic sessions shaped like the blog post
+workflow's session_state (scraped articles and finished blog posts):
+  - encode / decode: CPU time to build the column values of a session and to read them back
+  - write / read: latency of upserting each session and reading it by session_id, in a scratch schema
+  - disk: size of the scratch table with its TOAST table and indexes
+
+Reading sessions and the write, read and disk cases need the database configured by the DB_* environment
+variables. With --synthetic and --no-db the benchmark runs without a database.
+
+Usage: python -m benchmarks.session_compression [--table ai.blog_post_generator_workflows] [--limit 200]
+       python -m benchmarks.session_compression --synthetic 200 [--article-kb 8] [--no-db]
+"""
+
+import argparse
+import time
+from typing import Any, Callable, Dict, List, Optional
+
+from sqlalchemy import Engine, bindparam, text
+from sqlalchemy.dialects.postgresql import JSONB
+
+from db.compression import compress_json, compression_version, decompress_json
+from db.settings import db_settings
+from utils.serialization import dumps, loads
+
+COLUMNS = ("memory", "session_data")
+
+
+def get_synthetic_sessions(count: int, article_kb: int) -> List[Dict[str, Any]]:
+    paragraph = "Lorem ipsum dolor sit amet, **consectetur** adipiscing elit, sed do eiusmod tempor incididunt.\n"
+    content = paragraph * (article_kb * 1024 // len(paragraph))
+    sessions = []
+    for i in range(count):
+        articles = {
+            f"https://example.com/news/{i}/{j}": {
+                "title": f"Article {j} on topic {i}",
+                "url": f"https://example.com/news/{i}/{j}",
+                "summary": "A short summary of the article.",
+                "content": f"{j} {content}",
+            }
+            for j in range(5)
+        }
+        blog_post = f"# Topic {i}\n\n" + paragraph * 40
+        sessions.append(
+            {
+                "session_id": f"session-{i}",
+                "memory": {"runs": [{"input": f"Topic {i}", "content": blog_post, "event": "RunResponse"}]},
+                "session_data": {
+                    "session_state": {
+                        "scraped_articles": {f"topic {i}": articles},
+                        "blog_posts": {f"topic {i}": blog_post},
+                    }
+                },
+            }
+        )
+    return sessions
+
+
+def read_sessions(engine: Engine, table: str, limit: int) -> List[Dict[str, Any]]:
+    """Reads the largest sessions of a table, decompressing compressed columns."""
+    with engine.connect() as conn:
+        rows = conn.execute(
+            text(
+                f"SELECT session_id, memory, session_data FROM {table} "
+                "ORDER BY pg_column_size(memory) + pg_column_size(session_data) DESC LIMIT :limit"
+            ),
+            {"limit": limit},
+        ).all()
+    return [
+        {"session_id": row.session_id, **{column: decompress_json(getattr(row, column)) for column in COLUMNS}}
+        for row in rows
+    ]
+
+
+def get_rows(sessions: List[Dict[str, Any]], threshold: Optional[int]) -> List[Dict[str, Any]]:
+    return [
+        {
+            "session_id": session["session_id"],
+            **{column: compress_json(session[column], threshold) for column in COLUMNS},
+        }
+        for session in sessions
+    ]
+
+
+def time_each(fn: Callable[[Dict[str, Any]], Any], items: List[Dict[str, Any]]) -> float:
+    """Returns the mean milliseconds of fn over the items, best of 3 passes."""
+    best = float("inf")
+    for _ in range(3):
+        start = time.perf_counter()
+        for item in items:
+            fn(item)
+        best = min(best, time.perf_counter() - start)
+    return best / len(items) * 1000
+
+
+def run_cpu_cases(sessions: List[Dict[str, Any]], threshold: int) -> Dict[str, Dict[str, float]]:
+    results: Dict[str, Dict[str, float]] = {}
+    for name, case_threshold in (("plain", None), ("compressed", threshold)):
+        rows = get_rows(sessions, case_threshold)
+        stored = [{column: dumps(row[column]) for column in COLUMNS} for row in rows]
+        results[name] = {
+            "encode_ms": time_each(
+                lambda session: [dumps(compress_json(session[c], case_threshold)) for c in COLUMNS], sessions
+            ),
+            "decode_ms": time_each(lambda values: [decompress_json(loads(values[c])) for c in COLUMNS], stored),
+            "json_bytes": sum(len(value) for values in stored for value in values.values()),
+        }
+    return results
+
+
+def run_db_cases(
+    engine: Engine, sessions: List[Dict[str, Any]], threshold: int, schema: str
+) -> Dict[str, Dict[str, float]]:
+    results: Dict[str, Dict[str, float]] = {}
+    with engine.begin() as conn:
+        conn.execute(text(f"DROP SCHEMA IF EXISTS {schema} CASCADE"))
+        conn.execute(text(f"CREATE SCHEMA {schema}"))
+    upsert = text(
+        f"INSERT INTO {schema}.sessions (session_id, memory, session_data) "
+        "VALUES (:session_id, :memory, :session_data) ON CONFLICT (session_id) "
+        "DO UPDATE SET memory = excluded.memory, session_data = excluded.session_data"
+    ).bindparams(bindparam("memory", type_=JSONB), bindparam("session_data", type_=JSONB))
+    columns = [f"{column} jsonb" for column in COLUMNS]
+    select = text(f"SELECT memory, session_data FROM {schema}.sessions WHERE session_id = :session_id")
+    try:
+        for name, case_threshold in (("plain", None), ("compressed", threshold)):
+            with engine.begin() as conn:
+                conn.execute(text(f"DROP TABLE IF EXISTS {schema}.sessions"))
+                conn.execute(
+                    text(f"CREATE TABLE {schema}.sessions (session_id text PRIMARY KEY, {', '.join(columns)})")
+                )
+            rows = get_rows(sessions, case_threshold)
+
+            def write(row: Dict[str, Any]) -> None:
+                with engine.begin() as conn:
+                    conn.execute(upsert, row)
+
+            def read(row: Dict[str, Any]) -> None:
+                with engine.connect() as conn:
+                    values = conn.execute(select, {"session_id": row["session_id"]}).one()
+                    [decompress_json(value) for value in values]
+
+            write_ms = time_each(write, rows)
+            read_ms = time_each(read, rows)
+            # Rewrite the table without the row versions left by the repeated upserts
+            with engine.connect().execution_options(isolation_level="AUTOCOMMIT") as conn:
+                conn.execute(text(f"VACUUM FULL {schema}.sessions"))
+                disk_bytes = conn.execute(text(f"SELECT pg_total_relation_size('{schema}.sessions')")).scalar_one()
+            results[name] = {"write_ms": write_ms, "read_ms": read_ms, "disk_bytes": disk_bytes}
+    finally:
+        with engine.begin() as conn:
+            conn.execute(text(f"DROP SCHEMA IF EXISTS {schema} CASCADE"))
+    return results
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--table", default="ai.blog_post_generator_workflows")
+    parser.add_argument("--limit", type=int, default=200)
+    parser.add_argument("--synthetic", type=int, help="Benchmark this many synthetic sessions")
+    parser.add_argument("--article-kb", type=int, default=8)
+    parser.add_argument("--threshold", type=int, default=db_settings.session_compression_threshold or 16 * 1024)
+    parser.add_argument("--schema", default="benchmark")
+    parser.add_argument("--no-db", action="store_true", help="Skip the write, read and disk cases")
+    args = parser.parse_args()
+
+    engine: Optional[Engine] = None
+    if not (args.synthetic and args.no_db):
+        from db.session import db_engine
+
+        engine = db_engine
+    if args.synthetic:
+        sessions = get_synthetic_sessions(args.synthetic, args.article_kb)
+        source = f"{len(sessions)} synthetic sessions"
+    else:
+        assert engine is not None
+        sessions = read_sessions(engine, args.table, args.limit)
+        source = f"{len(sessions)} sessions from {args.table}"
+    if not sessions:
+        print(f"No sessions in {args.table}")
+        return
+
+    print(f"{source}, compression version {compression_version}, threshold {args.threshold} bytes")
+    cpu = run_cpu_cases(sessions, args.threshold)
+    print(f"{'case':<12} {'encode':>10} {'decode':>10} {'json bytes':>12}")
+    for name, result in cpu.items():
+        print(f"{name:<12} {result['encode_ms']:>8.3f}ms {result['decode_ms']:>8.3f}ms {result['json_bytes']:>12}")
+    print(f"size ratio: {cpu['plain']['json_bytes'] / cpu['compressed']['json_bytes']:.1f}x")
+
+    if engine is None or args.no_db:
+        return
+    db = run_db_cases(engine, sessions, args.threshold, args.schema)
+    print(f"{'case':<12} {'write':>10} {'read':>10} {'disk bytes':>12}")
+    for name, result in db.items():
+        print(f"{name:<12} {result['write_ms']:>8.3f}ms {result['read_ms']:>8.3f}ms {result['disk_bytes']:>12}")
+    print(f"disk ratio: {db['plain']['disk_bytes'] / db['compressed']['disk_bytes']:.1f}x")
+
+
+if __name__ == "__main__":
+    main()
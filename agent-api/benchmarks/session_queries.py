@@ -0,0 +1,166 @@
+"""Session and knowledge query benchmark.
+
+Times the queries that the indexes of the a1e6c0f4d827 migration serve, on tables seeded in a scratch schema, before
+and after the indexes are created:
+  - user sessions: sessions of a user, newest first
+  - idle sessions: sessions without activity for 90 days, as selected by the compaction job
+  - keyword search: knowledge documents matching a full-text query
+  - filtered search: knowledge documents matching a filters @> '{...}' condition
+
+Needs the database configured by the DB_* environment variables. The scratch schema is dropped afterwards.
+
+Usage: python -m benchmarks.session_queries [--sessions 100000] [--documents 50000] [--schema benchmark]
+"""
+
+import argparse
+import time
+from typing import Dict, List, Tuple
+
+from sqlalchemy import Engine, Index, Table, text
+
+from db.session import db_engine
+from db.tables import SageKnowledge, SageSession
+
+QUERIES: Dict[str, str] = {
+    "user sessions": """
+        SELECT session_id FROM {schema}.sage_sessions
+        WHERE user_id = 'user_42' ORDER BY created_at DESC LIMIT 20
+    """,
+    "idle sessions": """
+        SELECT session_id FROM {schema}.sage_sessions
+        WHERE coalesce(updated_at, created_at) < extract(epoch from now())::bigint - 86400 * 90
+        ORDER BY session_id LIMIT 100
+    """,
+    "keyword search": """
+        SELECT id FROM {schema}.sage_knowledge
+        WHERE to_tsvector('english'::regconfig, content) @@ plainto_tsquery('english', 'lighthouse')
+        LIMIT 20
+    """,
+    "filtered search": """
+        SELECT id FROM {schema}.sage_knowledge
+        WHERE filters @> '{{"source": "source_7"}}'::jsonb
+        LIMIT 20
+    """,
+}
+
+WORDS = ["agent", "session", "storage", "vector", "index", "query", "team", "workflow", "model", "memory"]
+
+
+def get_new_indexes() -> List[Index]:
+    """Returns the indexes added by the migration, the others are created by agno with the tables."""
+    return [
+        index
+        for model in (SageSession, SageKnowledge)
+        for index in model.__table__.indexes  # type: ignore[attr-defined]
+        if index.name is not None and not index.name.startswith(("ix_ai_", "idx_"))
+    ]
+
+
+def create_tables(engine: Engine, schema: str, sessions: int, documents: int) -> None:
+    with engine.begin() as conn:
+        conn.execute(text("CREATE EXTENSION IF NOT EXISTS vector"))
+        conn.execute(text(f"DROP SCHEMA IF EXISTS {schema} CASCADE"))
+        conn.execute(text(f"CREATE SCHEMA {schema}"))
+        scratch = conn.execution_options(schema_translate_map={"ai": schema})
+        new_indexes = {index.name for index in get_new_indexes()}
+        for model in (SageSession, SageKnowledge):
+            table: Table = model.__table__  # type: ignore[assignment]
+            table.create(scratch)
+            for index in table.indexes:
+                if index.name in new_indexes:
+                    scratch.execute(text(f"DROP INDEX {schema}.{index.name}"))
+
+        # 1000 users, sessions created over a year and half of them updated since
+        conn.execute(
+            text(
+                f"""
+                INSERT INTO {schema}.sage_sessions (session_id, user_id, agent_id, memory, created_at, updated_at)
+                SELECT
+                    md5(i::text),
+                    'user_' || (i % 1000),
+                    'sage',
+                    jsonb_build_object('runs', jsonb_build_array(jsonb_build_object('message', repeat('x', 512)))),
+                    extract(epoch from now())::bigint - (random() * 86400 * 365)::bigint,
+                    CASE WHEN i % 2 = 0 THEN extract(epoch from now())::bigint - (random() * 86400 * 30)::bigint END
+                FROM generate_series(1, :sessions) AS i
+                """
+            ),
+            {"sessions": sessions},
+        )
+        # Documents of 200 words from a small vocabulary, with a rare word in 1 of 1000
+        conn.execute(
+            text(
+                f"""
+                INSERT INTO {schema}.sage_knowledge (id, name, content, filters, content_hash)
+                SELECT
+                    md5(i::text),
+                    'document_' || (i / 20),
+                    (
+                        SELECT string_agg((:words)[1 + ((i * 31 + j * 7) % 10)], ' ')
+                        FROM generate_series(1, 200) AS j
+                    ) || CASE WHEN i % 1000 = 0 THEN ' lighthouse' ELSE '' END,
+                    jsonb_build_object('source', 'source_' || (i % 500)),
+                    md5(i::text)
+                FROM generate_series(1, :documents) AS i
+                """
+            ),
+            {"documents": documents, "words": WORDS},
+        )
+        conn.execute(text(f"ANALYZE {schema}.sage_sessions"))
+        conn.execute(text(f"ANALYZE {schema}.sage_knowledge"))
+
+
+def create_indexes(engine: Engine, schema: str) -> None:
+    with engine.begin() as conn:
+        scratch = conn.execution_options(schema_translate_map={"ai": schema})
+        for index in get_new_indexes():
+            index.create(scratch)
+        conn.execute(text(f"ANALYZE {schema}.sage_sessions"))
+        conn.execute(text(f"ANALYZE {schema}.sage_knowledge"))
+
+
+def time_query(engine: Engine, query: str, repeat: int) -> Tuple[float, str]:
+    """Returns the milliseconds of the fastest run and the top node of the query plan."""
+    timings = []
+    with engine.connect() as conn:
+        plan = conn.execute(text(f"EXPLAIN {query}")).scalars().all()
+        for _ in range(repeat):
+            start = time.perf_counter()
+            conn.execute(text(query)).fetchall()
+            timings.append(time.perf_counter() - start)
+    # The first scan node shows whether an index is used
+    nodes = [line.strip().lstrip("-> ") for line in plan if "Scan" in line]
+    node = (nodes[0] if nodes else plan[0]).split("  (")[0]
+    return min(timings) * 1000, node
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sessions", type=int, default=100_000)
+    parser.add_argument("--documents", type=int, default=50_000)
+    parser.add_argument("--schema", default="benchmark")
+    parser.add_argument("--repeat", type=int, default=10)
+    args = parser.parse_args()
+
+    print(f"Seeding {args.sessions} sessions and {args.documents} documents in schema {args.schema}")
+    create_tables(db_engine, args.schema, args.sessions, args.documents)
+    try:
+        results: Dict[str, Dict[str, Tuple[float, str]]] = {"before": {}, "after": {}}
+        for name, query in QUERIES.items():
+            results["before"][name] = time_query(db_engine, query.format(schema=args.schema), args.repeat)
+        create_indexes(db_engine, args.schema)
+        for name, query in QUERIES.items():
+            results["after"][name] = time_query(db_engine, query.format(schema=args.schema), args.repeat)
+    finally:
+        with db_engine.begin() as conn:
+            conn.execute(text(f"DROP SCHEMA IF EXISTS {args.schema} CASCADE"))
+
+    print(f"{'query':<18} {'before':>10} {'after':>10} {'speedup':>9}  plan after")
+    for name in QUERIES:
+        before, _ = results["before"][name]
+        after, node = results["after"][name]
+        print(f"{name:<18} {before:>8.2f}ms {after:>8.2f}ms {before / after:>8.1f}x  {node}")
+
+
+if __name__ == "__main__":
+    main()
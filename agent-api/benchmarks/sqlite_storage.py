@@ -0,0 +1,140 @@
+"""SQLite session storage concurrency benchmark.
+
+Compares the default SqliteStorage(db_file=...), as used by agents/10_persisting_state_in_database.py, with the
+tuned storage of db.sqlite, on concurrent agent runs sharing one database file. Each run thread reads a session,
+waits --think-ms like a model call, and upserts the session. Reader threads read random sessions every
+--read-interval-ms, like the playground listing and loading sessions. Reports throughput, latency percentiles and
+failed operations (the default storage logs "database is locked" errors and returns None).
+
+Each case uses a fresh database file in a temporary directory, no database configuration is needed.
+
+Usage: python -m benchmarks.sqlite_storage [--runs 16] [--turns 50] [--readers 8] [--sessions 100]
+"""
+
+import argparse
+import random
+import tempfile
+import threading
+import time
+from pathlib import Path
+from typing import Any, Callable, Dict, List
+
+from agno.storage.session import AgentSession
+from agno.storage.sqlite import SqliteStorage
+
+from db.sqlite import get_sqlite_storage
+
+
+def get_session(session_id: str, turn: int, run_kb: int) -> AgentSession:
+    content = "Lorem ipsum dolor sit amet, consectetur adipiscing elit. " * (run_kb * 1024 // 56)
+    return AgentSession(
+        session_id=session_id,
+        agent_id="benchmark-agent",
+        user_id="benchmark-user",
+        memory={"runs": [{"input": f"Turn {i}", "content": content} for i in range(turn % 5 + 1)]},
+        agent_data={"name": "Benchmark Agent"},
+        session_data={"session_state": {"turn": turn}},
+    )
+
+
+def percentile(latencies: List[float], q: float) -> float:
+    if not latencies:
+        return 0.0
+    return sorted(latencies)[min(len(latencies) - 1, int(len(latencies) * q))] * 1000
+
+
+def run_case(storage: Any, args: argparse.Namespace) -> Dict[str, Any]:
+    session_ids = [f"session-{i}" for i in range(args.sessions)]
+    for i, session_id in enumerate(session_ids):
+        storage.upsert(get_session(session_id, i, args.run_kb))
+
+    write_latencies: List[float] = []
+    read_latencies: List[float] = []
+    failures = {"write": 0, "read": 0}
+    lock = threading.Lock()
+    runs_done = threading.Event()
+
+    def timed(fn: Callable[[], Any], latencies: List[float], kind: str) -> None:
+        start = time.perf_counter()
+        ok = fn() is not None
+        elapsed = time.perf_counter() - start
+        with lock:
+            latencies.append(elapsed)
+            failures[kind] += 0 if ok else 1
+
+    def run(worker: int) -> None:
+        rng = random.Random(worker)
+        for turn in range(args.turns):
+            session_id = rng.choice(session_ids)
+            timed(lambda: storage.read(session_id), read_latencies, "read")
+            time.sleep(args.think_ms / 1000)
+            session = get_session(session_id, turn, args.run_kb)
+            timed(lambda: storage.upsert(session), write_latencies, "write")
+
+    def read(worker: int) -> None:
+        rng = random.Random(1000 + worker)
+        while not runs_done.is_set():
+            session_id = rng.choice(session_ids)
+            timed(lambda: storage.read(session_id), read_latencies, "read")
+            time.sleep(args.read_interval_ms / 1000)
+
+    runs = [threading.Thread(target=run, args=(i,)) for i in range(args.runs)]
+    readers = [threading.Thread(target=read, args=(i,)) for i in range(args.readers)]
+    start = time.perf_counter()
+    for thread in runs + readers:
+        thread.start()
+    for thread in runs:
+        thread.join()
+    runs_done.set()
+    for thread in readers:
+        thread.join()
+    elapsed = time.perf_counter() - start
+
+    return {
+        "writes_per_s": len(write_latencies) / elapsed,
+        "reads_per_s": len(read_latencies) / elapsed,
+        "write_p50_ms": percentile(write_latencies, 0.5),
+        "write_p99_ms": percentile(write_latencies, 0.99),
+        "read_p50_ms": percentile(read_latencies, 0.5),
+        "read_p99_ms": percentile(read_latencies, 0.99),
+        "failed_writes": failures["write"],
+        "failed_reads": failures["read"],
+    }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--runs", type=int, default=16, help="Concurrent agent runs")
+    parser.add_argument("--turns", type=int, default=50, help="Turns of each run thread")
+    parser.add_argument("--think-ms", type=float, default=20)
+    parser.add_argument("--readers", type=int, default=8)
+    parser.add_argument("--read-interval-ms", type=float, default=5)
+    parser.add_argument("--sessions", type=int, default=100)
+    parser.add_argument("--run-kb", type=int, default=2, help="Size of each run in a session's memory")
+    args = parser.parse_args()
+
+    results: Dict[str, Dict[str, Any]] = {}
+    with tempfile.TemporaryDirectory() as tmp:
+        default = SqliteStorage(table_name="agent_sessions", db_file=str(Path(tmp) / "default.db"))
+        results["default"] = run_case(default, args)
+        tuned = get_sqlite_storage(table_name="agent_sessions", db_file=str(Path(tmp) / "tuned.db"))
+        results["tuned"] = run_case(tuned, args)
+        tuned.writer.stop()
+
+    print(
+        f"{args.runs} runs x {args.turns} turns, {args.readers} readers, {args.sessions} sessions, {args.run_kb}KB runs"
+    )
+    print(
+        f"{'case':<8} {'writes/s':>9} {'reads/s':>9} {'write p50':>10} {'write p99':>10} "
+        f"{'read p50':>9} {'read p99':>9} {'failed w/r':>11}"
+    )
+    for name, r in results.items():
+        print(
+            f"{name:<8} {r['writes_per_s']:>9.0f} {r['reads_per_s']:>9.0f} {r['write_p50_ms']:>8.2f}ms "
+            f"{r['write_p99_ms']:>8.2f}ms {r['read_p50_ms']:>7.2f}ms {r['read_p99_ms']:>7.2f}ms "
+            f"{r['failed_writes']:>5}/{r['failed_reads']:<5}"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,115 @@
+"""Startup benchmark for the API.
+
+Reports, for fresh interpreters:
+  - the time to import `api.main`
+  - the time from starting `uvicorn api.main:app` to the first successful request to /v1/health
+  - the time of the first playground request, which builds the playground agents
+
+Usage: python -m benchmarks.startup [--runs 5] [--port 8765]
+"""
+
+import argparse
+import os
+import socket
+import statistics
+import subprocess
+import sys
+import time
+import urllib.error
+import urllib.request
+from pathlib import Path
+from typing import List, Optional
+
+API_DIR = Path(__file__).resolve().parent.parent
+
+IMPORT_SCRIPT = """
+import time
+start = time.perf_counter()
+import api.main
+print(time.perf_counter() - start)
+"""
+
+
+def measure_import() -> float:
+    """Returns the seconds taken to import api.main in a new interpreter."""
+    output = subprocess.run(
+        [sys.executable, "-c", IMPORT_SCRIPT], cwd=API_DIR, check=True, capture_output=True, text=True
+    ).stdout
+    return float(output.strip().splitlines()[-1])
+
+
+def wait_for(url: str, timeout: float, process: subprocess.Popen) -> Optional[float]:
+    """Polls the url until it returns a response. Returns the seconds waited, or None on timeout."""
+    start = time.perf_counter()
+    while time.perf_counter() - start < timeout:
+        if process.poll() is not None:
+            return None
+        try:
+            with urllib.request.urlopen(url, timeout=timeout) as response:
+                response.read()
+                return time.perf_counter() - start
+        except urllib.error.HTTPError:
+            # The server is up, the request failed, eg: the database is not available
+            return time.perf_counter() - start
+        except (urllib.error.URLError, ConnectionError):
+            time.sleep(0.01)
+    return None
+
+
+def get_free_port(port: int) -> int:
+    with socket.socket() as s:
+        if s.connect_ex(("127.0.0.1", port)) != 0:
+            return port
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def measure_first_requests(port: int, timeout: float) -> List[Optional[float]]:
+    """Starts uvicorn and returns the seconds to the first /v1/health and /v1/playground/agents responses."""
+    port = get_free_port(port)
+    base_url = f"http://127.0.0.1:{port}"
+    process = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "api.main:app", "--port", str(port), "--log-level", "warning"],
+        cwd=API_DIR,
+        env={**os.environ, "PYTHONUNBUFFERED": "1"},
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL,
+    )
+    try:
+        health = wait_for(f"{base_url}/v1/health", timeout, process)
+        playground = wait_for(f"{base_url}/v1/playground/agents", timeout, process) if health is not None else None
+        return [health, playground]
+    finally:
+        process.terminate()
+        process.wait(timeout=10)
+
+
+def summarize(name: str, values: List[Optional[float]]) -> None:
+    measured = [v for v in values if v is not None]
+    if not measured:
+        print(f"{name:<36} failed")
+        return
+    print(
+        f"{name:<36} median {statistics.median(measured):7.3f}s  min {min(measured):7.3f}s  "
+        f"max {max(measured):7.3f}s  ({len(measured)}/{len(values)} runs)"
+    )
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--timeout", type=float, default=60)
+    args = parser.parse_args()
+
+    imports = [measure_import() for _ in range(args.runs)]
+    requests = [measure_first_requests(args.port, args.timeout) for _ in range(args.runs)]
+
+    summarize("import api.main", list(imports))
+    summarize("time to first request (/v1/health)", [r[0] for r in requests])
+    summarize("first playground request", [r[1] for r in requests])
+
+
+if __name__ == "__main__":
+    main()
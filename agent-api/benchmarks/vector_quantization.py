@@ -0,0 +1,104 @@
+"""Quantized vector index benchmark.
+
+Measures recall@k, query latency and index size of HNSW indexes over the float32 embeddings, their halfvec cast and
+their binary quantization, against an exact search of the same table. Quantized searches re-rank the candidates of
+the index by their float32 distance, at increasing rerank factors. The dataset is loaded in a scratch schema, as in
+benchmarks/vector_recall.py, either as clustered random vectors or copied from a knowledge table with --source.
+
+Needs the database configured by the DB_* environment variables, with pgvector >= 0.7.0. The scratch schema is
+dropped afterwards.
+
+Usage: python -m benchmarks.vector_quantization [--rows 100000] [--dims 1536] [--queries 200] [-k 10] [--source TABLE]
+"""
+
+import argparse
+import time
+from typing import Any, Dict, List
+
+from agno.embedder.openai import OpenAIEmbedder
+from agno.vectordb.pgvector import HNSW
+from sqlalchemy import text
+
+from benchmarks.vector_recall import load_dataset, run_queries, search_ids
+from db.knowledge import KnowledgeVectorDb
+from db.session import db_engine
+from db.vector_index import QUANTIZATIONS, get_vector_indexes, rebuild_vector_index
+
+RERANK_FACTORS = [1, 2, 4, 8]
+
+
+def get_vector_db(schema: str, dims: int, quantization: str = "none") -> KnowledgeVectorDb:
+    # The embedder is never called, the benchmark searches by embedding
+    return KnowledgeVectorDb(
+        table_name="vector_quantization",
+        schema=schema,
+        db_engine=db_engine,
+        embedder=OpenAIEmbedder(dimensions=dims),
+        vector_index=HNSW(),
+        quantization=quantization,
+    )
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rows", type=int, default=100_000)
+    parser.add_argument("--dims", type=int, default=1536, help="Dimensions of the random vectors")
+    parser.add_argument("--clusters", type=int, default=100, help="Clusters of the random vectors")
+    parser.add_argument("--source", help="Copy the rows from this knowledge table instead, eg: ai.sage_knowledge")
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--noise", type=float, default=0.1, help="Noise added to the query vectors")
+    parser.add_argument("-k", type=int, default=10, help="Results per query")
+    parser.add_argument("--m", type=int, default=16)
+    parser.add_argument("--ef-construction", type=int, default=64)
+    parser.add_argument("--ef-search", type=int, default=40, help="Raised to the candidates read from the index")
+    parser.add_argument("--schema", default="benchmark")
+    args = parser.parse_args()
+
+    vector_db = get_vector_db(args.schema, args.dims)
+    print(f"Loading {args.rows} vectors in schema {args.schema}")
+    queries = load_dataset(vector_db, args)
+    try:
+        with db_engine.connect() as conn:
+            table_bytes = conn.scalar(
+                text("SELECT pg_table_size(to_regclass(:table))"), {"table": vector_db.table.fullname}
+            )
+
+        # Without an index, the nearest neighbours are exact
+        exact = [set(search_ids(vector_db, query, args.k)) for query in queries]
+        results: List[Dict[str, Any]] = []
+        for quantization in QUANTIZATIONS:
+            vector_db = get_vector_db(args.schema, args.dims, quantization)
+            start = time.monotonic()
+            rebuild_vector_index(vector_db, HNSW(m=args.m, ef_construction=args.ef_construction), concurrently=False)
+            build_seconds = time.monotonic() - start
+            size = sum(info.size_bytes for info in get_vector_indexes(vector_db))
+            for rerank_factor in [1] if quantization == "none" else RERANK_FACTORS:
+                vector_db.rerank_factor = rerank_factor
+                # Warm up the index pages before timing
+                run_queries(vector_db, queries[:10], exact[:10], args.k, ef_search=args.ef_search)
+                results.append(
+                    {
+                        "index": f"{quantization} {size / 2**20:.0f}MB",
+                        "rerank": f"{rerank_factor}x" if quantization != "none" else "",
+                        **run_queries(vector_db, queries, exact, args.k, ef_search=args.ef_search),
+                        "build_s": build_seconds,
+                    }
+                )
+    finally:
+        with db_engine.begin() as conn:
+            conn.execute(text(f"DROP SCHEMA IF EXISTS {args.schema} CASCADE"))
+
+    print(
+        f"{args.rows} rows ({(table_bytes or 0) / 2**20:.0f}MB table), {len(queries)} queries, "
+        f"recall@{args.k} against exact search, ef_search={args.ef_search}"
+    )
+    print(f"{'index':<14} {'rerank':<7} {'recall':>7} {'p50':>9} {'p99':>9} {'qps':>8} {'build':>8}")
+    for r in results:
+        print(
+            f"{r['index']:<14} {r['rerank']:<7} {r['recall']:>7.3f} {r['p50_ms']:>7.2f}ms {r['p99_ms']:>7.2f}ms "
+            f"{r['qps']:>8.0f} {r['build_s']:>7.1f}s"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,181 @@
+"""Vector index recall and latency benchmark.
+
+Measures recall@k and query latency of HNSW and IVFFlat indexes at increasing ef_search and probes, against an exact
+search of the same table. The dataset is loaded in a scratch schema, either as clustered random vectors or copied
+from an existing knowledge table with --source, eg: --source ai.sage_knowledge. Queries are vectors of the dataset
+with noise added, they are not in the table.
+
+Each index is built with the index management of db/vector_index.py and searched through KnowledgeVectorDb, as Sage
+searches its knowledge. Needs the database configured by the DB_* environment variables. The scratch schema is
+dropped afterwards.
+
+Usage: python -m benchmarks.vector_recall [--rows 100000] [--dims 1536] [--queries 200] [-k 10] [--source TABLE]
+"""
+
+import argparse
+import time
+from typing import Any, Dict, List, Optional, Set
+
+import numpy as np
+from agno.embedder.openai import OpenAIEmbedder
+from agno.vectordb.pgvector import HNSW, Ivfflat
+from sqlalchemy import text
+
+from db.ingestion import format_vector
+from db.knowledge import KnowledgeVectorDb
+from db.session import db_engine
+from db.vector_index import VectorIndex, drop_vector_index, get_vector_indexes, rebuild_vector_index
+
+EF_SEARCH = [10, 20, 40, 80, 160, 320]
+PROBES = [1, 2, 5, 10, 20, 50, 100]
+
+
+def get_vector_db(schema: str, dims: int, index: Optional[VectorIndex] = None) -> KnowledgeVectorDb:
+    # The embedder is never called, the benchmark searches by embedding
+    return KnowledgeVectorDb(
+        table_name="vector_recall",
+        schema=schema,
+        db_engine=db_engine,
+        embedder=OpenAIEmbedder(dimensions=dims),
+        vector_index=index or HNSW(),
+    )
+
+
+def get_clustered_vectors(rng: np.random.Generator, count: int, dims: int, clusters: int) -> np.ndarray:
+    """Returns unit vectors around random centers, closer to real embeddings than uniform noise."""
+    centers = rng.standard_normal((clusters, dims)).astype(np.float32)
+    vectors = centers[rng.integers(0, clusters, count)] + 0.5 * rng.standard_normal((count, dims)).astype(np.float32)
+    return vectors / np.linalg.norm(vectors, axis=1, keepdims=True)
+
+
+def load_dataset(vector_db: KnowledgeVectorDb, args: argparse.Namespace) -> np.ndarray:
+    """Loads the table and returns the query vectors."""
+    rng = np.random.default_rng(42)
+    with db_engine.begin() as conn:
+        conn.execute(text(f"DROP SCHEMA IF EXISTS {args.schema} CASCADE"))
+    vector_db.create()
+    for info in get_vector_indexes(vector_db):
+        drop_vector_index(vector_db, info.name, concurrently=False)
+    table = vector_db.table.fullname
+
+    if args.source:
+        with db_engine.begin() as conn:
+            conn.execute(
+                text(
+                    f"INSERT INTO {table} (id, content_hash, embedding) "
+                    f"SELECT id, content_hash, embedding FROM {args.source} ORDER BY random() LIMIT :rows"
+                ),
+                {"rows": args.rows},
+            )
+            sample = conn.execute(
+                text(f"SELECT embedding FROM {table} ORDER BY random() LIMIT :queries"), {"queries": args.queries}
+            )
+            base = np.array([np.array(row[0], dtype=np.float32) for row in sample])
+    else:
+        vectors = get_clustered_vectors(rng, args.rows + args.queries, args.dims, args.clusters)
+        base = vectors[args.rows :]
+        with db_engine.connect() as conn:
+            cursor = conn.connection.dbapi_connection.cursor()  # type: ignore[union-attr]
+            with cursor.copy(f"COPY {table} (id, content_hash, embedding) FROM STDIN") as copy:
+                for i, vector in enumerate(vectors[: args.rows]):
+                    copy.write_row([str(i), str(i), format_vector(vector.tolist())])
+            conn.commit()
+
+    with db_engine.connect() as conn:
+        conn.execution_options(isolation_level="AUTOCOMMIT").execute(text(f"VACUUM ANALYZE {table}"))
+    queries = base + args.noise * rng.standard_normal(base.shape).astype(np.float32)
+    return queries / np.linalg.norm(queries, axis=1, keepdims=True)
+
+
+def search_ids(vector_db: KnowledgeVectorDb, query: np.ndarray, k: int, **settings: Any) -> List[str]:
+    return [
+        str(document.id) for document in vector_db.search_by_embedding(list(map(float, query)), limit=k, **settings)
+    ]
+
+
+def run_queries(
+    vector_db: KnowledgeVectorDb, queries: np.ndarray, exact: List[Set[str]], k: int, **settings: Any
+) -> Dict[str, float]:
+    latencies: List[float] = []
+    found = 0
+    for query, expected in zip(queries, exact):
+        start = time.perf_counter()
+        ids = search_ids(vector_db, query, k, **settings)
+        latencies.append(time.perf_counter() - start)
+        found += len(expected.intersection(ids))
+    latencies.sort()
+    return {
+        "recall": found / (len(queries) * k),
+        "p50_ms": latencies[len(latencies) // 2] * 1000,
+        "p99_ms": latencies[min(len(latencies) - 1, int(len(latencies) * 0.99))] * 1000,
+        "qps": len(latencies) / sum(latencies),
+    }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rows", type=int, default=100_000)
+    parser.add_argument("--dims", type=int, default=1536, help="Dimensions of the random vectors")
+    parser.add_argument("--clusters", type=int, default=100, help="Clusters of the random vectors")
+    parser.add_argument("--source", help="Copy the rows from this knowledge table instead, eg: ai.sage_knowledge")
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--noise", type=float, default=0.1, help="Noise added to the query vectors")
+    parser.add_argument("-k", type=int, default=10, help="Results per query")
+    parser.add_argument("--m", type=int, default=16)
+    parser.add_argument("--ef-construction", type=int, default=64)
+    parser.add_argument("--lists", type=int, default=0, help="IVFFlat lists, 0 for rows / 1000")
+    parser.add_argument("--schema", default="benchmark")
+    args = parser.parse_args()
+
+    vector_db = get_vector_db(args.schema, args.dims)
+    print(f"Loading {args.rows} vectors in schema {args.schema}")
+    queries = load_dataset(vector_db, args)
+    try:
+        # Without an index, the nearest neighbours are exact
+        exact_ids = [search_ids(vector_db, query, args.k) for query in queries]
+        exact = [set(ids) for ids in exact_ids]
+        results: List[Dict[str, Any]] = [
+            {"index": "exact", "setting": "", **run_queries(vector_db, queries, exact, args.k), "build_s": 0.0}
+        ]
+
+        indexes: List[VectorIndex] = [
+            HNSW(m=args.m, ef_construction=args.ef_construction),
+            Ivfflat(lists=args.lists or 100, dynamic_lists=args.lists == 0),
+        ]
+        for index in indexes:
+            vector_db = get_vector_db(args.schema, args.dims, index)
+            start = time.monotonic()
+            rebuild_vector_index(vector_db, index, concurrently=False)
+            build_seconds = time.monotonic() - start
+            size = sum(info.size_bytes for info in get_vector_indexes(vector_db))
+            sweep = (
+                [("ef_search", value) for value in EF_SEARCH if value >= args.k]
+                if isinstance(index, HNSW)
+                else [("probes", value) for value in PROBES]
+            )
+            for name, value in sweep:
+                # Warm up the index pages before timing
+                run_queries(vector_db, queries[:10], exact[:10], args.k, **{name: value})
+                results.append(
+                    {
+                        "index": f"{'hnsw' if isinstance(index, HNSW) else 'ivfflat'} {size / 2**20:.0f}MB",
+                        "setting": f"{name}={value}",
+                        **run_queries(vector_db, queries, exact, args.k, **{name: value}),
+                        "build_s": build_seconds,
+                    }
+                )
+    finally:
+        with db_engine.begin() as conn:
+            conn.execute(text(f"DROP SCHEMA IF EXISTS {args.schema} CASCADE"))
+
+    print(f"{args.rows} rows, {len(queries)} queries, recall@{args.k} against exact search")
+    print(f"{'index':<14} {'setting':<14} {'recall':>7} {'p50':>9} {'p99':>9} {'qps':>8} {'build':>8}")
+    for r in results:
+        print(
+            f"{r['index']:<14} {r['setting']:<14} {r['recall']:>7.3f} {r['p50_ms']:>7.2f}ms {r['p99_ms']:>7.2f}ms "
+            f"{r['qps']:>8.0f} {r['build_s']:>7.1f}s"
+        )
+
+
+if __name__ == "__main__":
+    main()
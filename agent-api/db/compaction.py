@@ -0,0 +1,386 @@
+import argparse
+import time
+from dataclasses import asdict, dataclass
+from typing import Any, Dict, List, Optional, Tuple
+
+from sqlalchemy import (
+    BigInteger,
+    and_,
+    Connection,
+    MetaData,
+    Table,
+    case,
+    delete,
+    func,
+    insert,
+    inspect,
+    or_,
+    select,
+    text,
+    update,
+)
+from sqlalchemy.engine import Engine
+
+from db.compression import (
+    COMPRESSED_KEY,
+    compress,
+    compress_json,
+    decompress,
+    decompress_json,
+)
+from db.partitions import get_schema_partitions
+from db.session import db_engine
+from db.session_cache import session_cache
+from db.settings import db_settings
+from db.storage import get_run_messages
+from db.tables import SessionArchive, SessionRun
+from utils.log import logger
+from utils.serialization import dumps, loads
+
+######################################################
+## Session compaction
+######################################################
+
+# Runs are moved out of the hot session tables into the session_archive table, in batches of sessions. Each batch
+# is one short transaction that skips sessions locked by a run, so compaction can run next to the api. Only sessions
+# idle for idle_seconds are compacted, and they are dropped from the session caches of every process, so no agent
+# writes back the runs and summary it read before the compaction.
+
+
+@dataclass
+class CompactionPolicy:
+    # Archive runs older than this many days, None to disable
+    max_age_days: Optional[float] = 30
+    # Archive runs beyond the last keep_runs runs of a session, None to disable.
+    # Keep at least the num_history_runs of every agent.
+    keep_runs: Optional[int] = 50
+    # Skip sessions updated in the last idle_seconds, their runs could still be in an agent's memory
+    idle_seconds: float = 3600
+    # Sessions compacted per transaction
+    batch_size: int = 100
+    # Give up on a batch instead of waiting for a lock longer than this
+    lock_timeout_ms: int = 1000
+
+
+@dataclass
+class CompactionStats:
+    """Counters of a compaction."""
+
+    # Sessions with archived runs
+    sessions: int = 0
+    # Runs moved to the archive
+    runs_archived: int = 0
+    # session_runs rows deleted
+    rows_reclaimed: int = 0
+    # JSON bytes removed from the hot tables
+    bytes_reclaimed: int = 0
+    # Compressed bytes written to the archive
+    bytes_archived: int = 0
+    # Transactions committed
+    batches: int = 0
+
+
+def get_run_created_at(run: Dict[str, Any]) -> Optional[int]:
+    created_at = (run.get("response") or {}).get("created_at")
+    return int(created_at) if isinstance(created_at, (int, float)) else None
+
+
+def get_run_question(run: Dict[str, Any], max_length: int = 200) -> Optional[str]:
+    """Returns the user message of a saved agent, team or workflow run."""
+    content = (run.get("message") or {}).get("content")
+    if not content:
+        for message in (run.get("response") or {}).get("messages") or []:
+            if message.get("role") == "user" and not message.get("from_history"):
+                content = message.get("content")
+                break
+    if not content and run.get("input"):
+        content = dumps(run["input"]).decode("utf-8")
+    return str(content)[:max_length] if content else None
+
+
+def split_runs(runs: List[Dict[str, Any]], policy: CompactionPolicy, now: float) -> Tuple[List[Any], List[Any]]:
+    """Splits the runs of a session, oldest first, into the runs to archive and the runs to keep."""
+    keep_from = max(0, len(runs) - policy.keep_runs) if policy.keep_runs is not None else 0
+    cutoff = now - policy.max_age_days * 86400 if policy.max_age_days is not None else None
+    archived: List[Any] = []
+    kept: List[Any] = []
+    for index, run in enumerate(runs):
+        created_at = get_run_created_at(run)
+        if index < keep_from or (cutoff is not None and created_at is not None and created_at < cutoff):
+            archived.append(run)
+        else:
+            kept.append(run)
+    return archived, kept
+
+
+def get_archive_row(session_table: str, session_id: str, runs: List[Dict[str, Any]]) -> Dict[str, Any]:
+    raw = dumps(runs)
+    created_at = [c for c in map(get_run_created_at, runs) if c is not None]
+    return {
+        "session_table": session_table,
+        "session_id": session_id,
+        "run_count": len(runs),
+        "first_created_at": min(created_at, default=None),
+        "last_created_at": max(created_at, default=None),
+        "payload": compress(raw, db_settings.session_compression_level),
+        "raw_bytes": len(raw),
+    }
+
+
+def read_archive_payload(payload: bytes) -> List[Dict[str, Any]]:
+    """Returns the runs of an archive row, compressed by db/compression.py."""
+    return loads(decompress(payload))
+
+
+def get_archive_summary(
+    summary: Optional[Dict[str, Any]], archive_row: Dict[str, Any], runs: List[Dict[str, Any]], max_topics: int = 20
+) -> Dict[str, Any]:
+    """Returns the rolling summary of the archived runs, kept in the extra_data of the session under "archive"."""
+    summary = summary or {}
+    topics = summary.get("topics", []) + [q for q in map(get_run_question, runs) if q]
+    return {
+        "runs": summary.get("runs", 0) + archive_row["run_count"],
+        "bytes": summary.get("bytes", 0) + len(archive_row["payload"]),
+        "first_created_at": summary.get("first_created_at") or archive_row["first_created_at"],
+        "last_created_at": archive_row["last_created_at"] or summary.get("last_created_at"),
+        # The user messages of the most recent archived runs
+        "topics": topics[-max_topics:],
+    }
+
+
+def get_session_tables(engine: Engine, schema: str = "ai") -> List[Table]:
+    """Returns the agno session tables, the tables in `schema` with session_id, memory and extra_data columns.
+
+    Partitions are left out, their rows are compacted through their partitioned table.
+    """
+    metadata = MetaData(schema=schema)
+    with engine.connect() as conn:
+        partitions = set(get_schema_partitions(conn, schema))
+    tables = []
+    for table_name in sorted(set(inspect(engine).get_table_names(schema=schema)) - partitions):
+        table = Table(table_name, metadata, autoload_with=engine)
+        if {"session_id", "memory", "extra_data", "updated_at"} <= set(table.c.keys()):
+            tables.append(table)
+    return tables
+
+
+def invalidate_sessions(session_table: str, session_ids: List[str]) -> None:
+    """Drops compacted sessions from the session cache of this process, other processes are notified on commit."""
+    for session_id in session_ids:
+        session_cache.invalidate(session_table, session_id)
+
+
+def begin_batch(conn: Connection, policy: CompactionPolicy) -> None:
+    conn.execute(text(f"SET LOCAL lock_timeout = {int(policy.lock_timeout_ms)}"))
+
+
+def compact_session_table(engine: Engine, table: Table, policy: CompactionPolicy, stats: CompactionStats) -> None:
+    """Archives the runs saved in the memory column of an agno session table.
+
+    Compressed memory is checked after it is decompressed, and compressed again when runs are archived.
+    """
+    now = time.time()
+    runs = table.c.memory["runs"]
+    conditions = []
+    if policy.keep_runs is not None:
+        # jsonb_array_length fails on other json types
+        run_count = case((func.jsonb_typeof(runs) == "array", func.jsonb_array_length(runs)), else_=0)
+        conditions.append(run_count > policy.keep_runs)
+    if policy.max_age_days is not None:
+        oldest_created_at = runs[0]["response"]["created_at"].astext.cast(BigInteger)
+        conditions.append(oldest_created_at < int(now - policy.max_age_days * 86400))
+    if not conditions:
+        return
+
+    last_session_id = ""
+    while True:
+        with engine.begin() as conn:
+            begin_batch(conn, policy)
+            rows = conn.execute(
+                select(table.c.session_id, table.c.memory, table.c.extra_data)
+                .where(
+                    table.c.session_id > last_session_id,
+                    func.coalesce(table.c.updated_at, table.c.created_at) < int(now - policy.idle_seconds),
+                    or_(
+                        and_(func.jsonb_typeof(runs) == "array", or_(*conditions)),
+                        table.c.memory.has_key(COMPRESSED_KEY),
+                    ),
+                )
+                .order_by(table.c.session_id)
+                .limit(policy.batch_size)
+                .with_for_update(skip_locked=True)
+            ).all()
+            if not rows:
+                return
+            last_session_id = rows[-1].session_id
+
+            compacted: List[str] = []
+            for row in rows:
+                row_memory = decompress_json(row.memory)
+                if not isinstance(row_memory.get("runs"), list):
+                    continue
+                archived, kept = split_runs(row_memory["runs"], policy, now)
+                if not archived:
+                    continue
+                archive_row = get_archive_row(table.fullname, row.session_id, archived)
+                memory = {**row_memory, "runs": kept}
+                if "messages" in memory:
+                    memory["messages"] = get_run_messages(kept)
+                if row.memory is not row_memory:
+                    memory = compress_json(
+                        memory, db_settings.session_compression_threshold or None, db_settings.session_compression_level
+                    )
+                extra_data = row.extra_data or {}
+                extra_data = {
+                    **extra_data,
+                    "archive": get_archive_summary(extra_data.get("archive"), archive_row, archived),
+                }
+
+                conn.execute(insert(SessionArchive).values(archive_row))
+                conn.execute(
+                    update(table)
+                    .where(table.c.session_id == row.session_id)
+                    .values(memory=memory, extra_data=extra_data)
+                )
+                compacted.append(row.session_id)
+                stats.sessions += 1
+                stats.runs_archived += len(archived)
+                stats.bytes_reclaimed += len(dumps(row.memory)) - len(dumps(memory))
+                stats.bytes_archived += len(archive_row["payload"])
+            session_cache.send_invalidations(conn, table.fullname, compacted)
+        invalidate_sessions(table.fullname, compacted)
+        stats.batches += 1
+        logger.info(f"Compacted {table.fullname} up to session {last_session_id}: {stats}")
+
+
+def compact_session_runs(
+    engine: Engine, tables: Dict[str, Table], policy: CompactionPolicy, stats: CompactionStats
+) -> None:
+    """Archives the runs saved in the session_runs table, and updates the summary in their session rows.
+
+    Runs are only archived for the sessions of `tables` that are idle, their session row is locked while it changes.
+    """
+    now = time.time()
+    cutoff = int(now - policy.max_age_days * 86400) if policy.max_age_days is not None else None
+    conditions = []
+    if policy.keep_runs is not None:
+        conditions.append(func.count() > policy.keep_runs)
+    if cutoff is not None:
+        conditions.append(func.min(SessionRun.created_at) < cutoff)
+    if not conditions:
+        return
+
+    for session_table, table in tables.items():
+        idle = func.coalesce(table.c.updated_at, table.c.created_at) < int(now - policy.idle_seconds)
+        with engine.connect() as conn:
+            session_ids = conn.scalars(
+                select(SessionRun.session_id)
+                .join(table, table.c.session_id == SessionRun.session_id)
+                .where(SessionRun.session_table == session_table, idle)
+                .group_by(SessionRun.session_id)
+                .having(or_(*conditions))
+                .order_by(SessionRun.session_id)
+            ).all()
+
+        for start in range(0, len(session_ids), policy.batch_size):
+            batch = session_ids[start : start + policy.batch_size]
+            with engine.begin() as conn:
+                begin_batch(conn, policy)
+                # Sessions written since they were selected are no longer idle, and sessions locked by a write are
+                # skipped
+                extra_data_by_session = {
+                    row.session_id: row.extra_data
+                    for row in conn.execute(
+                        select(table.c.session_id, table.c.extra_data)
+                        .where(table.c.session_id.in_(batch), idle)
+                        .with_for_update(skip_locked=True)
+                    )
+                }
+                if not extra_data_by_session:
+                    continue
+                newest_first = func.row_number().over(
+                    partition_by=SessionRun.session_id,
+                    order_by=(SessionRun.created_at.desc(), SessionRun.id.desc()),
+                )
+                ranked = (
+                    select(SessionRun.id, SessionRun.created_at, newest_first.label("rank"))
+                    .where(
+                        SessionRun.session_table == session_table,
+                        SessionRun.session_id.in_(list(extra_data_by_session)),
+                    )
+                    .subquery()
+                )
+                archive_conditions = []
+                if policy.keep_runs is not None:
+                    archive_conditions.append(ranked.c.rank > policy.keep_runs)
+                if cutoff is not None:
+                    archive_conditions.append(ranked.c.created_at < cutoff)
+                rows = conn.execute(
+                    select(SessionRun.id, SessionRun.session_id, SessionRun.run)
+                    .where(SessionRun.id.in_(select(ranked.c.id).where(or_(*archive_conditions))))
+                    .order_by(SessionRun.session_id, SessionRun.created_at, SessionRun.id)
+                    .with_for_update(skip_locked=True)
+                ).all()
+
+                runs_by_session: Dict[str, List[Any]] = {}
+                for row in rows:
+                    runs_by_session.setdefault(row.session_id, []).append(row)
+
+                for session_id, session_rows in runs_by_session.items():
+                    archived = [row.run for row in session_rows]
+                    archive_row = get_archive_row(session_table, session_id, archived)
+                    conn.execute(insert(SessionArchive).values(archive_row))
+                    conn.execute(delete(SessionRun).where(SessionRun.id.in_([row.id for row in session_rows])))
+
+                    extra_data = extra_data_by_session[session_id] or {}
+                    summary = get_archive_summary(extra_data.get("archive"), archive_row, archived)
+                    conn.execute(
+                        update(table)
+                        .where(table.c.session_id == session_id)
+                        .values(extra_data={**extra_data, "archive": summary})
+                    )
+                    stats.sessions += 1
+                    stats.runs_archived += len(archived)
+                    stats.rows_reclaimed += len(session_rows)
+                    stats.bytes_reclaimed += archive_row["raw_bytes"]
+                    stats.bytes_archived += len(archive_row["payload"])
+                session_cache.send_invalidations(conn, session_table, list(runs_by_session))
+            invalidate_sessions(session_table, list(runs_by_session))
+            stats.batches += 1
+            logger.info(
+                f"Compacted {SessionRun.__tablename__} of {session_table}, "
+                f"{start + len(batch)}/{len(session_ids)} sessions: {stats}"
+            )
+
+
+def compact_sessions(policy: CompactionPolicy, engine: Engine = db_engine) -> CompactionStats:
+    """Moves old runs of all session tables to the session_archive table."""
+    stats = CompactionStats()
+    tables = get_session_tables(engine)
+    for table in tables:
+        compact_session_table(engine, table, policy, stats)
+    compact_session_runs(engine, {table.fullname: table for table in tables}, policy, stats)
+    return stats
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Moves old session runs to the session_archive table")
+    parser.add_argument("--max-age-days", type=float, default=db_settings.session_archive_after_days)
+    parser.add_argument("--keep-runs", type=int, default=db_settings.session_archive_keep_runs)
+    parser.add_argument("--idle-seconds", type=float, default=db_settings.session_compaction_idle_seconds)
+    parser.add_argument("--batch-size", type=int, default=db_settings.session_compaction_batch_size)
+    args = parser.parse_args()
+
+    policy = CompactionPolicy(
+        max_age_days=args.max_age_days if args.max_age_days > 0 else None,
+        keep_runs=args.keep_runs if args.keep_runs > 0 else None,
+        idle_seconds=args.idle_seconds,
+        batch_size=args.batch_size,
+    )
+    stats = compact_sessions(policy)
+    for field, value in asdict(stats).items():
+        print(f"{field}: {value}")
+
+
+if __name__ == "__main__":
+    main()
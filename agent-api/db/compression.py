@@ -0,0 +1,71 @@
+import base64
+import zlib
+from typing import Any, Optional
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None  # type: ignore
+
+from utils.serialization import dumps, loads
+
+######################################################
+## Compressed JSON column values
+######################################################
+
+# Large session columns are stored as {"__compressed__": "<base64>"} in their JSONB column. The base64 payload
+# starts with a version byte that selects the codec, so values written by any version can be read. Values that
+# are not wrapped are read as they are.
+COMPRESSED_KEY = "__compressed__"
+
+# Payload versions
+ZLIB_VERSION = 1
+ZSTD_VERSION = 2
+
+# The version used for new values, zstd when zstandard is installed
+compression_version: int = ZSTD_VERSION if zstandard is not None else ZLIB_VERSION
+
+
+def compress(data: bytes, level: int = 3) -> bytes:
+    """Returns the version byte followed by the compressed data."""
+    if compression_version == ZSTD_VERSION:
+        return bytes([ZSTD_VERSION]) + zstandard.ZstdCompressor(level=level).compress(data)
+    return bytes([ZLIB_VERSION]) + zlib.compress(data, level)
+
+
+def decompress(payload: bytes) -> bytes:
+    version, data = payload[0], payload[1:]
+    if version == ZSTD_VERSION:
+        if zstandard is None:
+            raise RuntimeError("zstandard is required to read zstd compressed values")
+        return zstandard.ZstdDecompressor().decompress(data)
+    if version == ZLIB_VERSION:
+        return zlib.decompress(data)
+    raise ValueError(f"Unknown compression version: {version}")
+
+
+def is_compressed(value: Any) -> bool:
+    return isinstance(value, dict) and len(value) == 1 and isinstance(value.get(COMPRESSED_KEY), str)
+
+
+def compress_json(value: Any, threshold: Optional[int], level: int = 3) -> Any:
+    """Returns the value to store in a JSONB column, compressed when its JSON is at least `threshold` bytes.
+
+    Args:
+        value: A JSON value, eg: the memory or session_data of a session
+        threshold: The size in bytes from which values are compressed, None to store all values as they are
+        level: The compression level
+    """
+    if value is None or threshold is None or is_compressed(value):
+        return value
+    data = dumps(value)
+    if len(data) < threshold:
+        return value
+    return {COMPRESSED_KEY: base64.b64encode(compress(data, level)).decode("ascii")}
+
+
+def decompress_json(value: Any) -> Any:
+    """Returns the JSON value stored by `compress_json()`."""
+    if not is_compressed(value):
+        return value
+    return loads(decompress(base64.b64decode(value[COMPRESSED_KEY])))
@@ -0,0 +1,315 @@
+import hashlib
+import sys
+from array import array
+from collections import OrderedDict
+from dataclasses import dataclass, field, replace
+from threading import Lock
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from agno.embedder.base import Embedder
+from agno.embedder.openai import OpenAIEmbedder
+from sqlalchemy import Connection, Engine, select
+from sqlalchemy.dialects.postgresql import insert as postgresql_insert
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+
+from db.settings import db_settings
+from db.tables import EmbeddingCacheEntry
+from utils.log import logger
+
+######################################################
+## Embedding cache
+######################################################
+
+# Embeddings are deterministic for a model and a text, so recurring queries to search_knowledge_base and documents
+# loaded again are served from the cache instead of an embedding request. Entries are keyed by the embedder id and
+# dimensions and the sha256 digest of the text, and embeddings are stored as float32 bytes: 6KB with 1536
+# dimensions, a quarter of their JSON. The in-memory tier is an LRU of the most used embeddings of the process, the
+# Postgres or SQLite tier is shared by all processes and never expires.
+
+
+@dataclass
+class EmbeddingCacheStats:
+    """Counters of the embedding cache."""
+
+    # Lookups served from the in-memory tier
+    memory_hits: int = 0
+    # Lookups served from the Postgres or SQLite tier
+    db_hits: int = 0
+    # Lookups that were embedded by the embedder
+    misses: int = 0
+    # Embeddings added to the cache
+    writes: int = 0
+    # In-memory entries dropped because of the size limit
+    evictions: int = 0
+    # Failed reads or writes of the database tier, which are treated as misses
+    errors: int = 0
+    # Entries currently in memory
+    memory_entries: int = 0
+
+
+def pack_embedding(embedding: List[float]) -> bytes:
+    """Returns an embedding as little-endian float32 bytes."""
+    values = array("f", embedding)
+    if sys.byteorder == "big":
+        values.byteswap()
+    return values.tobytes()
+
+
+def unpack_embedding(data: bytes) -> List[float]:
+    values = array("f")
+    values.frombytes(data)
+    if sys.byteorder == "big":
+        values.byteswap()
+    return values.tolist()
+
+
+def get_model_key(embedder: Embedder) -> str:
+    """Returns the cache key of an embedder, its id and dimensions, eg: "text-embedding-3-small/1536"."""
+    return f"{getattr(embedder, 'id', type(embedder).__name__)}/{embedder.dimensions}"
+
+
+def get_text_hash(text: str) -> bytes:
+    return hashlib.sha256(text.encode("utf-8")).digest()
+
+
+class EmbeddingCache:
+    """A cache of embeddings with an in-memory LRU tier backed by a database table.
+
+    Args:
+        engine: The engine of the database tier, None to only cache in memory
+        max_entries: Embeddings held in memory
+        write: Runs the inserts, eg: `SqliteWriter.submit` for a SQLite database. By default they are run on a
+            connection of `engine`.
+    """
+
+    def __init__(
+        self,
+        engine: Optional[Engine],
+        max_entries: int = 10_000,
+        write: Optional[Callable[[Callable[[Connection], Any]], Any]] = None,
+    ):
+        self.engine = engine
+        self.max_entries = max_entries
+        self.write = write
+        # SQLite has no schemas, the table is kept in the main database
+        self.execution_options: Dict[str, Any] = {}
+        if engine is not None and engine.dialect.name == "sqlite":
+            self.execution_options["schema_translate_map"] = {"public": None}
+
+        # (model, text_hash) -> packed embedding, ordered from least to most recently used
+        self._entries: "OrderedDict[Tuple[str, bytes], bytes]" = OrderedDict()
+        self._stats = EmbeddingCacheStats()
+        self._lock = Lock()
+        self._table_checked = False
+
+    def _get_memory_entry(self, key: Tuple[str, bytes]) -> Optional[bytes]:
+        with self._lock:
+            data = self._entries.get(key)
+            if data is not None:
+                self._entries.move_to_end(key)
+            return data
+
+    def _set_memory_entry(self, key: Tuple[str, bytes], data: bytes) -> None:
+        if self.max_entries <= 0:
+            return
+        with self._lock:
+            self._entries[key] = data
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self._stats.evictions += 1
+
+    def _count(self, name: str) -> None:
+        with self._lock:
+            setattr(self._stats, name, getattr(self._stats, name) + 1)
+
+    def _check_table(self) -> None:
+        """Creates the table in a SQLite database, Postgres tables are created by the migrations."""
+        if self._table_checked or self.engine is None:
+            return
+        if self.engine.dialect.name == "sqlite":
+            with self.engine.begin() as conn:
+                conn = conn.execution_options(**self.execution_options)
+                EmbeddingCacheEntry.metadata.create_all(conn, tables=[EmbeddingCacheEntry.__table__])  # type: ignore
+        self._table_checked = True
+
+    def get(self, model: str, text: str) -> Optional[List[float]]:
+        """Returns the cached embedding of a text, or None."""
+        key = (model, get_text_hash(text))
+        data = self._get_memory_entry(key)
+        if data is not None:
+            self._count("memory_hits")
+            return unpack_embedding(data)
+
+        if self.engine is not None:
+            try:
+                self._check_table()
+                with self.engine.connect() as conn:
+                    data = conn.execution_options(**self.execution_options).scalar(
+                        select(EmbeddingCacheEntry.embedding).where(
+                            EmbeddingCacheEntry.model == model, EmbeddingCacheEntry.text_hash == key[1]
+                        )
+                    )
+            except Exception as e:
+                logger.warning(f"Could not read the embedding cache: {e}")
+                self._count("errors")
+                data = None
+            if data is not None:
+                self._set_memory_entry(key, data)
+                self._count("db_hits")
+                return unpack_embedding(data)
+
+        self._count("misses")
+        return None
+
+    def set(self, model: str, text: str, embedding: List[float]) -> None:
+        """Adds an embedding to both tiers."""
+        key = (model, get_text_hash(text))
+        data = pack_embedding(embedding)
+        self._set_memory_entry(key, data)
+        self._count("writes")
+        if self.engine is None:
+            return
+
+        insert = postgresql_insert if self.engine.dialect.name == "postgresql" else sqlite_insert
+        stmt = (
+            insert(EmbeddingCacheEntry)
+            .values(model=model, text_hash=key[1], embedding=data)
+            .on_conflict_do_nothing(index_elements=["model", "text_hash"])
+        )
+        try:
+            self._check_table()
+            if self.write is not None:
+                self.write(lambda conn: conn.execution_options(**self.execution_options).execute(stmt))
+            else:
+                with self.engine.begin() as conn:
+                    conn.execution_options(**self.execution_options).execute(stmt)
+        except Exception as e:
+            logger.warning(f"Could not write the embedding cache: {e}")
+            self._count("errors")
+
+    def get_many(self, model: str, texts: List[str]) -> List[Optional[List[float]]]:
+        """Returns the cached embeddings of texts, None for the misses, with one query to the database tier."""
+        keys = [(model, get_text_hash(text)) for text in texts]
+        found: Dict[bytes, bytes] = {}
+        for key in keys:
+            data = self._get_memory_entry(key)
+            if data is not None:
+                found[key[1]] = data
+                self._count("memory_hits")
+
+        missing = list({key[1] for key in keys if key[1] not in found})
+        if missing and self.engine is not None:
+            try:
+                self._check_table()
+                with self.engine.connect() as conn:
+                    rows = conn.execution_options(**self.execution_options).execute(
+                        select(EmbeddingCacheEntry.text_hash, EmbeddingCacheEntry.embedding).where(
+                            EmbeddingCacheEntry.model == model, EmbeddingCacheEntry.text_hash.in_(missing)
+                        )
+                    )
+                    for text_hash, data in rows:
+                        found[text_hash] = data
+                        self._set_memory_entry((model, text_hash), data)
+                        self._count("db_hits")
+            except Exception as e:
+                logger.warning(f"Could not read the embedding cache: {e}")
+                self._count("errors")
+
+        embeddings: List[Optional[List[float]]] = []
+        for key in keys:
+            data = found.get(key[1])
+            if data is None:
+                self._count("misses")
+            embeddings.append(unpack_embedding(data) if data is not None else None)
+        return embeddings
+
+    def set_many(self, model: str, texts: List[str], embeddings: List[List[float]]) -> None:
+        """Adds embeddings to both tiers, with one insert to the database tier."""
+        values = []
+        for text, embedding in zip(texts, embeddings):
+            key = (model, get_text_hash(text))
+            data = pack_embedding(embedding)
+            self._set_memory_entry(key, data)
+            self._count("writes")
+            values.append({"model": model, "text_hash": key[1], "embedding": data})
+        if self.engine is None or not values:
+            return
+
+        insert = postgresql_insert if self.engine.dialect.name == "postgresql" else sqlite_insert
+        stmt = insert(EmbeddingCacheEntry).on_conflict_do_nothing(index_elements=["model", "text_hash"])
+        try:
+            self._check_table()
+            if self.write is not None:
+                self.write(lambda conn: conn.execution_options(**self.execution_options).execute(stmt, values))
+            else:
+                with self.engine.begin() as conn:
+                    conn.execution_options(**self.execution_options).execute(stmt, values)
+        except Exception as e:
+            logger.warning(f"Could not write the embedding cache: {e}")
+            self._count("errors")
+
+    def clear(self) -> None:
+        """Drops all in-memory entries."""
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self) -> EmbeddingCacheStats:
+        """Returns a snapshot of the counters."""
+        with self._lock:
+            return replace(self._stats, memory_entries=len(self._entries))
+
+
+def create_embedding_cache() -> EmbeddingCache:
+    """Returns the embedding cache of the configured backend."""
+    max_entries = db_settings.embedding_cache_max_entries
+    if db_settings.embedding_cache_backend == "sqlite":
+        from db.sqlite import get_sqlite_writer
+
+        writer = get_sqlite_writer(db_settings.embedding_cache_sqlite_file)
+        return EmbeddingCache(writer.engine, max_entries, write=writer.submit)
+    if db_settings.embedding_cache_backend == "postgres":
+        from db.session import db_engine
+
+        return EmbeddingCache(db_engine, max_entries)
+    return EmbeddingCache(None, max_entries)
+
+
+# Embedding cache shared by all embedders in this process
+embedding_cache = create_embedding_cache()
+
+
+@dataclass
+class CachedEmbedder(Embedder):
+    """An embedder serving the embeddings of recurring texts from the embedding cache.
+
+    Use it as the embedder of a PgVector, in place of the embedder it wraps. Cached embeddings have no usage.
+    """
+
+    embedder: Embedder = field(default_factory=OpenAIEmbedder)
+    cache: EmbeddingCache = field(default_factory=lambda: embedding_cache)
+
+    def __post_init__(self):
+        self.dimensions = self.embedder.dimensions
+
+    @property
+    def model(self) -> str:
+        return get_model_key(self.embedder)
+
+    def get_embedding(self, text: str) -> List[float]:
+        return self.get_embedding_and_usage(text)[0]
+
+    def get_embedding_and_usage(self, text: str) -> Tuple[List[float], Optional[Dict]]:
+        embedding = self.cache.get(self.model, text)
+        if embedding is not None:
+            return embedding, None
+        embedding, usage = self.embedder.get_embedding_and_usage(text)
+        # Failed embeddings are empty, they are not cached
+        if embedding:
+            self.cache.set(self.model, text, embedding)
+        return embedding, usage
+
+
+def get_cached_embedder(embedder: Optional[Embedder] = None) -> CachedEmbedder:
+    """Returns `embedder`, by default an OpenAIEmbedder, behind the embedding cache of this process."""
+    return CachedEmbedder(embedder=embedder or OpenAIEmbedder())
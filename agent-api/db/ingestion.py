@@ -0,0 +1,412 @@
+import argparse
+import os
+import random
+import time
+from concurrent.futures import FIRST_COMPLETED, Future, ProcessPoolExecutor, ThreadPoolExecutor, wait
+from dataclasses import asdict, dataclass, replace
+from hashlib import md5
+from pathlib import Path
+from threading import Lock
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Optional, Set, Tuple
+
+from agno.document.chunking.fixed import FixedSizeChunking
+from agno.document.chunking.strategy import ChunkingStrategy
+from agno.document.reader.base import Reader
+from agno.document.reader.pdf_reader import PDFReader
+from agno.document.reader.text_reader import TextReader
+from agno.embedder.base import Embedder
+from agno.embedder.openai import OpenAIEmbedder
+from agno.knowledge.agent import AgentKnowledge
+from agno.vectordb.pgvector import PgVector
+from openai import APIConnectionError, APITimeoutError, InternalServerError, RateLimitError
+from sqlalchemy import Table, text
+from sqlalchemy.engine import Engine
+
+from db.embedding_cache import CachedEmbedder, EmbeddingCache
+from db.knowledge import KnowledgeVectorDb
+from db.settings import db_settings
+from utils.log import logger
+from utils.serialization import dumps
+
+######################################################
+## Knowledge ingestion
+######################################################
+
+# Loads a large corpus into the PgVector table of a knowledge base. Files are read and chunked in a process pool
+# while the chunks read so far are embedded and written, so reading, embedding and writing overlap. Chunks whose
+# content_hash is already in the table are skipped before they are embedded, the remaining chunks are embedded in
+# batched requests with a bounded number of requests in flight, and each batch is written with COPY and upserted
+# by id in one transaction.
+#
+# With a CachedEmbedder, the chunks that are not in the table are looked up in the embedding cache first, one query
+# per embedding request, and the new embeddings are added to it. Chunks deleted from the table, or loaded into
+# another knowledge base with the same embedder, are not embedded again.
+#
+# Every batch is committed on its own, so an interrupted ingestion is resumed by running it again: the chunks
+# written before the crash are skipped by their content_hash and only the rest is embedded.
+
+# Files read from directories, other files are skipped
+SUFFIXES = {".txt", ".md", ".markdown", ".rst", ".csv", ".json", ".pdf"}
+
+COPY_COLUMNS = ["id", "name", "meta_data", "filters", "content", "embedding", "content_hash"]
+
+# Embedding errors worth retrying, other errors fail the chunks of the request
+RETRYABLE_ERRORS = (RateLimitError, APIConnectionError, APITimeoutError, InternalServerError)
+
+Row = Dict[str, Any]
+
+
+@dataclass
+class IngestionStats:
+    """Counters of an ingestion."""
+
+    # Files read, and files that could not be read or had no content
+    files: int = 0
+    failed_files: int = 0
+    # Chunks read from the files
+    chunks: int = 0
+    # Chunks skipped because their content_hash is already in the table
+    skipped_existing: int = 0
+    # Chunks skipped because an earlier chunk of this ingestion has the same content
+    skipped_duplicate: int = 0
+    # Chunks whose embedding was served from the embedding cache
+    cached: int = 0
+    # Chunks embedded and written to the table
+    embedded: int = 0
+    written: int = 0
+    # Chunks not written because their embedding request failed, they are embedded on the next run
+    failed_chunks: int = 0
+    # Embedding requests sent, and retried after a rate limit or server error
+    embedding_requests: int = 0
+    embedding_retries: int = 0
+    # Transactions committed
+    batches: int = 0
+    seconds: float = 0.0
+    docs_per_second: float = 0.0
+    chunks_per_second: float = 0.0
+
+
+def iter_files(paths: Iterable[str]) -> Iterator[Path]:
+    """Yields the files of `paths`, walking directories in a stable order."""
+    for path in map(Path, paths):
+        if path.is_dir():
+            yield from sorted(p for p in path.rglob("*") if p.is_file() and p.suffix.lower() in SUFFIXES)
+        else:
+            yield path
+
+
+def read_chunks(path: str, chunking_strategy: ChunkingStrategy) -> List[Row]:
+    """Reads and chunks a file, in a worker process.
+
+    Returns:
+        List[Row]: The rows of the chunks without their embedding, as PgVector.insert() builds them
+    """
+    file = Path(path)
+    reader: Reader
+    if file.suffix.lower() == ".pdf":
+        reader = PDFReader(chunking_strategy=chunking_strategy)
+    else:
+        reader = TextReader(chunking_strategy=chunking_strategy)
+
+    rows: List[Row] = []
+    for document in reader.read(file):
+        content = document.content.replace("\x00", "\ufffd")
+        if not content.strip():
+            continue
+        content_hash = md5(content.encode()).hexdigest()
+        rows.append(
+            {
+                "id": document.id or content_hash,
+                "name": document.name,
+                "meta_data": {**document.meta_data, "path": path},
+                "content": content,
+                "content_hash": content_hash,
+            }
+        )
+    return rows
+
+
+def embed_texts(
+    embedder: Embedder, texts: List[str], retries: int = 5, on_retry: Optional[Callable[[], None]] = None
+) -> List[List[float]]:
+    """Embeds texts, in one request with an OpenAIEmbedder, retrying rate limits and server errors with backoff."""
+    for attempt in range(retries + 1):
+        try:
+            if isinstance(embedder, OpenAIEmbedder):
+                # The embeddings endpoint takes a list of inputs, OpenAIEmbedder passes its input through
+                response = embedder.response(text=texts)  # type: ignore[arg-type]
+                return [item.embedding for item in sorted(response.data, key=lambda item: item.index)]
+            return [embedder.get_embedding(content) for content in texts]
+        except RETRYABLE_ERRORS as e:
+            if attempt == retries:
+                raise
+            delay = min(2**attempt, 30) * random.uniform(0.5, 1.0)
+            logger.warning(f"Embedding request failed, retrying in {delay:.1f}s: {e}")
+            if on_retry is not None:
+                on_retry()
+            time.sleep(delay)
+    raise AssertionError("unreachable")
+
+
+def format_vector(embedding: List[float]) -> str:
+    return "[" + ",".join(map(str, embedding)) + "]"
+
+
+class KnowledgeIngestion:
+    """Streams files into the PgVector table of a knowledge base.
+
+    Args:
+        knowledge: The knowledge base, its vector_db must be a PgVector
+        write_batch_size: Chunks written per transaction
+        embed_batch_size: Chunks embedded per embedding request
+        embed_concurrency: Embedding requests in flight
+        chunk_workers: Processes reading and chunking files, None uses every cpu
+    """
+
+    def __init__(
+        self,
+        knowledge: AgentKnowledge,
+        write_batch_size: int = db_settings.knowledge_write_batch_size,
+        embed_batch_size: int = db_settings.knowledge_embed_batch_size,
+        embed_concurrency: int = db_settings.knowledge_embed_concurrency,
+        chunk_workers: Optional[int] = None,
+    ):
+        if not isinstance(knowledge.vector_db, PgVector):
+            raise ValueError("Knowledge ingestion needs a PgVector vector_db")
+        self.vector_db: PgVector = knowledge.vector_db
+        self.embedder: Embedder = self.vector_db.embedder
+        # Chunks are embedded in batches by the wrapped embedder, with batched lookups in the embedding cache
+        self.cache: Optional[EmbeddingCache] = None
+        self.cache_model = ""
+        if isinstance(self.embedder, CachedEmbedder):
+            self.cache, self.cache_model = self.embedder.cache, self.embedder.model
+            self.embedder = self.embedder.embedder
+        self.chunking_strategy: ChunkingStrategy = knowledge.chunking_strategy or FixedSizeChunking()
+        self.write_batch_size = write_batch_size
+        self.embed_batch_size = embed_batch_size
+        self.embed_concurrency = embed_concurrency
+        self.chunk_workers = chunk_workers or os.cpu_count() or 1
+
+        self._stats = IngestionStats()
+        self._lock = Lock()
+        # Content hashes of the chunks of this ingestion, to skip repeated chunks without a query
+        self._seen: Set[str] = set()
+
+    @property
+    def table(self) -> Table:
+        return self.vector_db.table
+
+    @property
+    def engine(self) -> Engine:
+        return self.vector_db.db_engine
+
+    def ingest(self, paths: Iterable[str], filters: Optional[Dict[str, Any]] = None) -> IngestionStats:
+        """Reads, embeds and writes the files of `paths`, skipping the chunks already in the table."""
+        self.vector_db.create()
+        start = time.monotonic()
+        last_report = start
+        batch: List[Row] = []
+        # The batch being embedded, written once the next batch is submitted so embedding and writing overlap
+        in_flight: Optional[Tuple[List[Row], List[Future]]] = None
+
+        with (
+            ProcessPoolExecutor(self.chunk_workers) as processes,
+            ThreadPoolExecutor(self.embed_concurrency, thread_name_prefix="embedder") as threads,
+        ):
+            for rows in self.iter_chunks(processes, iter_files(paths)):
+                batch.extend(rows)
+                while len(batch) >= self.write_batch_size:
+                    submitted = self.submit(threads, batch[: self.write_batch_size])
+                    batch = batch[self.write_batch_size :]
+                    if in_flight is not None:
+                        self.write(*in_flight, filters=filters)
+                    in_flight = submitted
+                if time.monotonic() - last_report >= 10:
+                    last_report = time.monotonic()
+                    logger.info(f"Ingesting into {self.table.fullname}: {self.stats(start)}")
+            if batch:
+                submitted = self.submit(threads, batch)
+                if in_flight is not None:
+                    self.write(*in_flight, filters=filters)
+                in_flight = submitted
+            if in_flight is not None:
+                self.write(*in_flight, filters=filters)
+
+        stats = self.stats(start)
+        logger.info(f"Ingested into {self.table.fullname}: {stats}")
+        return stats
+
+    def iter_chunks(self, processes: ProcessPoolExecutor, files: Iterator[Path]) -> Iterator[List[Row]]:
+        """Yields the chunks of each file as it is read, with a bounded number of files read ahead."""
+        pending: Dict[Future, Path] = {}
+
+        def submit_next() -> None:
+            path = next(files, None)
+            if path is not None:
+                pending[processes.submit(read_chunks, str(path), self.chunking_strategy)] = path
+
+        for _ in range(self.chunk_workers * 2):
+            submit_next()
+        while pending:
+            done, _ = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                path = pending.pop(future)
+                submit_next()
+                self._stats.files += 1
+                try:
+                    rows = future.result()
+                except Exception as e:
+                    logger.error(f"Could not read {path}: {e}")
+                    rows = []
+                if not rows:
+                    self._stats.failed_files += 1
+                self._stats.chunks += len(rows)
+                yield rows
+
+    def submit(self, threads: ThreadPoolExecutor, rows: List[Row]) -> Tuple[List[Row], List[Future]]:
+        """Drops the chunks already in the table and submits the embedding requests of the rest."""
+        new_rows: List[Row] = []
+        for row in rows:
+            if row["content_hash"] in self._seen:
+                self._stats.skipped_duplicate += 1
+                continue
+            self._seen.add(row["content_hash"])
+            new_rows.append(row)
+
+        existing = self.get_existing_hashes([row["content_hash"] for row in new_rows])
+        self._stats.skipped_existing += len(existing)
+        new_rows = [row for row in new_rows if row["content_hash"] not in existing]
+
+        futures = [
+            threads.submit(self.embed, [row["content"] for row in new_rows[i : i + self.embed_batch_size]])
+            for i in range(0, len(new_rows), self.embed_batch_size)
+        ]
+        return new_rows, futures
+
+    def get_existing_hashes(self, hashes: List[str]) -> Set[str]:
+        if not hashes:
+            return set()
+        with self.engine.connect() as conn:
+            result = conn.execute(
+                text(f"SELECT content_hash FROM {self.table.fullname} WHERE content_hash = ANY(:hashes)"),
+                {"hashes": hashes},
+            )
+            return {content_hash for (content_hash,) in result}
+
+    def embed(self, texts: List[str]) -> List[List[float]]:
+        """Embeds texts, serving the embeddings found in the embedding cache and caching the others."""
+        embeddings: List[Optional[List[float]]] = [None] * len(texts)
+        if self.cache is not None:
+            embeddings = self.cache.get_many(self.cache_model, texts)
+        missing = [i for i, embedding in enumerate(embeddings) if embedding is None]
+        with self._lock:
+            self._stats.cached += len(texts) - len(missing)
+            if missing:
+                self._stats.embedding_requests += 1
+        if missing:
+            new_texts = [texts[i] for i in missing]
+            new_embeddings = embed_texts(self.embedder, new_texts, on_retry=self._count_retry)
+            if self.cache is not None:
+                self.cache.set_many(self.cache_model, new_texts, new_embeddings)
+            for i, embedding in zip(missing, new_embeddings):
+                embeddings[i] = embedding
+        return [embedding for embedding in embeddings if embedding is not None]
+
+    def _count_retry(self) -> None:
+        with self._lock:
+            self._stats.embedding_retries += 1
+
+    def write(self, rows: List[Row], futures: List[Future], filters: Optional[Dict[str, Any]] = None) -> None:
+        """Waits for the embeddings of a batch and writes it in one transaction."""
+        embedded: List[Tuple[Row, List[float]]] = []
+        for i, future in enumerate(futures):
+            group = rows[i * self.embed_batch_size : (i + 1) * self.embed_batch_size]
+            try:
+                embedded.extend(zip(group, future.result()))
+            except Exception as e:
+                logger.error(f"Could not embed {len(group)} chunks: {e}")
+                self._stats.failed_chunks += len(group)
+                # Forget their hashes, so repeats of these chunks later in this ingestion are embedded
+                self._seen.difference_update(row["content_hash"] for row in group)
+        self._stats.embedded += len(embedded)
+        if not embedded:
+            return
+
+        staging = f"{self.table.name}_ingestion"
+        columns = ", ".join(COPY_COLUMNS)
+        updates = ", ".join(f"{name} = excluded.{name}" for name in COPY_COLUMNS if name != "id")
+        filters_json = dumps(filters).decode() if filters is not None else None
+        with self.engine.connect() as conn:
+            conn.exec_driver_sql(
+                f"CREATE TEMP TABLE IF NOT EXISTS {staging} (LIKE {self.table.fullname} INCLUDING DEFAULTS) "
+                "ON COMMIT DELETE ROWS"
+            )
+            cursor = conn.connection.dbapi_connection.cursor()  # type: ignore[union-attr]
+            with cursor.copy(f"COPY {staging} ({columns}) FROM STDIN") as copy:
+                for row, embedding in embedded:
+                    copy.write_row(
+                        [
+                            row["id"],
+                            row["name"],
+                            dumps(row["meta_data"]).decode(),
+                            filters_json,
+                            row["content"],
+                            format_vector(embedding),
+                            row["content_hash"],
+                        ]
+                    )
+            # Chunks of files with the same name share ids, the last one read is kept
+            conn.exec_driver_sql(
+                f"INSERT INTO {self.table.fullname} ({columns}) "
+                f"SELECT DISTINCT ON (id) {columns} FROM {staging} ORDER BY id "
+                f"ON CONFLICT (id) DO UPDATE SET {updates}, updated_at = now()"
+            )
+            conn.commit()
+        # Cached search results of this process would miss the new chunks until they expire
+        if isinstance(self.vector_db, KnowledgeVectorDb):
+            self.vector_db.clear_search_cache()
+        self._stats.written += len(embedded)
+        self._stats.batches += 1
+
+    def stats(self, start: float) -> IngestionStats:
+        """Returns a snapshot of the counters."""
+        seconds = time.monotonic() - start
+        with self._lock:
+            return replace(
+                self._stats,
+                seconds=round(seconds, 3),
+                docs_per_second=round(self._stats.files / seconds, 2) if seconds else 0.0,
+                chunks_per_second=round(self._stats.chunks / seconds, 2) if seconds else 0.0,
+            )
+
+
+def get_knowledge_bases() -> Dict[str, Callable[[], AgentKnowledge]]:
+    from agents.sage import get_sage_knowledge
+
+    return {"sage": get_sage_knowledge}
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Loads files into the vector table of a knowledge base")
+    parser.add_argument("paths", nargs="+", help="Files and directories to load")
+    parser.add_argument("--knowledge", choices=sorted(get_knowledge_bases()), default="sage")
+    parser.add_argument("--write-batch-size", type=int, default=db_settings.knowledge_write_batch_size)
+    parser.add_argument("--embed-batch-size", type=int, default=db_settings.knowledge_embed_batch_size)
+    parser.add_argument("--embed-concurrency", type=int, default=db_settings.knowledge_embed_concurrency)
+    parser.add_argument("--chunk-workers", type=int, default=db_settings.knowledge_chunk_workers)
+    args = parser.parse_args()
+
+    ingestion = KnowledgeIngestion(
+        get_knowledge_bases()[args.knowledge](),
+        write_batch_size=args.write_batch_size,
+        embed_batch_size=args.embed_batch_size,
+        embed_concurrency=args.embed_concurrency,
+        chunk_workers=args.chunk_workers or None,
+    )
+    stats = ingestion.ingest(args.paths)
+    for field, value in asdict(stats).items():
+        print(f"{field}: {value}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,500 @@
+import asyncio
+import json
+import re
+import time
+import unicodedata
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, replace
+from threading import Lock
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+from agno.document import Document
+from agno.vectordb.distance import Distance
+from agno.vectordb.pgvector import HNSW, Ivfflat, PgVector, SearchType
+from pgvector.sqlalchemy import BIT, HALFVEC, Vector
+from sqlalchemy import Row, Select, bindparam, cast, func, literal, literal_column, select, text
+from sqlalchemy.ext.asyncio import AsyncEngine
+
+from db.settings import db_settings
+from db.vector_index import QUANTIZATIONS, ensure_vector_index, get_vector_index, rebuild_vector_index
+from utils.log import logger
+
+######################################################
+## Knowledge vector db
+######################################################
+
+# PgVector sets the query-time parameters of the vector index from its vector_index configuration, for every query.
+# The vector db of the knowledge bases lets each query set them: HNSW visits ef_search candidates and IVFFlat scans
+# probes lists, higher values return closer neighbours more slowly. Use benchmarks/vector_recall.py to pick them.
+#
+# PgVector's hybrid search orders the whole table by a weighted sum of the vector and full-text scores, which no
+# index serves. Hybrid searches here run a vector query served by the vector index and a full-text query served by
+# the GIN index at the same time, each returning its best candidates, and fuse the two rankings with reciprocal
+# rank fusion. Ranks are comparable where cosine distances and ts_rank_cd scores are not. The full-text query
+# starts while the query is being embedded.
+#
+# With a quantized vector index, vector queries run in two stages in one statement: the compact index returns
+# rerank_factor candidates per result, ordered by the distance of the quantized embeddings, and the candidates are
+# re-ranked by the distance of their float32 embeddings. Use benchmarks/vector_quantization.py to compare recall.
+
+
+@dataclass
+class HybridSearchStats:
+    """Counters of the hybrid knowledge searches of this process."""
+
+    # Hybrid searches
+    searches: int = 0
+    # Searches served from the search cache
+    cache_hits: int = 0
+    # Failed vector or full-text queries, the search returns the results of the other query
+    errors: int = 0
+    # Entries currently in the search cache
+    memory_entries: int = 0
+
+
+class HybridSearchCache:
+    """Fused results by table, normalized query, limit and filters, for `ttl` seconds.
+
+    Writes to the knowledge table are seen once the cached results expire, keep the ttl short.
+    """
+
+    def __init__(self, ttl: float = 60, max_entries: int = 1024):
+        self.ttl = ttl
+        self.max_entries = max_entries
+
+        # key -> (expires_at, documents), ordered from least to most recently used
+        self._entries: "OrderedDict[Tuple[str, ...], Tuple[float, List[Document]]]" = OrderedDict()
+        self._stats = HybridSearchStats()
+        self._lock = Lock()
+
+    def get(self, key: Tuple[str, ...]) -> Optional[List[Document]]:
+        with self._lock:
+            self._stats.searches += 1
+            cached = self._entries.get(key)
+            if cached is None:
+                return None
+            if cached[0] <= time.monotonic():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            self._stats.cache_hits += 1
+            return list(cached[1])
+
+    def set(self, key: Tuple[str, ...], documents: List[Document]) -> None:
+        if self.ttl <= 0 or self.max_entries <= 0:
+            return
+        with self._lock:
+            self._entries[key] = (time.monotonic() + self.ttl, list(documents))
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def count_error(self) -> None:
+        with self._lock:
+            self._stats.errors += 1
+
+    def clear(self, table: Optional[str] = None) -> None:
+        """Drops the entries of a table, by its full name, or all entries. Called after documents are written."""
+        with self._lock:
+            if table is None:
+                self._entries.clear()
+                return
+            for key in [key for key in self._entries if key[0] == table]:
+                del self._entries[key]
+
+    def stats(self) -> HybridSearchStats:
+        """Returns a snapshot of the counters."""
+        with self._lock:
+            return replace(self._stats, memory_entries=len(self._entries))
+
+
+# Search cache shared by the knowledge bases of this process
+hybrid_search_cache = HybridSearchCache(
+    ttl=db_settings.knowledge_search_cache_ttl, max_entries=db_settings.knowledge_search_cache_max_entries
+)
+
+# Runs the full-text query of sync hybrid searches while the calling thread embeds the query and runs the vector query
+search_executor = ThreadPoolExecutor(max_workers=8, thread_name_prefix="knowledge-search")
+
+
+# The maximum hnsw.ef_search accepted by pgvector
+MAX_EF_SEARCH = 1000
+
+
+def normalize_query(query: str) -> str:
+    """Normalizes unicode and whitespace, so queries that differ only in formatting share cached results."""
+    return " ".join(unicodedata.normalize("NFKC", query).split())
+
+
+def reciprocal_rank_fusion(rankings: Sequence[Tuple[Sequence[Any], float]], k: int) -> List[Tuple[Any, float]]:
+    """Fuses rankings of rows with an id.
+
+    Args:
+        rankings: The (rows, weight) of each ranking, best row first
+        k: Damps the weight of the top ranks, higher values let lower ranks count more
+
+    Returns:
+        List[Tuple[Any, float]]: The (row, score) of every row, by descending score
+    """
+    scores: Dict[Any, float] = {}
+    rows: Dict[Any, Any] = {}
+    for ranking, weight in rankings:
+        for rank, row in enumerate(ranking, start=1):
+            scores[row.id] = scores.get(row.id, 0.0) + weight / (k + rank)
+            rows.setdefault(row.id, row)
+    return sorted(((rows[id_], score) for id_, score in scores.items()), key=lambda item: item[1], reverse=True)
+
+
+class KnowledgeVectorDb(PgVector):
+    """PgVector with per-query ef_search and probes, fused hybrid search and concurrent index builds.
+
+    Args:
+        table_name: Name of the table
+        vector_index: HNSW or Ivfflat, by default the one configured by the db settings, see `get_vector_index()`
+        async_engine: Engine of async searches, eg: db.session.db_async_engine. Without it they run in a thread.
+        rrf_k: Damping of reciprocal rank fusion
+        vector_weight: Weight of the vector ranking in the fused ranking
+        keyword_weight: Weight of the full-text ranking in the fused ranking
+        candidates: Candidates fetched by each query of a hybrid search
+        search_cache: Cache of fused results, None to disable it
+        quantization: "halfvec" or "binary" to search a quantized vector index and re-rank, "none" otherwise
+        rerank_factor: Candidates fetched from a quantized index per result
+    """
+
+    def __init__(
+        self,
+        table_name: str,
+        vector_index: Optional[Any] = None,
+        async_engine: Optional[AsyncEngine] = None,
+        rrf_k: int = db_settings.knowledge_rrf_k,
+        vector_weight: float = db_settings.knowledge_rrf_vector_weight,
+        keyword_weight: float = db_settings.knowledge_rrf_keyword_weight,
+        candidates: int = db_settings.knowledge_hybrid_candidates,
+        search_cache: Optional[HybridSearchCache] = hybrid_search_cache,
+        quantization: str = db_settings.knowledge_quantization,
+        rerank_factor: int = db_settings.knowledge_rerank_factor,
+        **kwargs: Any,
+    ):
+        super().__init__(table_name=table_name, vector_index=vector_index or get_vector_index(), **kwargs)
+        # The language is part of the full-text expression, so queries match the expression of the GIN index
+        if not re.fullmatch(r"[a-z_]+", self.content_language):
+            raise ValueError(f"Invalid content_language: {self.content_language}")
+        if quantization not in QUANTIZATIONS:
+            raise ValueError(f"Invalid quantization: {quantization}")
+        self.async_engine = async_engine
+        self.rrf_k = rrf_k
+        self.vector_weight = vector_weight
+        self.keyword_weight = keyword_weight
+        self.candidates = candidates
+        self.search_cache = search_cache
+        self.quantization = quantization
+        self.rerank_factor = rerank_factor
+        self._ef_search_clamped = False
+
+    def clear_search_cache(self) -> None:
+        """Drops the cached results of this table, so searches see the documents just written."""
+        if self.search_cache is not None:
+            self.search_cache.clear(self.table.fullname)
+
+    def insert(
+        self, documents: List[Document], filters: Optional[Dict[str, Any]] = None, batch_size: int = 100
+    ) -> None:
+        try:
+            super().insert(documents, filters=filters, batch_size=batch_size)
+        finally:
+            self.clear_search_cache()
+
+    def upsert(
+        self, documents: List[Document], filters: Optional[Dict[str, Any]] = None, batch_size: int = 100
+    ) -> None:
+        try:
+            super().upsert(documents, filters=filters, batch_size=batch_size)
+        finally:
+            self.clear_search_cache()
+
+    def delete(self) -> bool:
+        try:
+            return super().delete()
+        finally:
+            self.clear_search_cache()
+
+    def get_search_settings(
+        self, limit: int, ef_search: Optional[int] = None, probes: Optional[int] = None
+    ) -> Dict[str, int]:
+        """Returns the settings of the vector index for a query."""
+        if isinstance(self.vector_index, HNSW):
+            # An HNSW scan returns at most ef_search rows
+            value = max(ef_search or self.vector_index.ef_search, self.get_index_limit(limit))
+            if value > MAX_EF_SEARCH:
+                if not self._ef_search_clamped:
+                    self._ef_search_clamped = True
+                    logger.warning(
+                        f"hnsw.ef_search of {value} for {self.table.fullname} is above pgvector's maximum, using "
+                        f"{MAX_EF_SEARCH}. Lower the rerank_factor or the candidates."
+                    )
+                value = MAX_EF_SEARCH
+            return {"hnsw.ef_search": value}
+        if isinstance(self.vector_index, Ivfflat):
+            return {"ivfflat.probes": probes or self.vector_index.probes}
+        return {}
+
+    def get_index_limit(self, limit: int) -> int:
+        """Returns the rows read from the vector index for `limit` results, more to re-rank with a quantized index."""
+        if self.quantization == "none":
+            return limit
+        return limit * max(self.rerank_factor, 1)
+
+    def get_distance(self, embedding: List[float], column: Any = None) -> Any:
+        column = self.table.c.embedding if column is None else column
+        if self.distance == Distance.l2:
+            return column.l2_distance(embedding)
+        if self.distance == Distance.max_inner_product:
+            return column.max_inner_product(embedding)
+        return column.cosine_distance(embedding)
+
+    def get_quantized_distance(self, embedding: List[float]) -> Any:
+        """Returns the distance served by the quantized index, the expression must match get_index_expression()."""
+        # Typed, since binary_quantize() is defined for vector and halfvec
+        query: Any = cast(literal(embedding, Vector(self.dimensions)), Vector(self.dimensions))
+        if self.quantization == "binary":
+            column: Any = cast(func.binary_quantize(self.table.c.embedding), BIT(self.dimensions))
+            return column.hamming_distance(func.binary_quantize(query))
+        column = cast(self.table.c.embedding, HALFVEC(self.dimensions))
+        query = cast(query, HALFVEC(self.dimensions))
+        if self.distance == Distance.l2:
+            return column.l2_distance(query)
+        if self.distance == Distance.max_inner_product:
+            return column.max_inner_product(query)
+        return column.cosine_distance(query)
+
+    def get_vector_statement(
+        self, embedding: List[float], limit: int, filters: Optional[Dict[str, Any]] = None, embeddings: bool = True
+    ) -> Select:
+        """Returns the query of the `limit` documents nearest to an embedding.
+
+        With a quantized index, the query re-ranks the candidates of the index by their full-precision distance.
+        """
+        table = self.table
+        columns = [table.c.id, table.c.name, table.c.meta_data, table.c.content]
+        if embeddings:
+            columns += [table.c.usage]
+        if embeddings or self.quantization != "none":
+            columns += [table.c.embedding]
+        stmt = select(*columns)
+        if filters is not None:
+            stmt = stmt.where(table.c.filters.contains(filters))
+        if self.quantization == "none":
+            return stmt.order_by(self.get_distance(embedding)).limit(limit)
+
+        candidates = (
+            stmt.order_by(self.get_quantized_distance(embedding))
+            .limit(self.get_index_limit(limit))
+            .subquery("candidates")
+        )
+        outer_columns = [column for column in candidates.c if embeddings or column.name != "embedding"]
+        return select(*outer_columns).order_by(self.get_distance(embedding, column=candidates.c.embedding)).limit(limit)
+
+    def get_keyword_statement(self, query: str, limit: int, filters: Optional[Dict[str, Any]] = None) -> Select:
+        """Returns the query of the `limit` documents matching a full-text query best."""
+        table = self.table
+        language: Any = literal_column(f"'{self.content_language}'::regconfig")
+        ts_vector = func.to_tsvector(language, table.c.content)
+        processed_query = self.enable_prefix_matching(query) if self.prefix_match else query
+        ts_query = func.websearch_to_tsquery(language, bindparam("query", value=processed_query))
+        stmt = select(table.c.id, table.c.name, table.c.meta_data, table.c.content).where(ts_vector.op("@@")(ts_query))
+        if filters is not None:
+            stmt = stmt.where(table.c.filters.contains(filters))
+        return stmt.order_by(func.ts_rank_cd(ts_vector, ts_query).desc()).limit(limit)
+
+    def fetch(self, stmt: Select, settings: Optional[Dict[str, int]] = None) -> Sequence[Row]:
+        with self.Session() as sess, sess.begin():
+            for name, value in (settings or {}).items():
+                sess.execute(text(f"SET LOCAL {name} = {int(value)}"))
+            return sess.execute(stmt).fetchall()
+
+    async def async_fetch(self, stmt: Select, settings: Optional[Dict[str, int]] = None) -> Sequence[Row]:
+        assert self.async_engine is not None
+        async with self.async_engine.connect() as conn, conn.begin():
+            for name, value in (settings or {}).items():
+                await conn.execute(text(f"SET LOCAL {name} = {int(value)}"))
+            return (await conn.execute(stmt)).fetchall()
+
+    def search(
+        self,
+        query: str,
+        limit: int = 5,
+        filters: Optional[Dict[str, Any]] = None,
+        ef_search: Optional[int] = None,
+        probes: Optional[int] = None,
+    ) -> List[Document]:
+        if self.search_type == SearchType.vector:
+            return self.vector_search(query, limit=limit, filters=filters, ef_search=ef_search, probes=probes)
+        return super().search(query, limit=limit, filters=filters)
+
+    async def async_search(
+        self, query: str, limit: int = 5, filters: Optional[Dict[str, Any]] = None
+    ) -> List[Document]:
+        if self.search_type == SearchType.hybrid and self.async_engine is not None:
+            return await self.async_hybrid_search(query, limit=limit, filters=filters)
+        return await super().async_search(query, limit=limit, filters=filters)
+
+    def vector_search(
+        self,
+        query: str,
+        limit: int = 5,
+        filters: Optional[Dict[str, Any]] = None,
+        ef_search: Optional[int] = None,
+        probes: Optional[int] = None,
+    ) -> List[Document]:
+        """Returns the `limit` documents nearest to a query.
+
+        Args:
+            query: The search query
+            limit: Maximum number of results to return
+            filters: Only return documents whose filters contain these
+            ef_search: HNSW candidates visited, by default the ef_search of the vector index
+            probes: IVFFlat lists scanned, by default the probes of the vector index
+        """
+        embedding = self.embedder.get_embedding(query)
+        if not embedding:
+            logger.error(f"Error getting embedding for Query: {query}")
+            return []
+        return self.search_by_embedding(embedding, limit=limit, filters=filters, ef_search=ef_search, probes=probes)
+
+    def search_by_embedding(
+        self,
+        embedding: List[float],
+        limit: int = 5,
+        filters: Optional[Dict[str, Any]] = None,
+        ef_search: Optional[int] = None,
+        probes: Optional[int] = None,
+    ) -> List[Document]:
+        """Returns the `limit` documents nearest to an embedding, see `vector_search()`."""
+        try:
+            results = self.fetch(
+                self.get_vector_statement(embedding, limit, filters), self.get_search_settings(limit, ef_search, probes)
+            )
+        except Exception as e:
+            logger.error(f"Error performing vector search: {e}")
+            return []
+        return [
+            Document(
+                id=result.id,
+                name=result.name,
+                meta_data=result.meta_data,
+                content=result.content,
+                embedder=self.embedder,
+                embedding=result.embedding,
+                usage=result.usage,
+            )
+            for result in results
+        ]
+
+    def get_cache_key(self, query: str, limit: int, filters: Optional[Dict[str, Any]]) -> Tuple[str, ...]:
+        return (self.table.fullname, normalize_query(query), str(limit), json.dumps(filters, sort_keys=True))
+
+    def fuse(self, vector_rows: Sequence[Row], keyword_rows: Sequence[Row], limit: int) -> List[Document]:
+        """Returns the best `limit` documents of the fused rankings, with their fused score as reranking_score."""
+        fused = reciprocal_rank_fusion(
+            [(vector_rows, self.vector_weight), (keyword_rows, self.keyword_weight)], k=self.rrf_k
+        )
+        return [
+            Document(
+                id=row.id,
+                name=row.name,
+                meta_data=row.meta_data,
+                content=row.content,
+                embedder=self.embedder,
+                reranking_score=score,
+            )
+            for row, score in fused[:limit]
+        ]
+
+    def hybrid_search(self, query: str, limit: int = 5, filters: Optional[Dict[str, Any]] = None) -> List[Document]:
+        """Returns the best `limit` documents of the fused vector and full-text rankings of a query.
+
+        Documents are returned without their embedding.
+        """
+        key = self.get_cache_key(query, limit, filters)
+        if self.search_cache is not None and (cached := self.search_cache.get(key)) is not None:
+            return cached
+
+        candidates = max(self.candidates, limit)
+        keyword_future = search_executor.submit(self.fetch, self.get_keyword_statement(query, candidates, filters))
+        errors = 0
+        vector_rows: Sequence[Row] = []
+        keyword_rows: Sequence[Row] = []
+        try:
+            embedding = self.embedder.get_embedding(query)
+            if not embedding:
+                raise ValueError("the query could not be embedded")
+            vector_rows = self.fetch(
+                self.get_vector_statement(embedding, candidates, filters, embeddings=False),
+                self.get_search_settings(candidates),
+            )
+        except Exception as e:
+            logger.error(f"Error performing the vector query of a hybrid search: {e}")
+            errors += 1
+        try:
+            keyword_rows = keyword_future.result()
+        except Exception as e:
+            logger.error(f"Error performing the keyword query of a hybrid search: {e}")
+            errors += 1
+        return self._finish_hybrid_search(key, vector_rows, keyword_rows, limit, errors)
+
+    async def async_hybrid_search(
+        self, query: str, limit: int = 5, filters: Optional[Dict[str, Any]] = None
+    ) -> List[Document]:
+        """`hybrid_search()` on the async engine, the queries run on two connections at the same time."""
+        key = self.get_cache_key(query, limit, filters)
+        if self.search_cache is not None and (cached := self.search_cache.get(key)) is not None:
+            return cached
+
+        candidates = max(self.candidates, limit)
+
+        async def vector_query() -> Sequence[Row]:
+            embedding = await asyncio.to_thread(self.embedder.get_embedding, query)
+            if not embedding:
+                raise ValueError("the query could not be embedded")
+            return await self.async_fetch(
+                self.get_vector_statement(embedding, candidates, filters, embeddings=False),
+                self.get_search_settings(candidates),
+            )
+
+        results = await asyncio.gather(
+            vector_query(),
+            self.async_fetch(self.get_keyword_statement(query, candidates, filters)),
+            return_exceptions=True,
+        )
+        rows: List[Sequence[Row]] = []
+        errors = 0
+        for name, result in zip(("vector", "keyword"), results):
+            if isinstance(result, BaseException):
+                logger.error(f"Error performing the {name} query of a hybrid search: {result}")
+                errors += 1
+                rows.append([])
+            else:
+                rows.append(result)
+        return self._finish_hybrid_search(key, rows[0], rows[1], limit, errors)
+
+    def _finish_hybrid_search(
+        self, key: Tuple[str, ...], vector_rows: Sequence[Row], keyword_rows: Sequence[Row], limit: int, errors: int
+    ) -> List[Document]:
+        documents = self.fuse(vector_rows, keyword_rows, limit)
+        if self.search_cache is not None:
+            for _ in range(errors):
+                self.search_cache.count_error()
+            # Results missing a ranking are not cached
+            if not errors:
+                self.search_cache.set(key, documents)
+        return documents
+
+    def optimize(self, force_recreate: bool = False) -> None:
+        """Builds the vector index concurrently, or rebuilds it with `force_recreate`, and agno's full-text index."""
+        if self.vector_index is not None:
+            if force_recreate:
+                rebuild_vector_index(self, self.vector_index)
+            else:
+                ensure_vector_index(self, self.vector_index)
+        self._create_gin_index(force_recreate=force_recreate)
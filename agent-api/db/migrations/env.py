@@ -27,8 +27,11 @@ target_metadata = Base.metadata
 # Only include tables that are in the target_metadata
 # See: https://alembic.sqlalchemy.org/en/latest/autogenerate.html#omitting-table-names-from-the-autogenerate-process
 def include_name(name, type_, parent_names):
-    if type_ == "table":
-        return name in target_metadata.tables
+    if type_ == "schema":
+        # Tables are in the default schema or the "ai" schema of agno's storages and vector dbs
+        return name is None or name in {table.schema for table in target_metadata.tables.values()}
+    elif type_ == "table":
+        return f"{parent_names['schema_name'] or target_metadata.schema}.{name}" in target_metadata.tables
     else:
         return True
 
@@ -49,6 +52,7 @@ def run_migrations_offline() -> None:
         url=url,
         target_metadata=target_metadata,
         include_name=include_name,
+        include_schemas=True,
         literal_binds=True,
         dialect_opts={"paramstyle": "named"},
         version_table_schema=target_metadata.schema,
@@ -75,6 +79,7 @@ def run_migrations_online() -> None:
             connection=connection,
             target_metadata=target_metadata,
             include_name=include_name,
+            include_schemas=True,
             version_table_schema=target_metadata.schema,
         )
 
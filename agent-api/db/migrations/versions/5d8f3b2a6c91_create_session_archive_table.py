@@ -0,0 +1,45 @@
+"""Create session archive table
+
+Revision ID: 5d8f3b2a6c91
+Revises: c4a7e1d9b352
+Create Date: 2026-10-17 12:00:00.000000
+
+"""
+
+import sqlalchemy as sa
+from alembic import op
+
+# revision identifiers, used by Alembic.
+revision = "5d8f3b2a6c91"
+down_revision = "c4a7e1d9b352"
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    op.create_table(
+        "session_archive",
+        sa.Column("id", sa.BigInteger(), autoincrement=True, nullable=False),
+        sa.Column("session_table", sa.String(), nullable=False),
+        sa.Column("session_id", sa.String(), nullable=False),
+        sa.Column("run_count", sa.Integer(), nullable=False),
+        sa.Column("first_created_at", sa.BigInteger(), nullable=True),
+        sa.Column("last_created_at", sa.BigInteger(), nullable=True),
+        sa.Column("payload", sa.LargeBinary(), nullable=False),
+        sa.Column("raw_bytes", sa.Integer(), nullable=False),
+        sa.Column("archived_at", sa.DateTime(timezone=True), server_default=sa.text("now()"), nullable=False),
+        sa.PrimaryKeyConstraint("id"),
+        schema="public",
+    )
+    op.create_index(
+        "ix_session_archive_session",
+        "session_archive",
+        ["session_table", "session_id", "last_created_at"],
+        unique=False,
+        schema="public",
+    )
+
+
+def downgrade() -> None:
+    op.drop_index("ix_session_archive_session", table_name="session_archive", schema="public")
+    op.drop_table("session_archive", schema="public")
@@ -0,0 +1,40 @@
+"""Create response cache table
+
+Revision ID: 8b2e4d6f0a13
+Revises: 3f1c2a9d7b40
+Create Date: 2026-10-17 12:00:00.000000
+
+"""
+
+import sqlalchemy as sa
+from alembic import op
+from sqlalchemy.dialects import postgresql
+
+# revision identifiers, used by Alembic.
+revision = "8b2e4d6f0a13"
+down_revision = "3f1c2a9d7b40"
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    op.create_table(
+        "response_cache",
+        sa.Column("key", sa.String(), nullable=False),
+        sa.Column("agent_id", sa.String(), nullable=False),
+        sa.Column("model_id", sa.String(), nullable=False),
+        sa.Column("content", postgresql.JSONB(astext_type=sa.Text()), nullable=True),
+        sa.Column("created_at", sa.DateTime(timezone=True), server_default=sa.text("now()"), nullable=False),
+        sa.Column("accessed_at", sa.DateTime(timezone=True), server_default=sa.text("now()"), nullable=False),
+        sa.Column("expires_at", sa.DateTime(timezone=True), nullable=False),
+        sa.PrimaryKeyConstraint("key"),
+        schema="public",
+    )
+    op.create_index("ix_response_cache_expires_at", "response_cache", ["expires_at"], unique=False, schema="public")
+    op.create_index("ix_response_cache_accessed_at", "response_cache", ["accessed_at"], unique=False, schema="public")
+
+
+def downgrade() -> None:
+    op.drop_index("ix_response_cache_accessed_at", table_name="response_cache", schema="public")
+    op.drop_index("ix_response_cache_expires_at", table_name="response_cache", schema="public")
+    op.drop_table("response_cache", schema="public")
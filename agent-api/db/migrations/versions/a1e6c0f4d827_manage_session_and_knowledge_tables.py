@@ -0,0 +1,160 @@
+"""Manage session and knowledge tables
+
+Creates the agno session and knowledge tables in the "ai" schema, with agno's indexes, if agno has not created them
+yet. Then adds the indexes for session listing, compaction and full-text search. Indexes are built with CREATE INDEX
+CONCURRENTLY so existing tables stay writable. A failed concurrent build leaves an invalid index, drop it before
+upgrading again.
+
+Revision ID: a1e6c0f4d827
+Revises: 5d8f3b2a6c91
+Create Date: 2026-10-17 12:00:00.000000
+
+"""
+
+from typing import List
+
+import sqlalchemy as sa
+from alembic import op
+from pgvector.sqlalchemy import Vector
+from sqlalchemy.dialects import postgresql
+
+# revision identifiers, used by Alembic.
+revision = "a1e6c0f4d827"
+down_revision = "5d8f3b2a6c91"
+branch_labels = None
+depends_on = None
+
+SESSION_TABLES = {
+    "sage_sessions": "agent",
+    "scholar_sessions": "agent",
+    "finance_agent": "agent",
+    "web_agent": "agent",
+    "finance_researcher_team": "team",
+    "multi_language_team": "team",
+    "blog_post_generator_workflows": "workflow",
+    "investment_report_generator_workflows": "workflow",
+}
+
+
+def get_session_columns(mode: str) -> List[sa.Column]:
+    """Returns the columns of agno's session tables, schema version 1."""
+    columns = [
+        sa.Column("session_id", sa.String(), nullable=False),
+        sa.Column("user_id", sa.String(), nullable=True),
+        sa.Column("memory", postgresql.JSONB(astext_type=sa.Text()), nullable=True),
+        sa.Column("session_data", postgresql.JSONB(astext_type=sa.Text()), nullable=True),
+        sa.Column("extra_data", postgresql.JSONB(astext_type=sa.Text()), nullable=True),
+        sa.Column(
+            "created_at", sa.BigInteger(), server_default=sa.text("(extract(epoch from now()))::bigint"), nullable=True
+        ),
+        sa.Column("updated_at", sa.BigInteger(), nullable=True),
+    ]
+    if mode in ("agent", "team"):
+        columns += [
+            sa.Column(f"{mode}_id", sa.String(), nullable=True),
+            sa.Column("team_session_id", sa.String(), nullable=True),
+            sa.Column(f"{mode}_data", postgresql.JSONB(astext_type=sa.Text()), nullable=True),
+        ]
+    else:
+        columns += [
+            sa.Column("workflow_id", sa.String(), nullable=True),
+            sa.Column("workflow_data", postgresql.JSONB(astext_type=sa.Text()), nullable=True),
+        ]
+    return columns
+
+
+def upgrade() -> None:
+    op.execute("CREATE SCHEMA IF NOT EXISTS ai")
+    op.execute("CREATE EXTENSION IF NOT EXISTS vector")
+
+    for table_name, mode in SESSION_TABLES.items():
+        op.create_table(
+            table_name,
+            *get_session_columns(mode),
+            sa.PrimaryKeyConstraint("session_id"),
+            schema="ai",
+            if_not_exists=True,
+        )
+        index_columns = ["user_id", f"{mode}_id"] + (["team_session_id"] if mode in ("agent", "team") else [])
+        for column in index_columns:
+            op.create_index(
+                f"ix_ai_{table_name}_{column}", table_name, [column], unique=False, schema="ai", if_not_exists=True
+            )
+
+    op.create_table(
+        "sage_knowledge",
+        sa.Column("id", sa.String(), nullable=False),
+        sa.Column("name", sa.String(), nullable=True),
+        sa.Column("meta_data", postgresql.JSONB(astext_type=sa.Text()), server_default=sa.text("'{}'::jsonb")),
+        sa.Column("filters", postgresql.JSONB(astext_type=sa.Text()), server_default=sa.text("'{}'::jsonb")),
+        sa.Column("content", sa.Text(), nullable=True),
+        sa.Column("embedding", Vector(1536), nullable=True),
+        sa.Column("usage", postgresql.JSONB(astext_type=sa.Text()), nullable=True),
+        sa.Column("created_at", sa.DateTime(timezone=True), server_default=sa.text("now()"), nullable=True),
+        sa.Column("updated_at", sa.DateTime(timezone=True), nullable=True),
+        sa.Column("content_hash", sa.String(), nullable=True),
+        sa.PrimaryKeyConstraint("id"),
+        schema="ai",
+        if_not_exists=True,
+    )
+    for column in ("id", "name", "content_hash"):
+        op.create_index(
+            f"idx_sage_knowledge_{column}", "sage_knowledge", [column], unique=False, schema="ai", if_not_exists=True
+        )
+
+    # CREATE INDEX CONCURRENTLY cannot run in a transaction
+    with op.get_context().autocommit_block():
+        for table_name in SESSION_TABLES:
+            op.create_index(
+                f"ix_{table_name}_user_id_created_at",
+                table_name,
+                ["user_id", "created_at"],
+                schema="ai",
+                postgresql_concurrently=True,
+                if_not_exists=True,
+            )
+            op.create_index(
+                f"ix_{table_name}_last_updated_at",
+                table_name,
+                [sa.text("coalesce(updated_at, created_at)")],
+                schema="ai",
+                postgresql_concurrently=True,
+                if_not_exists=True,
+            )
+        op.create_index(
+            "ix_sage_knowledge_content_tsv",
+            "sage_knowledge",
+            [sa.text("to_tsvector('english'::regconfig, content)")],
+            schema="ai",
+            postgresql_using="gin",
+            postgresql_concurrently=True,
+            if_not_exists=True,
+        )
+        op.create_index(
+            "ix_sage_knowledge_filters",
+            "sage_knowledge",
+            ["filters"],
+            schema="ai",
+            postgresql_using="gin",
+            postgresql_ops={"filters": "jsonb_path_ops"},
+            postgresql_concurrently=True,
+            if_not_exists=True,
+        )
+
+
+def downgrade() -> None:
+    # The tables are left in place, agno creates them when they are missing and they hold the sessions
+    with op.get_context().autocommit_block():
+        op.drop_index(
+            "ix_sage_knowledge_filters", table_name="sage_knowledge", schema="ai", postgresql_concurrently=True
+        )
+        op.drop_index(
+            "ix_sage_knowledge_content_tsv", table_name="sage_knowledge", schema="ai", postgresql_concurrently=True
+        )
+        for table_name in SESSION_TABLES:
+            op.drop_index(
+                f"ix_{table_name}_last_updated_at", table_name=table_name, schema="ai", postgresql_concurrently=True
+            )
+            op.drop_index(
+                f"ix_{table_name}_user_id_created_at", table_name=table_name, schema="ai", postgresql_concurrently=True
+            )
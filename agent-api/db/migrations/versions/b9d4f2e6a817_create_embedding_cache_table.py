@@ -0,0 +1,32 @@
+"""Create embedding cache table
+
+Revision ID: b9d4f2e6a817
+Revises: e7b3d5a9c2f4
+Create Date: 2026-10-17 12:00:00.000000
+
+"""
+
+import sqlalchemy as sa
+from alembic import op
+
+# revision identifiers, used by Alembic.
+revision = "b9d4f2e6a817"
+down_revision = "e7b3d5a9c2f4"
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    op.create_table(
+        "embedding_cache",
+        sa.Column("model", sa.String(), nullable=False),
+        sa.Column("text_hash", sa.LargeBinary(), nullable=False),
+        sa.Column("embedding", sa.LargeBinary(), nullable=False),
+        sa.Column("created_at", sa.DateTime(timezone=True), server_default=sa.text("now()"), nullable=False),
+        sa.PrimaryKeyConstraint("model", "text_hash"),
+        schema="public",
+    )
+
+
+def downgrade() -> None:
+    op.drop_table("embedding_cache", schema="public")
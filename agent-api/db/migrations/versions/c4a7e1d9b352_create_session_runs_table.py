@@ -0,0 +1,44 @@
+"""Create session runs table
+
+Revision ID: c4a7e1d9b352
+Revises: 8b2e4d6f0a13
+Create Date: 2026-10-17 12:00:00.000000
+
+"""
+
+import sqlalchemy as sa
+from alembic import op
+from sqlalchemy.dialects import postgresql
+
+# revision identifiers, used by Alembic.
+revision = "c4a7e1d9b352"
+down_revision = "8b2e4d6f0a13"
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    op.create_table(
+        "session_runs",
+        sa.Column("id", sa.BigInteger(), autoincrement=True, nullable=False),
+        sa.Column("session_table", sa.String(), nullable=False),
+        sa.Column("session_id", sa.String(), nullable=False),
+        sa.Column("run_id", sa.String(), nullable=False),
+        sa.Column("run", postgresql.JSONB(astext_type=sa.Text()), nullable=False),
+        sa.Column("created_at", sa.BigInteger(), nullable=False),
+        sa.PrimaryKeyConstraint("id"),
+        sa.UniqueConstraint("session_table", "session_id", "run_id", name="uq_session_runs_run"),
+        schema="public",
+    )
+    op.create_index(
+        "ix_session_runs_session_id_created_at",
+        "session_runs",
+        ["session_id", "created_at"],
+        unique=False,
+        schema="public",
+    )
+
+
+def downgrade() -> None:
+    op.drop_index("ix_session_runs_session_id_created_at", table_name="session_runs", schema="public")
+    op.drop_table("session_runs", schema="public")
@@ -0,0 +1,28 @@
+"""Update pgvector extension
+
+Updates the vector extension of databases created with an older pgvector to the version installed on the server.
+Quantized knowledge indexes need the halfvec type and binary_quantize() of pgvector 0.7.0. Extension updates cannot
+be reverted, downgrading leaves the extension as it is.
+
+Revision ID: d3c8a5f1b706
+Revises: b9d4f2e6a817
+Create Date: 2026-10-17 12:00:00.000000
+
+"""
+
+from alembic import op
+
+# revision identifiers, used by Alembic.
+revision = "d3c8a5f1b706"
+down_revision = "b9d4f2e6a817"
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    op.execute("CREATE EXTENSION IF NOT EXISTS vector")
+    op.execute("ALTER EXTENSION vector UPDATE")
+
+
+def downgrade() -> None:
+    pass
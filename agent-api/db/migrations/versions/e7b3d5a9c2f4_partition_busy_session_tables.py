@@ -0,0 +1,58 @@
+"""Partition busy session tables
+
+Creates the session_lookup table and, when SESSION_PARTITIONING is set, range partitions scholar_sessions and
+finance_researcher_team by created_at month. The tables are locked while their rows are copied to the partitions,
+run it in a quiet period. Without the setting the tables are left as they are, they can be converted later with
+python -m db.partitions --partition-tables. To partition another session table, add a revision that calls
+partition_session_table() and set __partitioned__ on its model.
+
+Revision ID: e7b3d5a9c2f4
+Revises: a1e6c0f4d827
+Create Date: 2026-10-17 12:00:00.000000
+
+"""
+
+import sqlalchemy as sa
+from alembic import context, op
+
+from db.partitions import SESSION_SCHEMA, is_partitioned, partition_session_table, unpartition_session_table
+from db.settings import db_settings
+
+# revision identifiers, used by Alembic.
+revision = "e7b3d5a9c2f4"
+down_revision = "a1e6c0f4d827"
+branch_labels = None
+depends_on = None
+
+PARTITIONED_TABLES = ["scholar_sessions", "finance_researcher_team"]
+
+
+def upgrade() -> None:
+    op.create_table(
+        "session_lookup",
+        sa.Column("session_table", sa.String(), nullable=False),
+        sa.Column("session_id", sa.String(), nullable=False),
+        sa.Column("created_at", sa.BigInteger(), nullable=False),
+        sa.PrimaryKeyConstraint("session_table", "session_id"),
+        schema="public",
+    )
+    if not db_settings.session_partitioning:
+        return
+    # The partitions depend on the rows of the tables, so the conversion needs a connection
+    if context.is_offline_mode():
+        raise RuntimeError("Partitioning session tables is not supported in offline mode")
+    for table_name in PARTITIONED_TABLES:
+        if not is_partitioned(op.get_bind(), f"{SESSION_SCHEMA}.{table_name}"):
+            partition_session_table(op.get_bind(), table_name)
+
+
+def downgrade() -> None:
+    if context.is_offline_mode():
+        if db_settings.session_partitioning:
+            raise RuntimeError("Partitioning session tables is not supported in offline mode")
+    else:
+        # Tables are converted back if they were partitioned, whatever the current setting
+        for table_name in PARTITIONED_TABLES:
+            if is_partitioned(op.get_bind(), f"{SESSION_SCHEMA}.{table_name}"):
+                unpartition_session_table(op.get_bind(), table_name)
+    op.drop_table("session_lookup", schema="public")
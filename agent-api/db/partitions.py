@@ -0,0 +1,319 @@
+import argparse
+import re
+import time
+from datetime import date, datetime, timezone
+from typing import List, Optional
+
+from sqlalchemy import Connection, Engine, text
+
+from db.session import db_engine
+from db.settings import db_settings
+from db.tables import Base
+from utils.log import logger
+
+######################################################
+## Monthly partitions of session tables
+######################################################
+
+# Busy session tables can be range partitioned by created_at month, so vacuum and index maintenance work on one
+# month at a time and old months can be detached. Partitioning is opt-in with db_settings.session_partitioning, the
+# tables are then converted by a migration that calls partition_session_table(), or by partition_session_tables()
+# when it is set later. The storage finds a session's partition through the session_lookup table.
+
+SESSION_SCHEMA = "ai"
+# Detached partitions are moved to this schema, out of the session tables
+DETACHED_SCHEMA = "ai_detached"
+
+PARTITION_NAME = re.compile(r"_p(\d{4})(\d{2})$")
+
+
+def add_months(month: date, months: int) -> date:
+    index = month.year * 12 + month.month - 1 + months
+    return date(index // 12, index % 12 + 1, 1)
+
+
+def get_month(created_at: float) -> date:
+    """Returns the first day of the month of an epoch, in UTC."""
+    created = datetime.fromtimestamp(created_at, tz=timezone.utc)
+    return date(created.year, created.month, 1)
+
+
+def get_epoch(month: date) -> int:
+    return int(datetime(month.year, month.month, month.day, tzinfo=timezone.utc).timestamp())
+
+
+def get_partition_name(table_name: str, month: date) -> str:
+    return f"{table_name}_p{month:%Y%m}"
+
+
+def get_partitioned_tables(conn: Connection, schema: str = SESSION_SCHEMA) -> List[str]:
+    """Returns the names of the partitioned tables in a schema."""
+    return list(
+        conn.execute(
+            text(
+                "SELECT c.relname FROM pg_partitioned_table p JOIN pg_class c ON c.oid = p.partrelid "
+                "WHERE c.relnamespace = to_regnamespace(:schema) ORDER BY c.relname"
+            ),
+            {"schema": schema},
+        ).scalars()
+    )
+
+
+def get_partitions(conn: Connection, table_name: str, schema: str = SESSION_SCHEMA) -> List[str]:
+    """Returns the names of the partitions of a table."""
+    return list(
+        conn.execute(
+            text(
+                "SELECT c.relname FROM pg_inherits i JOIN pg_class c ON c.oid = i.inhrelid "
+                "WHERE i.inhparent = to_regclass(:table) ORDER BY c.relname"
+            ),
+            {"table": f"{schema}.{table_name}"},
+        ).scalars()
+    )
+
+
+def get_schema_partitions(conn: Connection, schema: str = SESSION_SCHEMA) -> List[str]:
+    """Returns the names of all partitions in a schema."""
+    return list(
+        conn.execute(
+            text("SELECT relname FROM pg_class WHERE relispartition AND relnamespace = to_regnamespace(:schema)"),
+            {"schema": schema},
+        ).scalars()
+    )
+
+
+def is_partitioned(conn: Connection, table_fullname: str) -> bool:
+    return bool(
+        conn.execute(
+            text("SELECT EXISTS (SELECT 1 FROM pg_partitioned_table WHERE partrelid = to_regclass(:table))"),
+            {"table": table_fullname},
+        ).scalar()
+    )
+
+
+def create_partitions(conn: Connection, table_name: str, first_month: date, last_month: date) -> List[str]:
+    """Creates the missing monthly partitions of a table from `first_month` to `last_month`, and returns them."""
+    # Processes creating the same partitions wait for each other
+    conn.execute(text("SELECT pg_advisory_xact_lock(hashtext(:table))"), {"table": f"partitions:{table_name}"})
+    existing = set(get_partitions(conn, table_name))
+    created = []
+    month = first_month
+    while month <= last_month:
+        name = get_partition_name(table_name, month)
+        if name not in existing:
+            conn.execute(
+                text(
+                    f"CREATE TABLE {SESSION_SCHEMA}.{name} PARTITION OF {SESSION_SCHEMA}.{table_name} "
+                    f"FOR VALUES FROM ({get_epoch(month)}) TO ({get_epoch(add_months(month, 1))})"
+                )
+            )
+            created.append(name)
+        month = add_months(month, 1)
+    return created
+
+
+def create_future_partitions(
+    engine: Engine, months_ahead: int, created_at: Optional[float] = None, table_name: Optional[str] = None
+) -> List[str]:
+    """Creates the partitions of the current month and the next `months_ahead` months for partitioned tables.
+
+    Args:
+        created_at: Also create the partition of this epoch
+        table_name: Only create partitions of this table
+    """
+    current_month = get_month(time.time())
+    created = []
+    with engine.begin() as conn:
+        for name in get_partitioned_tables(conn):
+            if table_name is not None and name != table_name:
+                continue
+            first_month = min(current_month, get_month(created_at)) if created_at is not None else current_month
+            last_month = add_months(current_month, months_ahead)
+            if created_at is not None:
+                last_month = max(last_month, get_month(created_at))
+            created += create_partitions(conn, name, first_month, last_month)
+    for name in created:
+        logger.info(f"Created partition {SESSION_SCHEMA}.{name}")
+    return created
+
+
+def detach_old_partitions(engine: Engine, retention_months: int) -> List[str]:
+    """Detaches the partitions of months that ended more than `retention_months` months ago.
+
+    Detached partitions are moved to the ai_detached schema, to be archived or dropped. Their sessions can no
+    longer be read, and their session_lookup rows are deleted.
+    """
+    cutoff = add_months(get_month(time.time()), -retention_months)
+    with engine.connect() as conn:
+        partitions = {table_name: get_partitions(conn, table_name) for table_name in get_partitioned_tables(conn)}
+
+    detached = []
+    # DETACH PARTITION CONCURRENTLY cannot run in a transaction
+    with engine.connect().execution_options(isolation_level="AUTOCOMMIT") as conn:
+        conn.execute(text(f"CREATE SCHEMA IF NOT EXISTS {DETACHED_SCHEMA}"))
+        for table_name, names in partitions.items():
+            for name in names:
+                match = PARTITION_NAME.search(name)
+                if match is None:
+                    continue
+                month = date(int(match.group(1)), int(match.group(2)), 1)
+                if add_months(month, 1) > cutoff:
+                    continue
+                conn.execute(
+                    text(
+                        f"ALTER TABLE {SESSION_SCHEMA}.{table_name} "
+                        f"DETACH PARTITION {SESSION_SCHEMA}.{name} CONCURRENTLY"
+                    )
+                )
+                conn.execute(text(f"ALTER TABLE {SESSION_SCHEMA}.{name} SET SCHEMA {DETACHED_SCHEMA}"))
+                conn.execute(
+                    text(
+                        "DELETE FROM public.session_lookup WHERE session_table = :table "
+                        "AND created_at >= :start AND created_at < :end"
+                    ),
+                    {
+                        "table": f"{SESSION_SCHEMA}.{table_name}",
+                        "start": get_epoch(month),
+                        "end": get_epoch(add_months(month, 1)),
+                    },
+                )
+                logger.info(f"Detached partition {SESSION_SCHEMA}.{name} to {DETACHED_SCHEMA}.{name}")
+                detached.append(name)
+    return detached
+
+
+def get_index_definitions(conn: Connection, table_fullname: str) -> List[str]:
+    """Returns the CREATE INDEX statements of the indexes of a table, except the primary key."""
+    definitions = conn.execute(
+        text(
+            "SELECT pg_get_indexdef(indexrelid) FROM pg_index "
+            "WHERE indrelid = to_regclass(:table) AND NOT indisprimary ORDER BY indexrelid"
+        ),
+        {"table": table_fullname},
+    ).scalars()
+    # Indexes of a partitioned table are defined ON ONLY the parent
+    return [definition.replace(" ON ONLY ", " ON ") for definition in definitions]
+
+
+def partition_session_table(conn: Connection, table_name: str, months_ahead: int = 3) -> None:
+    """Converts a session table to a table range partitioned by created_at month.
+
+    The primary key becomes (session_id, created_at), the rows are copied to monthly partitions and the indexes
+    are recreated on the partitioned table. The table is locked while its rows are copied. Used by migrations.
+    """
+    table = f"{SESSION_SCHEMA}.{table_name}"
+    previous = f"{table_name}_unpartitioned"
+    indexes = get_index_definitions(conn, table)
+
+    conn.execute(text(f"LOCK TABLE {table} IN ACCESS EXCLUSIVE MODE"))
+    conn.execute(text(f"ALTER TABLE {table} RENAME TO {previous}"))
+    conn.execute(
+        text(f"ALTER TABLE {SESSION_SCHEMA}.{previous} RENAME CONSTRAINT {table_name}_pkey TO {previous}_pkey")
+    )
+    conn.execute(
+        text(
+            f"UPDATE {SESSION_SCHEMA}.{previous} "
+            "SET created_at = coalesce(updated_at, extract(epoch from now())::bigint) WHERE created_at IS NULL"
+        )
+    )
+    conn.execute(
+        text(
+            f"CREATE TABLE {table} (LIKE {SESSION_SCHEMA}.{previous} INCLUDING DEFAULTS) "
+            "PARTITION BY RANGE (created_at)"
+        )
+    )
+    conn.execute(text(f"ALTER TABLE {table} ALTER COLUMN created_at SET NOT NULL"))
+    conn.execute(text(f"ALTER TABLE {table} ADD PRIMARY KEY (session_id, created_at)"))
+
+    oldest = conn.execute(text(f"SELECT min(created_at) FROM {SESSION_SCHEMA}.{previous}")).scalar()
+    current_month = get_month(time.time())
+    first_month = min(get_month(oldest), current_month) if oldest is not None else current_month
+    create_partitions(conn, table_name, first_month, add_months(current_month, months_ahead))
+
+    conn.execute(text(f"INSERT INTO {table} SELECT * FROM {SESSION_SCHEMA}.{previous}"))
+    conn.execute(
+        text(
+            "INSERT INTO public.session_lookup (session_table, session_id, created_at) "
+            f"SELECT :table, session_id, created_at FROM {SESSION_SCHEMA}.{previous} "
+            "ON CONFLICT (session_table, session_id) DO UPDATE SET created_at = excluded.created_at"
+        ),
+        {"table": table},
+    )
+    conn.execute(text(f"DROP TABLE {SESSION_SCHEMA}.{previous}"))
+    for definition in indexes:
+        conn.execute(text(definition))
+
+
+def unpartition_session_table(conn: Connection, table_name: str) -> None:
+    """Converts a partitioned session table back to a plain table keyed by session_id.
+
+    Only the rows of attached partitions are copied. Used by migrations.
+    """
+    table = f"{SESSION_SCHEMA}.{table_name}"
+    previous = f"{table_name}_partitioned"
+    indexes = get_index_definitions(conn, table)
+
+    conn.execute(text(f"LOCK TABLE {table} IN ACCESS EXCLUSIVE MODE"))
+    conn.execute(text(f"ALTER TABLE {table} RENAME TO {previous}"))
+    conn.execute(
+        text(f"ALTER TABLE {SESSION_SCHEMA}.{previous} RENAME CONSTRAINT {table_name}_pkey TO {previous}_pkey")
+    )
+    conn.execute(text(f"CREATE TABLE {table} (LIKE {SESSION_SCHEMA}.{previous} INCLUDING DEFAULTS)"))
+    conn.execute(text(f"ALTER TABLE {table} ALTER COLUMN created_at DROP NOT NULL"))
+    conn.execute(text(f"ALTER TABLE {table} ADD PRIMARY KEY (session_id)"))
+    conn.execute(
+        text(
+            f"INSERT INTO {table} SELECT * FROM {SESSION_SCHEMA}.{previous} "
+            "ORDER BY created_at DESC ON CONFLICT (session_id) DO NOTHING"
+        )
+    )
+    conn.execute(text(f"DROP TABLE {SESSION_SCHEMA}.{previous}"))
+    conn.execute(text("DELETE FROM public.session_lookup WHERE session_table = :table"), {"table": table})
+    for definition in indexes:
+        conn.execute(text(definition))
+
+
+def get_model_partitioned_tables() -> List[str]:
+    """Returns the names of the session tables whose models are partitioned, see db/tables/sessions.py."""
+    return [
+        table.name
+        for table in Base.metadata.sorted_tables
+        if table.schema == SESSION_SCHEMA and table.dialect_options["postgresql"]["partition_by"]
+    ]
+
+
+def partition_session_tables(engine: Engine, table_names: List[str]) -> List[str]:
+    """Partitions the tables that are not partitioned yet, each in its own transaction, and returns them."""
+    partitioned = []
+    for table_name in table_names:
+        with engine.begin() as conn:
+            if is_partitioned(conn, f"{SESSION_SCHEMA}.{table_name}"):
+                continue
+            partition_session_table(conn, table_name, db_settings.session_partition_months_ahead)
+        logger.info(f"Partitioned {SESSION_SCHEMA}.{table_name}")
+        partitioned.append(table_name)
+    return partitioned
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Creates future partitions and detaches old partitions")
+    parser.add_argument("--months-ahead", type=int, default=db_settings.session_partition_months_ahead)
+    parser.add_argument("--retention-months", type=int, default=db_settings.session_partition_retention_months)
+    parser.add_argument(
+        "--partition-tables",
+        action="store_true",
+        help="First convert the tables partitioned by their models, with SESSION_PARTITIONING set. Locks each table.",
+    )
+    args = parser.parse_args()
+
+    if args.partition_tables:
+        partitioned = partition_session_tables(db_engine, get_model_partitioned_tables())
+        print(f"partitioned: {', '.join(partitioned) or '-'}")
+    created = create_future_partitions(db_engine, args.months_ahead)
+    detached = detach_old_partitions(db_engine, args.retention_months) if args.retention_months > 0 else []
+    print(f"created: {', '.join(created) or '-'}")
+    print(f"detached: {', '.join(detached) or '-'}")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,16 +1,24 @@
-from typing import Generator
+from dataclasses import dataclass
+from typing import Any, AsyncGenerator, Dict, Generator
 
 from sqlalchemy.engine import Engine, create_engine
+from sqlalchemy.ext.asyncio import AsyncEngine, AsyncSession, async_sessionmaker, create_async_engine
 from sqlalchemy.orm import Session, sessionmaker
 
 from db.settings import db_settings
 
-# Create SQLAlchemy Engine using a database URL
+# Create SQLAlchemy Engines using a database URL.
+# Agent storages and vector dbs are passed db_engine, so a process keeps one sync and one async connection pool.
 db_url: str = db_settings.get_db_url()
-db_engine: Engine = create_engine(db_url, pool_pre_ping=True)
+db_engine: Engine = create_engine(db_url, **db_settings.get_engine_kwargs())
+# postgresql+psycopg uses psycopg's async connections with create_async_engine
+db_async_engine: AsyncEngine = create_async_engine(db_url, **db_settings.get_engine_kwargs())
 
 # Create a SessionLocal class
 SessionLocal: sessionmaker[Session] = sessionmaker(autocommit=False, autoflush=False, bind=db_engine)
+AsyncSessionLocal: async_sessionmaker[AsyncSession] = async_sessionmaker(
+    bind=db_async_engine, autoflush=False, expire_on_commit=False
+)
 
 
 def get_db() -> Generator[Session, None, None]:
@@ -25,3 +33,39 @@ def get_db() -> Generator[Session, None, None]:
         yield db
     finally:
         db.close()
+
+
+async def get_async_db() -> AsyncGenerator[AsyncSession, None]:
+    """
+    Dependency to get an async database session.
+
+    Yields:
+        AsyncSession: An SQLAlchemy async database session.
+    """
+    async with AsyncSessionLocal() as db:
+        yield db
+
+
+@dataclass
+class DbPoolStats:
+    """A snapshot of a connection pool."""
+
+    # Connections kept open by the pool
+    size: int = 0
+    # Connections in use
+    checked_out: int = 0
+    # Idle connections in the pool
+    checked_in: int = 0
+    # Connections opened beyond the pool size, negative while the pool is not full
+    overflow: int = 0
+
+
+def get_db_pool_stats() -> Dict[str, DbPoolStats]:
+    """Returns a snapshot of the sync ("db") and async ("db_async") connection pools."""
+    pools: Dict[str, Any] = {"db": db_engine.pool, "db_async": db_async_engine.pool}
+    return {
+        name: DbPoolStats(
+            size=pool.size(), checked_out=pool.checkedout(), checked_in=pool.checkedin(), overflow=pool.overflow()
+        )
+        for name, pool in pools.items()
+    }
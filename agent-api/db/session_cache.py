@@ -0,0 +1,222 @@
+import atexit
+import json
+import os
+import time
+import uuid
+from collections import OrderedDict
+from copy import deepcopy
+from dataclasses import dataclass, replace
+from threading import Event, Lock, Thread
+from typing import Iterable, Optional, Tuple, Union
+
+import psycopg
+from agno.storage.session import Session
+from sqlalchemy import Connection, func, select
+from sqlalchemy.engine import make_url
+from sqlalchemy.orm import Session as DbSession
+
+from db.settings import db_settings
+from utils.log import logger
+from utils.serialization import dumps
+
+######################################################
+## Read-through cache of sessions
+######################################################
+
+# Postgres channel of the invalidation notifications
+SESSION_CACHE_CHANNEL = "session_cache"
+
+
+@dataclass
+class SessionCacheStats:
+    """Counters of the session cache."""
+
+    # Reads served from the cache
+    hits: int = 0
+    # Reads that went to the database
+    misses: int = 0
+    # Sessions added to the cache after a read or a write
+    writes: int = 0
+    # Entries dropped because the session was written, deleted or notified by another process
+    invalidations: int = 0
+    # Entries dropped because of the size limit
+    evictions: int = 0
+    # Entries dropped because they expired
+    expired: int = 0
+    # Entries and their serialized size
+    entries: int = 0
+    bytes: int = 0
+    # hits / (hits + misses)
+    hit_ratio: float = 0.0
+
+
+class SessionCache:
+    """An in-process LRU cache of sessions, keyed by table and session_id.
+
+    Holds up to `max_bytes` of sessions, measured by their JSON size, and entries expire `ttl` seconds after they
+    are added. Storages update the cache when they write a session and drop it when they delete it. Sessions are
+    copied in and out of the cache, so callers can modify them.
+
+    With `notify` set, writes send a notification on the session_cache channel in the write transaction, and a
+    background thread listening on that channel drops the sessions written by other processes. The cache is only
+    read while the listener is connected, and it is cleared when the listener reconnects, since notifications can
+    be missed while it is disconnected.
+    """
+
+    def __init__(self, max_bytes: int = 64 * 1024 * 1024, ttl: float = 300, notify: bool = True):
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.notify = notify
+        # Notifications sent by this process are ignored by its listener
+        self.process_id = f"{os.getpid()}-{uuid.uuid4().hex[:8]}"
+
+        self._lock = Lock()
+        # (table, session_id) -> (session, size, expires_at), ordered from least to most recently used
+        self._entries: "OrderedDict[Tuple[str, str], Tuple[Session, int, float]]" = OrderedDict()
+        self._bytes = 0
+        # Incremented when entries are dropped or written, so a read that raced a write does not cache the older
+        # session
+        self._generation = 0
+        self._stats = SessionCacheStats()
+
+        self._listening = Event()
+        self._stopping = Event()
+        self._listener: Optional[Thread] = None
+
+    @property
+    def enabled(self) -> bool:
+        return self.max_bytes > 0
+
+    @property
+    def generation(self) -> int:
+        return self._generation
+
+    def get(self, table: str, session_id: str) -> Optional[Session]:
+        if not self.enabled:
+            return None
+        if self.notify:
+            self.start_listener()
+        key = (table, session_id)
+        with self._lock:
+            entry = self._entries.get(key) if self._listening.is_set() or not self.notify else None
+            if entry is not None and entry[2] <= time.time():
+                self._drop(key)
+                self._stats.expired += 1
+                entry = None
+            if entry is None:
+                self._stats.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self._stats.hits += 1
+        return deepcopy(entry[0])
+
+    def put(self, table: str, session: Session, generation: Optional[int] = None) -> None:
+        """Adds a session to the cache.
+
+        Args:
+            generation: The `generation` before the session was read. The session is not cached if entries were
+                dropped or written since, as it may be older than a session written in the meantime. None for
+                sessions that were just written, which are always cached.
+        """
+        if not self.enabled:
+            return
+        size = len(dumps(session.to_dict()))
+        if size > self.max_bytes:
+            return
+        session = deepcopy(session)
+        key = (table, session.session_id)
+        with self._lock:
+            if generation is None:
+                # A read that started before this write must not replace it with the session it read
+                self._generation += 1
+            elif generation != self._generation:
+                return
+            if key in self._entries:
+                self._drop(key)
+            self._entries[key] = (session, size, time.time() + self.ttl)
+            self._bytes += size
+            self._stats.writes += 1
+            while self._bytes > self.max_bytes:
+                self._drop(next(iter(self._entries)))
+                self._stats.evictions += 1
+
+    def invalidate(self, table: str, session_id: Optional[str] = None) -> None:
+        """Drops a session, or all sessions of a table."""
+        with self._lock:
+            self._generation += 1
+            for key in [key for key in self._entries if key[0] == table and session_id in (None, key[1])]:
+                self._drop(key)
+                self._stats.invalidations += 1
+
+    def clear(self) -> None:
+        with self._lock:
+            self._generation += 1
+            self._entries.clear()
+            self._bytes = 0
+
+    def send_invalidations(
+        self, db: Union[DbSession, Connection], table: str, session_ids: Iterable[Optional[str]]
+    ) -> None:
+        """Notifies other processes that sessions of a table changed, when the transaction of `db` commits.
+
+        A session_id of None invalidates the whole table.
+        """
+        if not self.enabled or not self.notify:
+            return
+        for session_id in session_ids:
+            payload = json.dumps([self.process_id, table, session_id])
+            db.execute(select(func.pg_notify(SESSION_CACHE_CHANNEL, payload)))
+
+    def start_listener(self) -> None:
+        with self._lock:
+            if self._listener is not None or self._stopping.is_set():
+                return
+            self._listener = Thread(target=self._listen, name="session-cache-listener", daemon=True)
+            self._listener.start()
+        atexit.register(self.stop_listener)
+
+    def stop_listener(self) -> None:
+        self._stopping.set()
+        if self._listener is not None:
+            self._listener.join()
+
+    def stats(self) -> SessionCacheStats:
+        with self._lock:
+            reads = self._stats.hits + self._stats.misses
+            return replace(
+                self._stats,
+                entries=len(self._entries),
+                bytes=self._bytes,
+                hit_ratio=self._stats.hits / reads if reads else 0.0,
+            )
+
+    def _drop(self, key: Tuple[str, str]) -> None:
+        _, size, _ = self._entries.pop(key)
+        self._bytes -= size
+
+    def _listen(self) -> None:
+        # The listener holds its own connection, outside the pool
+        conninfo = make_url(db_settings.get_db_url()).set(drivername="postgresql").render_as_string(hide_password=False)
+        while not self._stopping.is_set():
+            try:
+                with psycopg.connect(conninfo, autocommit=True) as conn:
+                    conn.execute(f"LISTEN {SESSION_CACHE_CHANNEL}")
+                    self.clear()
+                    self._listening.set()
+                    while not self._stopping.is_set():
+                        for notify in conn.notifies(timeout=1.0):
+                            process_id, table, session_id = json.loads(notify.payload)
+                            if process_id != self.process_id:
+                                self.invalidate(table, session_id)
+            except Exception as e:
+                logger.warning(f"Session cache listener disconnected, retrying: {e}")
+                self._stopping.wait(5)
+            finally:
+                self._listening.clear()
+
+
+session_cache = SessionCache(
+    max_bytes=db_settings.session_cache_max_bytes,
+    ttl=db_settings.session_cache_ttl,
+    notify=db_settings.session_cache_notify,
+)
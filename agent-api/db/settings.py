@@ -1,5 +1,5 @@
 from os import getenv
-from typing import Optional
+from typing import Any, Dict, Literal, Optional
 
 from pydantic_settings import BaseSettings
 
@@ -17,6 +17,106 @@ class DbSettings(BaseSettings):
     db_pass: Optional[str] = None
     db_database: Optional[str] = None
     db_driver: str = "postgresql+psycopg"
+    # Connection pool shared by the api, agent storages and vector dbs of a process.
+    # Each process opens at most db_pool_size + db_max_overflow connections per engine.
+    db_pool_size: int = 10
+    db_max_overflow: int = 20
+    # Seconds after which a connection is replaced, before Postgres or a proxy drops it
+    db_pool_recycle: int = 1800
+    # Seconds to wait for a connection when the pool is exhausted
+    db_pool_timeout: float = 30
+    # Test connections with a ping when they are checked out of the pool
+    db_pool_pre_ping: bool = True
+    # Milliseconds after which Postgres cancels a statement, 0 disables the timeout
+    db_statement_timeout: int = 60_000
+    # Keep the runs of agent sessions in the session_runs table, so agents load only their history window
+    session_runs_table: bool = True
+    # Write agent and team sessions in the background, in batches, instead of during each run
+    session_write_behind: bool = False
+    # Seconds between background session writes
+    session_flush_interval: float = 1.0
+    # Write sessions before the interval ends once this many sessions are pending
+    session_flush_size: int = 100
+    # The memory and session_data of sessions are stored zstd compressed when their JSON is at least this many
+    # bytes, 0 disables compression. Compressed and plain values are both read, so this can change at any time.
+    session_compression_threshold: int = 16 * 1024
+    session_compression_level: int = 3
+    # Bytes of sessions cached in each process, so follow-up turns do not read the session again. 0 disables it.
+    session_cache_max_bytes: int = 64 * 1024 * 1024
+    # Seconds after which a cached session is read again
+    session_cache_ttl: float = 300
+    # Drop sessions written by other processes from the cache, with Postgres LISTEN/NOTIFY. Each process holds one
+    # more connection. Only disable it when a single process writes the sessions.
+    session_cache_notify: bool = True
+    # Session compaction (python -m db.compaction) moves runs older than session_archive_after_days, or beyond the
+    # last session_archive_keep_runs runs of a session, to the session_archive table. 0 disables a limit.
+    session_archive_after_days: float = 30
+    session_archive_keep_runs: int = 50
+    # Sessions updated more recently are not compacted
+    session_compaction_idle_seconds: float = 3600
+    # Sessions compacted per transaction
+    session_compaction_batch_size: int = 100
+    # Range partition the busy session tables by created_at month. Read by their models and by the migration that
+    # converts them, set it before migrating, or convert them later with python -m db.partitions --partition-tables.
+    session_partitioning: bool = False
+    # Partitioned session tables (python -m db.partitions) get partitions this many months ahead, and partitions of
+    # months that ended more than session_partition_retention_months ago are detached. 0 keeps all partitions.
+    session_partition_months_ahead: int = 3
+    session_partition_retention_months: int = 0
+    # SQLite session storage (db/sqlite.py), for single node deployments without Postgres.
+    # Bytes of the database file memory mapped by each connection, 0 disables mmap
+    sqlite_mmap_size: int = 256 * 1024 * 1024
+    # KiB of page cache of each connection
+    sqlite_cache_size_kb: int = 16 * 1024
+    # Prepared statements cached by each connection
+    sqlite_statement_cache_size: int = 256
+    # Connections kept open for readers
+    sqlite_pool_size: int = 8
+    # Seconds to wait for a lock held by another process
+    sqlite_busy_timeout: float = 5
+    # Writes committed in one transaction by the writer thread
+    sqlite_write_batch_size: int = 100
+    # Knowledge ingestion (python -m db.ingestion): chunks written per transaction, chunks embedded per embedding
+    # request, embedding requests in flight, and processes reading and chunking files (0 uses every cpu)
+    knowledge_write_batch_size: int = 500
+    knowledge_embed_batch_size: int = 100
+    knowledge_embed_concurrency: int = 4
+    knowledge_chunk_workers: int = 0
+    # Vector index of the knowledge tables (python -m db.vector_index), "hnsw" or "ivfflat"
+    knowledge_index_type: Literal["hnsw", "ivfflat"] = "hnsw"
+    # Links per node of the HNSW graph and candidates considered while building it. Higher values build slower,
+    # larger indexes with better recall.
+    knowledge_hnsw_m: int = 16
+    knowledge_hnsw_ef_construction: int = 64
+    # Candidates visited by each HNSW query, raised to the number of results. Higher is slower with better recall.
+    knowledge_hnsw_ef_search: int = 40
+    # IVFFlat lists, 0 uses rows / 1000 up to 1M rows and sqrt(rows) beyond
+    knowledge_ivfflat_lists: int = 0
+    # IVFFlat lists scanned by each query. Higher is slower with better recall.
+    knowledge_ivfflat_probes: int = 10
+    # Quantized vector index: "halfvec" indexes float16 embeddings, half the size of the float32 embeddings, and
+    # "binary" one bit per dimension, 1/32 of the size. Queries fetch knowledge_rerank_factor candidates per result
+    # from the compact index and re-rank them by the distance of the float32 embeddings kept in the table.
+    knowledge_quantization: Literal["none", "halfvec", "binary"] = "none"
+    knowledge_rerank_factor: int = 4
+    # maintenance_work_mem of index builds, HNSW builds are much faster when the graph fits in it
+    knowledge_index_maintenance_work_mem: str = "2GB"
+    # Hybrid knowledge search runs a vector query and a full-text query concurrently and fuses their rankings with
+    # reciprocal rank fusion: a document scores weight / (knowledge_rrf_k + rank) in each ranking it appears in.
+    knowledge_rrf_k: int = 60
+    knowledge_rrf_vector_weight: float = 1.0
+    knowledge_rrf_keyword_weight: float = 1.0
+    # Candidates fetched by each query, raised to the number of results
+    knowledge_hybrid_candidates: int = 40
+    # Seconds fused results are served from the search cache of each process, 0 disables it
+    knowledge_search_cache_ttl: float = 60
+    knowledge_search_cache_max_entries: int = 1024
+    # Embeddings of queries and documents are cached, in memory and in the embedding_cache table of "postgres" or
+    # the SQLite file embedding_cache_sqlite_file with "sqlite". "memory" only keeps the in-memory tier.
+    embedding_cache_backend: Literal["postgres", "sqlite", "memory"] = "postgres"
+    embedding_cache_sqlite_file: str = "tmp/embeddings.db"
+    # Embeddings held in memory per process, about 6KB each with 1536 dimensions. 0 disables the in-memory tier.
+    embedding_cache_max_entries: int = 10_000
     # Create/Upgrade database on startup using alembic
     migrate_db: bool = False
 
@@ -43,6 +143,19 @@ class DbSettings(BaseSettings):
             raise ValueError("Could not build database connection")
         return db_url
 
+    def get_engine_kwargs(self) -> Dict[str, Any]:
+        """Returns the keyword arguments of the sync and async engines."""
+        engine_kwargs: Dict[str, Any] = {
+            "pool_size": self.db_pool_size,
+            "max_overflow": self.db_max_overflow,
+            "pool_recycle": self.db_pool_recycle,
+            "pool_timeout": self.db_pool_timeout,
+            "pool_pre_ping": self.db_pool_pre_ping,
+        }
+        if self.db_statement_timeout > 0:
+            engine_kwargs["connect_args"] = {"options": f"-c statement_timeout={self.db_statement_timeout}"}
+        return engine_kwargs
+
 
 # Create DbSettings object
 db_settings = DbSettings()
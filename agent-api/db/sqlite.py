@@ -0,0 +1,265 @@
+import atexit
+import time
+from concurrent.futures import Future
+from dataclasses import dataclass, replace
+from pathlib import Path
+from queue import Empty, SimpleQueue
+from threading import Lock, Thread
+from typing import Any, Callable, Dict, List, Literal, Optional, Tuple
+
+from agno.storage.session import Session
+from agno.storage.sqlite import SqliteStorage
+from sqlalchemy import Connection, Engine, create_engine, event, inspect
+from sqlalchemy.dialects import sqlite
+from sqlalchemy.orm import sessionmaker
+
+from db.settings import db_settings
+from utils.log import logger
+from utils.serialization import dumps
+
+######################################################
+## Tuned SQLite session storage
+######################################################
+
+# The default SqliteStorage opens its database in rollback journal mode with synchronous=FULL: each upsert syncs
+# the journal and the database file, and a writer blocks every reader. The tuned profile uses WAL, where readers
+# and the writer do not block each other, and synchronous=NORMAL, which syncs the WAL at checkpoints instead of at
+# each commit (a power loss can lose the last commits but does not corrupt the database). Reads use memory mapped
+# I/O and cached prepared statements, and all writes of a database go through one writer thread.
+#
+# Nothing here uses the Postgres engine of db.session, so it can be used without a Postgres database.
+
+Write = Callable[[Connection], Any]
+
+
+def get_sqlite_engine(
+    db_file: str,
+    mmap_size: int = db_settings.sqlite_mmap_size,
+    cache_size_kb: int = db_settings.sqlite_cache_size_kb,
+    statement_cache_size: int = db_settings.sqlite_statement_cache_size,
+    pool_size: int = db_settings.sqlite_pool_size,
+    busy_timeout: float = db_settings.sqlite_busy_timeout,
+) -> Engine:
+    """Returns an engine for a SQLite database file that sets the tuned profile on its connections."""
+    db_path = Path(db_file).resolve()
+    db_path.parent.mkdir(parents=True, exist_ok=True)
+    engine = create_engine(
+        f"sqlite:///{db_path}",
+        connect_args={
+            "check_same_thread": False,
+            "timeout": busy_timeout,
+            # The sqlite3 module keeps this many prepared statements per connection, 128 by default
+            "cached_statements": statement_cache_size,
+        },
+        pool_size=pool_size,
+        max_overflow=pool_size,
+    )
+
+    @event.listens_for(engine, "connect")
+    def set_pragmas(dbapi_connection: Any, connection_record: Any) -> None:
+        cursor = dbapi_connection.cursor()
+        cursor.execute("PRAGMA journal_mode=WAL")
+        cursor.execute("PRAGMA synchronous=NORMAL")
+        cursor.execute(f"PRAGMA mmap_size={int(mmap_size)}")
+        cursor.execute(f"PRAGMA cache_size=-{int(cache_size_kb)}")
+        cursor.execute("PRAGMA temp_store=MEMORY")
+        cursor.close()
+
+    return engine
+
+
+@dataclass
+class SqliteWriteStats:
+    """Counters of a SQLite writer thread."""
+
+    # Writes submitted to the writer thread
+    submitted: int = 0
+    # Writes committed
+    written: int = 0
+    # Failed writes, the error is raised to their caller
+    errors: int = 0
+    # Transactions committed
+    transactions: int = 0
+    # Writes waiting for the writer thread
+    pending: int = 0
+
+
+class SqliteWriter:
+    """Runs the writes to a SQLite database on one thread, committing the writes queued meanwhile in one transaction.
+
+    SQLite allows one writer at a time, so concurrent writers would wait on the database lock and each commit would
+    sync on its own. `submit()` blocks until the transaction of its write commits, so a write is as durable as in a
+    transaction of its own. When a batch fails, its writes are run again in a transaction each, so only the failing
+    writes raise. Writes should be prepared by their caller, the writer thread only runs their statements.
+    """
+
+    def __init__(self, engine: Engine, max_batch: int = 100):
+        self.engine = engine
+        self.max_batch = max_batch
+
+        self._lock = Lock()
+        self._queue: SimpleQueue[Optional[Tuple[Write, Future]]] = SimpleQueue()
+        self._thread: Optional[Thread] = None
+        self._stats = SqliteWriteStats()
+
+    def submit(self, write: Write) -> Any:
+        """Runs `write` with the connection of the writer thread and returns its result once it is committed."""
+        future: Future = Future()
+        with self._lock:
+            if self._thread is None:
+                self._thread = Thread(target=self._run, name="sqlite-writer", daemon=True)
+                self._thread.start()
+                atexit.register(self.stop)
+            self._stats.submitted += 1
+            self._queue.put((write, future))
+        return future.result()
+
+    def stop(self) -> None:
+        """Commits the queued writes and stops the writer thread."""
+        with self._lock:
+            thread, self._thread = self._thread, None
+            if thread is not None:
+                self._queue.put(None)
+        if thread is not None:
+            thread.join()
+
+    def stats(self) -> SqliteWriteStats:
+        with self._lock:
+            return replace(self._stats, pending=self._queue.qsize())
+
+    def _run(self) -> None:
+        while True:
+            item = self._queue.get()
+            if item is None:
+                return
+            batch = [item]
+            stopping = False
+            while len(batch) < self.max_batch:
+                try:
+                    item = self._queue.get_nowait()
+                except Empty:
+                    break
+                if item is None:
+                    stopping = True
+                    break
+                batch.append(item)
+            self._write(batch)
+            if stopping:
+                return
+
+    def _write(self, batch: List[Tuple[Write, Future]]) -> None:
+        try:
+            with self.engine.begin() as conn:
+                results = [write(conn) for write, _ in batch]
+        except Exception as e:
+            if len(batch) > 1:
+                # Run the writes of the batch in a transaction each, so only the failing writes fail
+                for item in batch:
+                    self._write([item])
+                return
+            with self._lock:
+                self._stats.errors += 1
+            batch[0][1].set_exception(e)
+            return
+
+        with self._lock:
+            self._stats.written += len(batch)
+            self._stats.transactions += 1
+        for (_, future), result in zip(batch, results):
+            future.set_result(result)
+
+
+# Writer threads by database path, so every storage of a database shares the writer and its engine
+_writers: Dict[str, SqliteWriter] = {}
+_lock = Lock()
+
+
+def get_sqlite_writer(db_file: str) -> SqliteWriter:
+    db_path = str(Path(db_file).resolve())
+    with _lock:
+        if db_path not in _writers:
+            _writers[db_path] = SqliteWriter(get_sqlite_engine(db_path), max_batch=db_settings.sqlite_write_batch_size)
+        return _writers[db_path]
+
+
+class SqliteSessionStorage(SqliteStorage):
+    """SqliteStorage using the tuned SQLite profile, for single node deployments without Postgres.
+
+    Sessions are read on pooled connections, which run concurrently in WAL mode. Upserts and deletes are run by
+    the writer thread of the database, which commits the writes of concurrent runs together.
+    """
+
+    def __init__(
+        self,
+        table_name: str,
+        db_file: str,
+        mode: Optional[Literal["agent", "team", "workflow"]] = "agent",
+        auto_upgrade_schema: bool = False,
+    ):
+        self.db_file = db_file
+        db_engine = get_sqlite_writer(db_file).engine
+        super().__init__(table_name=table_name, db_engine=db_engine, mode=mode, auto_upgrade_schema=auto_upgrade_schema)
+        # SqliteStorage replaces a db_engine it is given with an in-memory database
+        self.db_engine = db_engine
+        self.inspector = inspect(db_engine)
+        self.SqlSession = sessionmaker(bind=db_engine)
+
+    @property
+    def writer(self) -> SqliteWriter:
+        return get_sqlite_writer(self.db_file)
+
+    def get_upsert_sql(self) -> str:
+        """Returns the upsert statement of the table, with a named parameter for each column."""
+        columns = [column.name for column in self.table.columns if column.name not in ("created_at", "updated_at")]
+        updates = [f"{name} = excluded.{name}" for name in columns if name != "session_id"]
+        return (
+            f"INSERT INTO {self.table_name} ({', '.join(columns)}, created_at) "
+            f"VALUES ({', '.join(f':{name}' for name in columns)}, :now) "
+            f"ON CONFLICT (session_id) DO UPDATE SET {', '.join(updates)}, updated_at = :now"
+        )
+
+    def upsert(self, session: Session, create_and_retry: bool = True) -> Optional[Session]:
+        if self.auto_upgrade_schema and not self._schema_up_to_date:
+            self.upgrade_schema()
+
+        # The statement and its JSON parameters are built here, so the writer thread only runs the statement. The
+        # statement text is the same for every upsert of the table, so connections reuse its prepared statement.
+        sql = self.get_upsert_sql()
+        params: Dict[str, Any] = {"now": int(time.time())}
+        for column in self.table.columns:
+            if column.name in ("created_at", "updated_at"):
+                continue
+            value = getattr(session, column.name, None)
+            params[column.name] = dumps(value).decode() if isinstance(column.type, sqlite.JSON) else value
+        try:
+            self.writer.submit(lambda conn: conn.exec_driver_sql(sql, params))
+        except Exception as e:
+            if create_and_retry and not self.table_exists():
+                self.create()
+                return self.upsert(session, create_and_retry=False)
+            logger.warning(f"Could not upsert session {session.session_id} to {self.table_name}: {e}")
+            return None
+        return self.read(session_id=session.session_id)
+
+    def delete_session(self, session_id: Optional[str] = None):
+        if session_id is None:
+            logger.warning("No session_id provided for deletion.")
+            return
+        stmt = self.table.delete().where(self.table.c.session_id == session_id)
+        try:
+            self.writer.submit(lambda conn: conn.execute(stmt))
+        except Exception as e:
+            logger.error(f"Error deleting session: {e}")
+
+
+def get_sqlite_storage(
+    table_name: str,
+    db_file: str = "tmp/data.db",
+    mode: Literal["agent", "team", "workflow"] = "agent",
+    auto_upgrade_schema: bool = False,
+) -> SqliteSessionStorage:
+    """Returns the tuned SQLite storage for agent, team or workflow sessions, use it in place of
+    `SqliteStorage(db_file=...)`."""
+    return SqliteSessionStorage(
+        table_name=table_name, db_file=db_file, mode=mode, auto_upgrade_schema=auto_upgrade_schema
+    )
@@ -0,0 +1,515 @@
+import atexit
+import hashlib
+import json
+import time
+from copy import deepcopy
+from dataclasses import dataclass, replace
+from threading import Event, Lock, Thread
+from typing import Any, Dict, List, Literal, Optional, Tuple, Type
+
+from agno.storage.postgres import PostgresStorage
+from agno.storage.session import AgentSession, Session, TeamSession, WorkflowSession
+from sqlalchemy import delete, inspect, select
+from sqlalchemy.dialects import postgresql
+from sqlalchemy.orm import Session as DbSession
+
+from db.compression import compress_json, decompress_json
+from db.partitions import create_future_partitions, is_partitioned
+from db.session import db_engine
+from db.session_cache import session_cache
+from db.settings import db_settings
+from db.tables import SessionLookup, SessionRun
+from utils.log import logger
+
+######################################################
+## Session storage for agents and teams
+######################################################
+
+# Columns written for each storage mode, in addition to session_id
+SESSION_COLUMNS: Dict[str, List[str]] = {
+    "agent": ["agent_id", "team_session_id", "user_id", "memory", "agent_data", "session_data", "extra_data"],
+    "team": ["team_id", "user_id", "team_session_id", "memory", "team_data", "session_data", "extra_data"],
+    "workflow": ["workflow_id", "user_id", "memory", "workflow_data", "session_data", "extra_data"],
+}
+
+
+SESSION_CLASSES: Dict[str, Type[Session]] = {"agent": AgentSession, "team": TeamSession, "workflow": WorkflowSession}
+
+
+def get_run_id(run: Dict[str, Any]) -> str:
+    """Returns the run_id of a saved AgentRun. Runs without one, like an agent introduction, are keyed by content."""
+    run_id = (run.get("response") or {}).get("run_id")
+    if run_id:
+        return run_id
+    return hashlib.sha256(json.dumps(run, sort_keys=True, default=str).encode("utf-8")).hexdigest()
+
+
+def get_run_messages(runs: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """Returns the messages of saved AgentRuns that were sent in the run, like `AgentMemory.messages`."""
+    return [
+        message
+        for run in runs
+        for message in (run.get("response") or {}).get("messages") or []
+        if not message.get("from_history") and message.get("role") != "system"
+    ]
+
+
+def get_partition_keys(sess: DbSession, table: str, sessions: List[Session]) -> Dict[str, int]:
+    """Returns the created_at of sessions of a partitioned table, adding new sessions to session_lookup."""
+    now = int(time.time())
+    sess.execute(
+        postgresql.insert(SessionLookup)
+        .values(
+            [
+                {"session_table": table, "session_id": session.session_id, "created_at": session.created_at or now}
+                for session in sessions
+            ]
+        )
+        .on_conflict_do_nothing()
+    )
+    rows = sess.execute(
+        select(SessionLookup.session_id, SessionLookup.created_at).where(
+            SessionLookup.session_table == table,
+            SessionLookup.session_id.in_([session.session_id for session in sessions]),
+        )
+    )
+    return {session_id: created_at for session_id, created_at in rows}
+
+
+def write_sessions(storage: "SessionStorage", sessions: List[Session], batch_size: int = 500) -> None:
+    """Upserts sessions into the table of a storage, with one multi-row statement per `batch_size` sessions.
+
+    When the storage keeps runs in the session_runs table, the runs and messages are removed from the session row
+    and the runs that are not in session_runs yet are inserted. The memory and session_data of large sessions are
+    compressed, see `SessionStorage`. Sessions of partitioned tables are written to the partition of the created_at
+    in session_lookup.
+    """
+    if storage.auto_upgrade_schema and not storage._schema_up_to_date:
+        storage.upgrade_schema()
+
+    columns = SESSION_COLUMNS[storage.mode]
+    session_rows: List[Dict[str, Any]] = []
+    run_rows: List[Dict[str, Any]] = []
+    for session in sessions:
+        row: Dict[str, Any] = {
+            "session_id": session.session_id,
+            **{column: getattr(session, column, None) for column in columns},
+        }
+        memory: Optional[Dict[str, Any]] = row["memory"]
+        if storage.num_history_runs is not None and memory is not None:
+            runs = memory.get("runs") or []
+            run_rows.extend(
+                {
+                    "session_table": storage.table.fullname,
+                    "session_id": session.session_id,
+                    "run_id": get_run_id(run),
+                    "run": run,
+                    "created_at": (run.get("response") or {}).get("created_at") or int(time.time()),
+                }
+                for run in runs
+            )
+            row["memory"] = {**memory, "runs": [], "messages": []}
+        for column in ("memory", "session_data"):
+            row[column] = compress_json(
+                row[column], storage.compression_threshold, level=db_settings.session_compression_level
+            )
+        session_rows.append(row)
+
+    with storage.Session() as sess, sess.begin():
+        conflict_columns = ["session_id"]
+        if storage.partitioned:
+            conflict_columns.append("created_at")
+            partition_keys = get_partition_keys(sess, storage.table.fullname, sessions)
+            for row in session_rows:
+                row["created_at"] = partition_keys[row["session_id"]]
+        for start in range(0, len(session_rows), batch_size):
+            stmt = postgresql.insert(storage.table).values(session_rows[start : start + batch_size])
+            stmt = stmt.on_conflict_do_update(
+                index_elements=conflict_columns,
+                set_={**{column: stmt.excluded[column] for column in columns}, "updated_at": int(time.time())},
+            )
+            sess.execute(stmt)
+        for start in range(0, len(run_rows), batch_size):
+            sess.execute(
+                postgresql.insert(SessionRun)
+                .values(run_rows[start : start + batch_size])
+                .on_conflict_do_nothing(constraint="uq_session_runs_run")
+            )
+        session_cache.send_invalidations(sess, storage.table.fullname, [session.session_id for session in sessions])
+
+
+@dataclass
+class SessionWriteStats:
+    """Counters of the session write queue."""
+
+    # Session upserts received
+    queued: int = 0
+    # Upserts replaced by a later upsert of the same session before they were written
+    coalesced: int = 0
+    # Sessions written to the database
+    written: int = 0
+    # Multi-row upserts sent to the database
+    batches: int = 0
+    # Failed table writes, their sessions are retried on the next flush
+    errors: int = 0
+    # Sessions waiting to be written
+    pending: int = 0
+
+
+class SessionWriteQueue:
+    """Collects session upserts and writes them to the database in the background.
+
+    Upserts are coalesced per session, so only the last upsert of a session is written. Pending sessions are
+    written every `flush_interval` seconds, or as soon as `flush_size` sessions are pending, with one multi-row
+    upsert per table. Reads of a pending session return the pending session, so a process always reads its own
+    writes. Sessions are keyed by table and session_id, so every storage instance of a table shares them.
+
+    `stop()` writes the pending sessions and stops the background thread. It is also called at exit.
+    """
+
+    def __init__(self, flush_interval: float = 1.0, flush_size: int = 100, batch_size: int = 500):
+        self.flush_interval = flush_interval
+        self.flush_size = flush_size
+        self.batch_size = batch_size
+
+        self._lock = Lock()
+        # Held while a flush writes, so flushes run one at a time
+        self._flush_lock = Lock()
+        self._wakeup = Event()
+        self._stopping = Event()
+        self._thread: Optional[Thread] = None
+        # Sessions waiting to be written and sessions being written, by (table, session_id)
+        self._pending: Dict[Tuple[str, str], Tuple["SessionStorage", Session]] = {}
+        self._flushing: Dict[Tuple[str, str], Tuple["SessionStorage", Session]] = {}
+        self._stats = SessionWriteStats()
+
+    def put(self, storage: "SessionStorage", session: Session) -> None:
+        key = (storage.table.fullname, session.session_id)
+        with self._lock:
+            if key in self._pending:
+                self._stats.coalesced += 1
+            self._pending[key] = (storage, session)
+            self._stats.queued += 1
+            pending = len(self._pending)
+            if self._thread is None and not self._stopping.is_set():
+                self._thread = Thread(target=self._run, name="session-write-queue", daemon=True)
+                self._thread.start()
+                atexit.register(self.stop)
+
+        if self._stopping.is_set():
+            # Sessions upserted after shutdown are written right away
+            self.flush()
+        elif pending >= self.flush_size:
+            self._wakeup.set()
+
+    def get(self, storage: "SessionStorage", session_id: str) -> Optional[Session]:
+        """Returns the pending session, or the session being written, with this session_id."""
+        key = (storage.table.fullname, session_id)
+        with self._lock:
+            entry = self._pending.get(key) or self._flushing.get(key)
+        return entry[1] if entry is not None else None
+
+    def discard(self, storage: "SessionStorage", session_id: Optional[str] = None) -> None:
+        """Drops a pending session, or all pending sessions of a table, and waits for a running flush."""
+        with self._lock:
+            for key in list(self._pending):
+                if key[0] == storage.table.fullname and (session_id is None or key[1] == session_id):
+                    del self._pending[key]
+        # A session being written could otherwise be written after it is deleted
+        with self._flush_lock:
+            pass
+
+    def flush(self) -> None:
+        """Writes the pending sessions. Sessions of a table that fails to write are pending again."""
+        with self._flush_lock:
+            with self._lock:
+                self._flushing, self._pending = self._pending, {}
+            if not self._flushing:
+                return
+
+            sessions_by_table: Dict[str, List[Tuple["SessionStorage", Session]]] = {}
+            for (table, _), entry in self._flushing.items():
+                sessions_by_table.setdefault(table, []).append(entry)
+
+            failed: Dict[Tuple[str, str], Tuple["SessionStorage", Session]] = {}
+            for table, entries in sessions_by_table.items():
+                storage = entries[-1][0]
+                sessions = [session for _, session in entries]
+                try:
+                    storage.write(sessions)
+                except Exception as e:
+                    logger.warning(f"Could not write {len(sessions)} sessions to {table}: {e}")
+                    failed.update(((table, entry[1].session_id), entry) for entry in entries)
+                    with self._lock:
+                        self._stats.errors += 1
+                    continue
+                with self._lock:
+                    self._stats.written += len(sessions)
+                    self._stats.batches += (len(sessions) + self.batch_size - 1) // self.batch_size
+
+            with self._lock:
+                # A session upserted again while it was being written keeps its newer upsert
+                for key, entry in failed.items():
+                    self._pending.setdefault(key, entry)
+                self._flushing = {}
+
+    def stop(self) -> None:
+        """Writes the pending sessions and stops the background thread."""
+        self._stopping.set()
+        self._wakeup.set()
+        if self._thread is not None:
+            self._thread.join()
+        self.flush()
+
+    def stats(self) -> SessionWriteStats:
+        with self._lock:
+            return replace(self._stats, pending=len(self._pending) + len(self._flushing))
+
+    def _run(self) -> None:
+        while not self._stopping.is_set():
+            self._wakeup.wait(self.flush_interval)
+            self._wakeup.clear()
+            try:
+                self.flush()
+            except Exception as e:
+                logger.error(f"Session write queue flush failed: {e}")
+
+
+session_write_queue = SessionWriteQueue(
+    flush_interval=db_settings.session_flush_interval,
+    flush_size=db_settings.session_flush_size,
+)
+
+
+class SessionStorage(PostgresStorage):
+    """PostgresStorage for agent, team and workflow sessions, with run windows, write-behind and compression.
+
+    With `num_history_runs` set, the runs of agent sessions are kept in the session_runs table instead of the
+    session row, and reading a session loads only its last `num_history_runs` runs. Older runs are read with
+    `read_runs()`, eg: by the get_chat_history tool. Sessions saved with all their runs in the row are read as
+    they are, and their runs move to session_runs on the next write.
+
+    With `write_behind` set, upserts are queued in `session_write_queue` instead of being written in the run.
+    A crash loses the sessions upserted in the last `session_flush_interval` seconds.
+
+    With `compression_threshold` set, the memory and session_data columns of a session are stored compressed when
+    their JSON is at least `compression_threshold` bytes. Both compressed and plain values are read.
+
+    Partitioned tables (see db/partitions.py) are keyed by (session_id, created_at), the created_at of a session is
+    kept in the session_lookup table so reading a session scans only its partition.
+
+    Sessions that are read or written are kept in `session_cache`, so the next turn of a session does not read it
+    again. Sessions written by other processes are dropped from the cache, see `SessionCache`.
+    """
+
+    def __init__(
+        self,
+        *args: Any,
+        num_history_runs: Optional[int] = None,
+        write_behind: bool = False,
+        compression_threshold: Optional[int] = None,
+        **kwargs: Any,
+    ):
+        super().__init__(*args, **kwargs)
+        self.num_history_runs = num_history_runs
+        self.write_behind = write_behind
+        self.compression_threshold = compression_threshold
+        self._partitioned: Optional[bool] = None
+
+    @property
+    def partitioned(self) -> bool:
+        """Whether the table is partitioned, checked once per storage."""
+        if self._partitioned is None:
+            try:
+                with self.db_engine.connect() as conn:
+                    self._partitioned = is_partitioned(conn, self.table.fullname)
+            except Exception as e:
+                logger.warning(f"Could not check if {self.table.fullname} is partitioned: {e}")
+                return False
+        return self._partitioned
+
+    def upsert(self, session: Session, create_and_retry: bool = True) -> Optional[Session]:
+        if self.write_behind:
+            session_write_queue.put(self, session)
+            return session
+        try:
+            self.write([session])
+        except Exception as e:
+            logger.warning(f"Could not write session to {self.table.fullname}: {e}")
+            return None
+        return session
+
+    def write(self, sessions: List[Session]) -> None:
+        """Writes sessions, creating the tables and partitions they need if they do not exist."""
+        try:
+            write_sessions(self, sessions, session_write_queue.batch_size)
+        except Exception as e:
+            if "no partition of relation" in str(e):
+                # Partitions are created ahead by python -m db.partitions and at startup
+                create_future_partitions(
+                    self.db_engine, db_settings.session_partition_months_ahead, table_name=self.table.name
+                )
+            elif not self.create_missing_tables():
+                raise
+            write_sessions(self, sessions, session_write_queue.batch_size)
+        for session in sessions:
+            session_cache.put(self.table.fullname, self.get_written_session(session))
+
+    def create_missing_tables(self) -> bool:
+        """Creates the session and session_runs tables if they do not exist, returns whether one was created."""
+        session_runs_exists = self.num_history_runs is None or inspect(self.db_engine).has_table(
+            SessionRun.__tablename__, schema=SessionRun.__table__.schema
+        )
+        table_exists = self.table_exists()
+        if table_exists and session_runs_exists:
+            return False
+        if not table_exists:
+            self.create()
+        if not session_runs_exists:
+            SessionRun.metadata.create_all(self.db_engine, tables=[SessionRun.__table__], checkfirst=True)  # type: ignore
+        return True
+
+    def get_written_session(self, session: Session) -> Session:
+        """Returns a session as `read()` returns it once it is written."""
+        session = replace(session, updated_at=int(time.time()))
+        if self.num_history_runs is not None and session.memory is not None:
+            runs = session.memory.get("runs") or []
+            runs = runs[max(len(runs) - self.num_history_runs, 0) :]
+            session.memory = {**session.memory, "runs": runs, "messages": get_run_messages(runs)}
+        return session
+
+    def read(self, session_id: str, user_id: Optional[str] = None) -> Optional[Session]:
+        session = session_write_queue.get(self, session_id) if self.write_behind else None
+        if session is not None:
+            if user_id and session.user_id != user_id:
+                return None
+            # Sessions read from the database are new objects, so callers can modify them
+            return deepcopy(session)
+
+        session = session_cache.get(self.table.fullname, session_id)
+        if session is not None:
+            return session if not user_id or session.user_id == user_id else None
+
+        generation = session_cache.generation
+        if self.partitioned:
+            session = self.read_partition(session_id=session_id, user_id=user_id)
+        else:
+            session = super().read(session_id=session_id, user_id=user_id)
+        if session is None:
+            return None
+        self.decompress_session(session)
+        if self.num_history_runs is not None and session.memory is not None and not session.memory.get("runs"):
+            runs = self.read_runs(session_id, limit=self.num_history_runs)
+            session.memory = {**session.memory, "runs": runs, "messages": get_run_messages(runs)}
+        session_cache.put(self.table.fullname, session, generation=generation)
+        return session
+
+    def read_partition(self, session_id: str, user_id: Optional[str] = None) -> Optional[Session]:
+        """Reads a session of a partitioned table, from the partition of its created_at in session_lookup."""
+        created_at = (
+            select(SessionLookup.created_at)
+            .where(SessionLookup.session_table == self.table.fullname, SessionLookup.session_id == session_id)
+            .scalar_subquery()
+        )
+        stmt = select(self.table).where(self.table.c.session_id == session_id, self.table.c.created_at == created_at)
+        if user_id:
+            stmt = stmt.where(self.table.c.user_id == user_id)
+        try:
+            with self.Session() as sess:
+                row = sess.execute(stmt).fetchone()
+        except Exception as e:
+            logger.warning(f"Could not read session {session_id} from {self.table.fullname}: {e}")
+            return None
+        if row is None:
+            return None
+        return SESSION_CLASSES[self.mode].from_dict(row._mapping)
+
+    def decompress_session(self, session: Session) -> None:
+        session.memory = decompress_json(session.memory)
+        session.session_data = decompress_json(session.session_data)
+
+    def read_runs(self, session_id: str, limit: Optional[int] = None) -> List[Dict[str, Any]]:
+        """Returns the last `limit` saved runs of a session, oldest first."""
+        stmt = (
+            select(SessionRun.run)
+            .where(SessionRun.session_table == self.table.fullname, SessionRun.session_id == session_id)
+            .order_by(SessionRun.created_at.desc(), SessionRun.id.desc())
+            .limit(limit)
+        )
+        try:
+            with self.Session() as sess:
+                runs = list(sess.scalars(stmt))
+        except Exception as e:
+            logger.warning(f"Could not read runs of session {session_id}: {e}")
+            return []
+        return runs[::-1]
+
+    def get_all_session_ids(self, user_id: Optional[str] = None, entity_id: Optional[str] = None) -> List[str]:
+        if self.write_behind:
+            session_write_queue.flush()
+        return super().get_all_session_ids(user_id=user_id, entity_id=entity_id)
+
+    def get_all_sessions(self, user_id: Optional[str] = None, entity_id: Optional[str] = None) -> List[Session]:
+        if self.write_behind:
+            session_write_queue.flush()
+        sessions = super().get_all_sessions(user_id=user_id, entity_id=entity_id)
+        for session in sessions:
+            self.decompress_session(session)
+        return sessions
+
+    def delete_session(self, session_id: Optional[str] = None):
+        if session_id is None:
+            return super().delete_session(session_id=session_id)
+        if self.write_behind:
+            session_write_queue.discard(self, session_id)
+        super().delete_session(session_id=session_id)
+        session_cache.invalidate(self.table.fullname, session_id)
+        with self.Session() as sess, sess.begin():
+            if self.num_history_runs is not None:
+                sess.execute(
+                    delete(SessionRun).where(
+                        SessionRun.session_table == self.table.fullname, SessionRun.session_id == session_id
+                    )
+                )
+            if self.partitioned:
+                sess.execute(
+                    delete(SessionLookup).where(
+                        SessionLookup.session_table == self.table.fullname, SessionLookup.session_id == session_id
+                    )
+                )
+            session_cache.send_invalidations(sess, self.table.fullname, [session_id])
+
+    def drop(self) -> None:
+        if self.write_behind:
+            session_write_queue.discard(self)
+        partitioned = self.partitioned
+        super().drop()
+        session_cache.invalidate(self.table.fullname)
+        with self.Session() as sess, sess.begin():
+            if partitioned:
+                sess.execute(delete(SessionLookup).where(SessionLookup.session_table == self.table.fullname))
+            session_cache.send_invalidations(sess, self.table.fullname, [None])
+
+
+def get_session_storage(
+    table_name: str,
+    mode: Literal["agent", "team", "workflow"] = "agent",
+    auto_upgrade_schema: bool = False,
+    num_history_runs: Optional[int] = None,
+) -> SessionStorage:
+    """Returns the storage for agent, team or workflow sessions, using the shared db_engine.
+
+    Args:
+        num_history_runs: Load only this many runs of a session, use the num_history_responses of the agent.
+            Only used for agent sessions when `session_runs_table` is enabled.
+    """
+    compression_threshold = db_settings.session_compression_threshold
+    return SessionStorage(
+        table_name=table_name,
+        db_engine=db_engine,
+        mode=mode,
+        auto_upgrade_schema=auto_upgrade_schema,
+        num_history_runs=num_history_runs if mode == "agent" and db_settings.session_runs_table else None,
+        write_behind=db_settings.session_write_behind,
+        compression_threshold=compression_threshold if compression_threshold > 0 else None,
+    )
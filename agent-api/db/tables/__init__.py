@@ -1 +1,18 @@
 from db.tables.base import Base
+from db.tables.jobs import Job, JobEvent
+from db.tables.embedding_cache import EmbeddingCacheEntry
+from db.tables.response_cache import ResponseCacheEntry
+from db.tables.session_runs import SessionRun
+from db.tables.session_lookup import SessionLookup
+from db.tables.session_archive import SessionArchive
+from db.tables.knowledge import SageKnowledge
+from db.tables.sessions import (
+    BlogPostGeneratorSession,
+    FinanceAgentSession,
+    FinanceResearcherTeamSession,
+    InvestmentReportGeneratorSession,
+    MultiLanguageTeamSession,
+    SageSession,
+    ScholarSession,
+    WebAgentSession,
+)
@@ -0,0 +1,20 @@
+from datetime import datetime
+
+from sqlalchemy import DateTime, LargeBinary, String, func
+from sqlalchemy.orm import Mapped, mapped_column
+
+from db.tables.base import Base
+
+
+class EmbeddingCacheEntry(Base):
+    """A cached embedding of a text."""
+
+    __tablename__ = "embedding_cache"
+
+    # Embedder id and dimensions, eg: "text-embedding-3-small/1536"
+    model: Mapped[str] = mapped_column(String, primary_key=True)
+    # sha256 digest of the text
+    text_hash: Mapped[bytes] = mapped_column(LargeBinary, primary_key=True)
+    # The embedding as little-endian float32 values
+    embedding: Mapped[bytes] = mapped_column(LargeBinary, nullable=False)
+    created_at: Mapped[datetime] = mapped_column(DateTime(timezone=True), server_default=func.now(), nullable=False)
@@ -0,0 +1,46 @@
+from datetime import datetime
+from typing import Any, Optional
+
+from sqlalchemy import DateTime, ForeignKey, Index, Integer, String, Text, func
+from sqlalchemy.dialects.postgresql import JSONB
+from sqlalchemy.orm import Mapped, mapped_column
+
+from db.tables.base import Base
+
+
+class Job(Base):
+    """An agent, team or workflow run submitted to the job workers."""
+
+    __tablename__ = "jobs"
+    __table_args__ = (
+        # Workers claim the oldest queued job
+        Index("ix_jobs_status_created_at", "status", "created_at"),
+    )
+
+    id: Mapped[str] = mapped_column(String, primary_key=True)
+    # "agent", "team" or "workflow"
+    kind: Mapped[str] = mapped_column(String, nullable=False)
+    # The agent_id, team_id or workflow_id to run
+    target_id: Mapped[str] = mapped_column(String, nullable=False)
+    # "queued", "running", "succeeded" or "failed"
+    status: Mapped[str] = mapped_column(String, nullable=False)
+    input: Mapped[Any] = mapped_column(JSONB, nullable=False)
+    result: Mapped[Optional[Any]] = mapped_column(JSONB, nullable=True)
+    error: Mapped[Optional[str]] = mapped_column(Text, nullable=True)
+    created_at: Mapped[datetime] = mapped_column(DateTime(timezone=True), server_default=func.now(), nullable=False)
+    # Touched by the worker while the job runs, so jobs of a stopped worker can be detected
+    updated_at: Mapped[datetime] = mapped_column(DateTime(timezone=True), server_default=func.now(), nullable=False)
+    started_at: Mapped[Optional[datetime]] = mapped_column(DateTime(timezone=True), nullable=True)
+    finished_at: Mapped[Optional[datetime]] = mapped_column(DateTime(timezone=True), nullable=True)
+
+
+class JobEvent(Base):
+    """An event in the log of a job. Events are numbered from 0 in the order they were sent."""
+
+    __tablename__ = "job_events"
+
+    job_id: Mapped[str] = mapped_column(String, ForeignKey("public.jobs.id", ondelete="CASCADE"), primary_key=True)
+    seq: Mapped[int] = mapped_column(Integer, primary_key=True)
+    event: Mapped[str] = mapped_column(String, nullable=False)
+    data: Mapped[Any] = mapped_column(JSONB, nullable=False)
+    created_at: Mapped[datetime] = mapped_column(DateTime(timezone=True), server_default=func.now(), nullable=False)
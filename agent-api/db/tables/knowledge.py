@@ -0,0 +1,48 @@
+from datetime import datetime
+from typing import Any, Optional
+
+from pgvector.sqlalchemy import Vector
+from sqlalchemy import DateTime, Index, String, Text, func, text
+from sqlalchemy.dialects.postgresql import JSONB
+from sqlalchemy.orm import Mapped, mapped_column
+
+from db.tables.base import Base
+
+# Dimensions of the OpenAIEmbedder used by the knowledge bases
+EMBEDDING_DIMENSIONS = 1536
+
+
+class SageKnowledge(Base):
+    """Model of the table that agno's PgVector creates for the knowledge base of Sage.
+
+    The columns and the idx_ indexes match agno's schema version 1.
+    """
+
+    __tablename__ = "sage_knowledge"
+    __table_args__ = (
+        Index("idx_sage_knowledge_id", "id"),
+        Index("idx_sage_knowledge_name", "name"),
+        Index("idx_sage_knowledge_content_hash", "content_hash"),
+        # Full-text search, the expression matches to_tsvector(content_language, content) in keyword queries
+        Index(
+            "ix_sage_knowledge_content_tsv",
+            text("to_tsvector('english'::regconfig, content)"),
+            postgresql_using="gin",
+        ),
+        # Filtering documents with filters @> '{...}'
+        Index(
+            "ix_sage_knowledge_filters", "filters", postgresql_using="gin", postgresql_ops={"filters": "jsonb_path_ops"}
+        ),
+        {"schema": "ai"},
+    )
+
+    id: Mapped[str] = mapped_column(String, primary_key=True)
+    name: Mapped[Optional[str]] = mapped_column(String)
+    meta_data: Mapped[Optional[Any]] = mapped_column(JSONB, server_default=text("'{}'::jsonb"))
+    filters: Mapped[Optional[Any]] = mapped_column(JSONB, server_default=text("'{}'::jsonb"), nullable=True)
+    content: Mapped[Optional[str]] = mapped_column(Text)
+    embedding: Mapped[Optional[Any]] = mapped_column(Vector(EMBEDDING_DIMENSIONS))
+    usage: Mapped[Optional[Any]] = mapped_column(JSONB)
+    created_at: Mapped[Optional[datetime]] = mapped_column(DateTime(timezone=True), server_default=func.now())
+    updated_at: Mapped[Optional[datetime]] = mapped_column(DateTime(timezone=True), onupdate=func.now())
+    content_hash: Mapped[Optional[str]] = mapped_column(String)
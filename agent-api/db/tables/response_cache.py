@@ -0,0 +1,29 @@
+from datetime import datetime
+from typing import Any
+
+from sqlalchemy import DateTime, Index, String, func
+from sqlalchemy.dialects.postgresql import JSONB
+from sqlalchemy.orm import Mapped, mapped_column
+
+from db.tables.base import Base
+
+
+class ResponseCacheEntry(Base):
+    """A cached response of a non-streaming agent run."""
+
+    __tablename__ = "response_cache"
+    __table_args__ = (
+        # Expired entries are deleted in bulk
+        Index("ix_response_cache_expires_at", "expires_at"),
+        # The least recently used entries are deleted once the table is full
+        Index("ix_response_cache_accessed_at", "accessed_at"),
+    )
+
+    # Hash of the agent_id, model, instructions version and normalized message
+    key: Mapped[str] = mapped_column(String, primary_key=True)
+    agent_id: Mapped[str] = mapped_column(String, nullable=False)
+    model_id: Mapped[str] = mapped_column(String, nullable=False)
+    content: Mapped[Any] = mapped_column(JSONB, nullable=True)
+    created_at: Mapped[datetime] = mapped_column(DateTime(timezone=True), server_default=func.now(), nullable=False)
+    accessed_at: Mapped[datetime] = mapped_column(DateTime(timezone=True), server_default=func.now(), nullable=False)
+    expires_at: Mapped[datetime] = mapped_column(DateTime(timezone=True), nullable=False)
@@ -0,0 +1,27 @@
+from datetime import datetime
+
+from sqlalchemy import BigInteger, DateTime, Index, Integer, LargeBinary, String, func
+from sqlalchemy.orm import Mapped, mapped_column
+
+from db.tables.base import Base
+
+
+class SessionArchive(Base):
+    """A batch of runs moved out of a session by compaction, as compressed JSON."""
+
+    __tablename__ = "session_archive"
+    __table_args__ = (Index("ix_session_archive_session", "session_table", "session_id", "last_created_at"),)
+
+    id: Mapped[int] = mapped_column(BigInteger, primary_key=True, autoincrement=True)
+    # Full name of the session table, eg: ai.sage_sessions
+    session_table: Mapped[str] = mapped_column(String, nullable=False)
+    session_id: Mapped[str] = mapped_column(String, nullable=False)
+    run_count: Mapped[int] = mapped_column(Integer, nullable=False)
+    # Epoch seconds of the first and last archived runs
+    first_created_at: Mapped[int] = mapped_column(BigInteger, nullable=True)
+    last_created_at: Mapped[int] = mapped_column(BigInteger, nullable=True)
+    # JSON list of the archived runs, compressed by db/compression.py, see db.compaction.read_archive_payload()
+    payload: Mapped[bytes] = mapped_column(LargeBinary, nullable=False)
+    # Size of the uncompressed JSON
+    raw_bytes: Mapped[int] = mapped_column(Integer, nullable=False)
+    archived_at: Mapped[datetime] = mapped_column(DateTime(timezone=True), server_default=func.now(), nullable=False)
@@ -0,0 +1,20 @@
+from sqlalchemy import BigInteger, String
+from sqlalchemy.orm import Mapped, mapped_column
+
+from db.tables.base import Base
+
+
+class SessionLookup(Base):
+    """The created_at of each session of a partitioned session table.
+
+    Partitioned session tables are keyed by (session_id, created_at) and Postgres has no index across partitions,
+    so a session is found by its created_at here first, which selects its partition.
+    """
+
+    __tablename__ = "session_lookup"
+
+    # Full name of the session table, eg: ai.scholar_sessions
+    session_table: Mapped[str] = mapped_column(String, primary_key=True)
+    session_id: Mapped[str] = mapped_column(String, primary_key=True)
+    # Epoch seconds, the partition key of the session row
+    created_at: Mapped[int] = mapped_column(BigInteger, nullable=False)
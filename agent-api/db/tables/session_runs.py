@@ -0,0 +1,30 @@
+from typing import Any
+
+from sqlalchemy import BigInteger, Index, String, UniqueConstraint
+from sqlalchemy.dialects.postgresql import JSONB
+from sqlalchemy.orm import Mapped, mapped_column
+
+from db.tables.base import Base
+
+
+class SessionRun(Base):
+    """A run of an agent session, stored apart from the session so agents can load only their recent runs."""
+
+    __tablename__ = "session_runs"
+    __table_args__ = (
+        # Runs are upserted with every session write, a run is only inserted once
+        UniqueConstraint("session_table", "session_id", "run_id", name="uq_session_runs_run"),
+        # Agents load the latest runs of a session
+        Index("ix_session_runs_session_id_created_at", "session_id", "created_at"),
+    )
+
+    # Insertion order, breaks ties between runs created in the same second
+    id: Mapped[int] = mapped_column(BigInteger, primary_key=True, autoincrement=True)
+    # Full name of the session table, eg: ai.sage_sessions
+    session_table: Mapped[str] = mapped_column(String, nullable=False)
+    session_id: Mapped[str] = mapped_column(String, nullable=False)
+    run_id: Mapped[str] = mapped_column(String, nullable=False)
+    # The AgentRun, as saved in the memory of the session
+    run: Mapped[Any] = mapped_column(JSONB, nullable=False)
+    # Epoch seconds of the run, like the created_at of agno's session tables
+    created_at: Mapped[int] = mapped_column(BigInteger, nullable=False)
@@ -0,0 +1,103 @@
+from typing import Any, Optional, Tuple
+
+from sqlalchemy import BigInteger, Index, PrimaryKeyConstraint, String, text
+from sqlalchemy.dialects.postgresql import JSONB
+from sqlalchemy.orm import Mapped, declared_attr, mapped_column
+
+from db.settings import db_settings
+from db.tables.base import Base
+
+# Models of the tables that agno's PostgresStorage creates for agent, team and workflow sessions, in the "ai" schema.
+# The columns and the indexes named ix_<table>_<column> match agno's schema version 1, the other indexes support
+# the session listing and compaction queries.
+
+
+class SessionTable(Base):
+    __abstract__ = True
+    # Range partitioned by created_at month, and keyed by (session_id, created_at). See db/partitions.py.
+    __partitioned__ = False
+
+    # The primary key is declared in __table_args__
+    session_id: Mapped[str] = mapped_column(String, nullable=False)
+    user_id: Mapped[Optional[str]] = mapped_column(String, index=True)
+    memory: Mapped[Optional[Any]] = mapped_column(JSONB)
+    session_data: Mapped[Optional[Any]] = mapped_column(JSONB)
+    extra_data: Mapped[Optional[Any]] = mapped_column(JSONB)
+    # Epoch seconds, updated_at is only set when a session is updated
+    created_at: Mapped[Optional[int]] = mapped_column(
+        BigInteger, server_default=text("(extract(epoch from now()))::bigint")
+    )
+    updated_at: Mapped[Optional[int]] = mapped_column(BigInteger)
+
+    @declared_attr.directive
+    def __table_args__(cls) -> Any:
+        table_args: Tuple[Any, ...] = (
+            # Sessions of a user, newest first
+            Index(f"ix_{cls.__tablename__}_user_id_created_at", "user_id", "created_at"),
+            # Sessions by last activity, for compaction and cleanup
+            Index(f"ix_{cls.__tablename__}_last_updated_at", text("coalesce(updated_at, created_at)")),
+        )
+        if cls.__partitioned__:
+            # The partition key must be part of the primary key
+            return table_args + (
+                PrimaryKeyConstraint("session_id", "created_at"),
+                {"schema": "ai", "postgresql_partition_by": "RANGE (created_at)"},
+            )
+        return table_args + (PrimaryKeyConstraint("session_id"), {"schema": "ai"})
+
+
+class AgentSessionTable(SessionTable):
+    __abstract__ = True
+
+    agent_id: Mapped[Optional[str]] = mapped_column(String, index=True)
+    team_session_id: Mapped[Optional[str]] = mapped_column(String, index=True, nullable=True)
+    agent_data: Mapped[Optional[Any]] = mapped_column(JSONB)
+
+
+class TeamSessionTable(SessionTable):
+    __abstract__ = True
+
+    team_id: Mapped[Optional[str]] = mapped_column(String, index=True)
+    team_session_id: Mapped[Optional[str]] = mapped_column(String, index=True, nullable=True)
+    team_data: Mapped[Optional[Any]] = mapped_column(JSONB)
+
+
+class WorkflowSessionTable(SessionTable):
+    __abstract__ = True
+
+    workflow_id: Mapped[Optional[str]] = mapped_column(String, index=True)
+    workflow_data: Mapped[Optional[Any]] = mapped_column(JSONB)
+
+
+class SageSession(AgentSessionTable):
+    __tablename__ = "sage_sessions"
+
+
+class ScholarSession(AgentSessionTable):
+    __tablename__ = "scholar_sessions"
+    __partitioned__ = db_settings.session_partitioning
+
+
+class FinanceAgentSession(AgentSessionTable):
+    __tablename__ = "finance_agent"
+
+
+class WebAgentSession(AgentSessionTable):
+    __tablename__ = "web_agent"
+
+
+class FinanceResearcherTeamSession(TeamSessionTable):
+    __tablename__ = "finance_researcher_team"
+    __partitioned__ = db_settings.session_partitioning
+
+
+class MultiLanguageTeamSession(TeamSessionTable):
+    __tablename__ = "multi_language_team"
+
+
+class BlogPostGeneratorSession(WorkflowSessionTable):
+    __tablename__ = "blog_post_generator_workflows"
+
+
+class InvestmentReportGeneratorSession(WorkflowSessionTable):
+    __tablename__ = "investment_report_generator_workflows"
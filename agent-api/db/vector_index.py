@@ -0,0 +1,314 @@
+import argparse
+import time
+from dataclasses import asdict, dataclass
+from typing import List, Literal, Optional, Union
+
+from agno.vectordb.distance import Distance
+from agno.vectordb.pgvector import HNSW, Ivfflat, PgVector
+from sqlalchemy import Connection, text
+
+from db.settings import db_settings
+from utils.log import logger
+
+######################################################
+## Vector index management
+######################################################
+
+# The vector index of a knowledge table is an HNSW graph or IVFFlat lists over its embedding column. HNSW has the
+# better recall/latency trade-off and needs no training data, but builds slower and larger. IVFFlat builds fast and
+# small, its lists are computed from the rows present at build time, so rebuild it after the table grows.
+#
+# Indexes are built with CREATE INDEX CONCURRENTLY, so the table stays writable, and rebuilt by building the new
+# index next to the old one, then swapping them. Queries use the old index until the new one is valid.
+#
+# A quantized index is built over an expression of the embedding column instead: its float16 "halfvec" cast, half
+# the size, or its "binary" quantization, one bit per dimension and 1/32 of the size. The table keeps the float32
+# embeddings, which KnowledgeVectorDb uses to re-rank the candidates of the compact index. pgvector >= 0.7.0.
+
+VectorIndex = Union[HNSW, Ivfflat]
+QUANTIZATIONS = ("none", "halfvec", "binary")
+
+
+@dataclass
+class VectorIndexInfo:
+    """A vector index of a table."""
+
+    name: str
+    # "hnsw" or "ivfflat"
+    method: str
+    # "none", "halfvec" or "binary"
+    quantization: str
+    definition: str
+    size_bytes: int
+    # False while a concurrent build runs, or after it failed
+    valid: bool
+
+
+def get_vector_index(index_type: Optional[Literal["hnsw", "ivfflat"]] = None) -> VectorIndex:
+    """Returns the configuration of the vector index of the knowledge tables, from the db settings."""
+    configuration = {"maintenance_work_mem": db_settings.knowledge_index_maintenance_work_mem}
+    if (index_type or db_settings.knowledge_index_type) == "ivfflat":
+        return Ivfflat(
+            lists=db_settings.knowledge_ivfflat_lists or 100,
+            probes=db_settings.knowledge_ivfflat_probes,
+            dynamic_lists=db_settings.knowledge_ivfflat_lists == 0,
+            configuration=configuration,
+        )
+    return HNSW(
+        m=db_settings.knowledge_hnsw_m,
+        ef_construction=db_settings.knowledge_hnsw_ef_construction,
+        ef_search=db_settings.knowledge_hnsw_ef_search,
+        configuration=configuration,
+    )
+
+
+def get_quantization(vector_db: PgVector) -> str:
+    """Returns the quantization of the vector index of a vector db, "none" unless it is a KnowledgeVectorDb."""
+    return getattr(vector_db, "quantization", "none")
+
+
+def get_index_name(vector_db: PgVector, index: VectorIndex) -> str:
+    """Returns the name of an index, agno's name by default so indexes built by agno are recognized.
+
+    Quantized indexes are named after their quantization, eg: sage_knowledge_hnsw_halfvec_index, so they can be
+    built next to the full-precision index.
+    """
+    if index.name is not None:
+        return index.name
+    method = "ivfflat" if isinstance(index, Ivfflat) else "hnsw"
+    quantization = get_quantization(vector_db)
+    if quantization == "none":
+        return f"{vector_db.table_name}_{method}_index"
+    return f"{vector_db.table_name}_{method}_{quantization}_index"
+
+
+def get_operator_class(vector_db: PgVector) -> str:
+    quantization = get_quantization(vector_db)
+    if quantization == "binary":
+        return "bit_hamming_ops"
+    ops = {
+        Distance.l2: "l2_ops",
+        Distance.max_inner_product: "ip_ops",
+        Distance.cosine: "cosine_ops",
+    }.get(vector_db.distance, "cosine_ops")
+    return f"{'halfvec' if quantization == 'halfvec' else 'vector'}_{ops}"
+
+
+def get_index_expression(vector_db: PgVector) -> str:
+    """Returns the indexed expression and its operator class, queries must order by the same expression."""
+    quantization = get_quantization(vector_db)
+    if quantization == "halfvec":
+        expression = f"(embedding::halfvec({vector_db.dimensions}))"
+    elif quantization == "binary":
+        expression = f"(binary_quantize(embedding)::bit({vector_db.dimensions}))"
+    else:
+        expression = "embedding"
+    return f"{expression} {get_operator_class(vector_db)}"
+
+
+def get_index_quantization(definition: str) -> str:
+    """Returns the quantization of an index from its definition."""
+    if "binary_quantize(" in definition:
+        return "binary"
+    if "halfvec" in definition:
+        return "halfvec"
+    return "none"
+
+
+def get_ivfflat_lists(rows: int) -> int:
+    """Returns the number of IVFFlat lists recommended by pgvector for a table of `rows` rows."""
+    if rows < 1_000_000:
+        return max(rows // 1000, 1)
+    return int(rows**0.5)
+
+
+def get_row_estimate(conn: Connection, vector_db: PgVector) -> int:
+    """Returns the planner's estimate of the rows of a table, counting them if it was never analyzed."""
+    rows = conn.scalar(
+        text("SELECT reltuples::bigint FROM pg_class WHERE oid = to_regclass(:table)"),
+        {"table": vector_db.table.fullname},
+    )
+    if rows is None or rows < 0:
+        rows = conn.scalar(text(f"SELECT count(*) FROM {vector_db.table.fullname}"))
+    return int(rows or 0)
+
+
+def get_vector_indexes(vector_db: PgVector) -> List[VectorIndexInfo]:
+    """Returns the HNSW and IVFFlat indexes of the table of a vector db."""
+    with vector_db.db_engine.connect() as conn:
+        rows = conn.execute(
+            text(
+                """
+                SELECT c.relname, am.amname, pg_get_indexdef(c.oid), pg_relation_size(c.oid), i.indisvalid
+                FROM pg_index i
+                JOIN pg_class c ON c.oid = i.indexrelid
+                JOIN pg_am am ON am.oid = c.relam
+                WHERE i.indrelid = to_regclass(:table) AND am.amname IN ('hnsw', 'ivfflat')
+                ORDER BY c.relname
+                """
+            ),
+            {"table": vector_db.table.fullname},
+        )
+        return [
+            VectorIndexInfo(
+                name=name,
+                method=method,
+                quantization=get_index_quantization(definition),
+                definition=definition,
+                size_bytes=size_bytes,
+                valid=valid,
+            )
+            for name, method, definition, size_bytes, valid in rows
+        ]
+
+
+def build_vector_index(
+    vector_db: PgVector, index: VectorIndex, concurrently: bool = True, name: Optional[str] = None
+) -> str:
+    """Builds a vector index on the table of a vector db, unless an index of that name exists.
+
+    The index is quantized like the vector db, see `get_quantization()`.
+
+    Args:
+        vector_db: The vector db
+        index: HNSW with m and ef_construction, or Ivfflat with lists (computed from the rows with dynamic_lists)
+        concurrently: Build without blocking writes to the table, slower and not in a transaction
+        name: Name of the index, by default get_index_name()
+
+    Returns:
+        str: The name of the index
+    """
+    name = name or get_index_name(vector_db, index)
+    start = time.monotonic()
+    with vector_db.db_engine.connect() as conn:
+        conn = conn.execution_options(isolation_level="AUTOCOMMIT")
+        settings = {**index.configuration, "statement_timeout": 0}
+        for key, value in settings.items():
+            conn.execute(text("SELECT set_config(:key, :value, false)"), {"key": key, "value": str(value)})
+        try:
+            if isinstance(index, Ivfflat):
+                lists = get_ivfflat_lists(get_row_estimate(conn, vector_db)) if index.dynamic_lists else index.lists
+                method, options = "ivfflat", f"lists = {int(lists)}"
+            else:
+                method, options = "hnsw", f"m = {int(index.m)}, ef_construction = {int(index.ef_construction)}"
+            conn.execute(
+                text(
+                    f'CREATE INDEX {"CONCURRENTLY " if concurrently else ""}IF NOT EXISTS "{name}" '
+                    f"ON {vector_db.table.fullname} USING {method} ({get_index_expression(vector_db)}) "
+                    f"WITH ({options})"
+                )
+            )
+        finally:
+            # The connection goes back to the pool, do not leave the build settings on it
+            for key in settings:
+                conn.execute(text(f"RESET {key}"))
+    logger.info(f"Built {method} index {name} ({options}) in {time.monotonic() - start:.1f}s")
+    return name
+
+
+def drop_vector_index(vector_db: PgVector, name: str, concurrently: bool = True) -> None:
+    with vector_db.db_engine.connect() as conn:
+        conn = conn.execution_options(isolation_level="AUTOCOMMIT")
+        conn.execute(
+            text(f'DROP INDEX {"CONCURRENTLY " if concurrently else ""}IF EXISTS "{vector_db.schema}"."{name}"')
+        )
+
+
+def drop_other_vector_indexes(vector_db: PgVector, keep: str, concurrently: bool = True) -> List[str]:
+    """Drops the vector indexes of a table other than `keep`, eg: the full-precision index once queries are quantized.
+
+    Returns:
+        List[str]: The names of the dropped indexes
+    """
+    dropped = []
+    for existing in get_vector_indexes(vector_db):
+        if existing.name != keep:
+            drop_vector_index(vector_db, existing.name, concurrently=concurrently)
+            dropped.append(existing.name)
+    return dropped
+
+
+def rebuild_vector_index(vector_db: PgVector, index: VectorIndex, concurrently: bool = True) -> str:
+    """Replaces the vector indexes of a table with a new index, eg: with other parameters or of the other type.
+
+    The new index is built next to the existing ones, which are then dropped, so queries keep an index throughout.
+    Needs the disk space of both indexes.
+
+    Returns:
+        str: The name of the new index
+    """
+    name = get_index_name(vector_db, index)
+    building = f"{name}_rebuild"
+    # A build that failed leaves an invalid index behind
+    drop_vector_index(vector_db, building, concurrently=concurrently)
+    build_vector_index(vector_db, index, concurrently=concurrently, name=building)
+    drop_other_vector_indexes(vector_db, building, concurrently=concurrently)
+    with vector_db.db_engine.begin() as conn:
+        conn.execute(text(f'ALTER INDEX "{vector_db.schema}"."{building}" RENAME TO "{name}"'))
+    return name
+
+
+def ensure_vector_index(vector_db: PgVector, index: VectorIndex, concurrently: bool = True) -> str:
+    """Builds the vector index of a table if it has no valid index of that name, dropping a failed build first."""
+    name = get_index_name(vector_db, index)
+    existing = {info.name: info for info in get_vector_indexes(vector_db)}
+    if name in existing and existing[name].valid:
+        return name
+    if name in existing:
+        logger.warning(f"Vector index {name} is invalid, building it again")
+        drop_vector_index(vector_db, name, concurrently=concurrently)
+    return build_vector_index(vector_db, index, concurrently=concurrently)
+
+
+def main() -> None:
+    from db.ingestion import get_knowledge_bases
+    from db.knowledge import KnowledgeVectorDb
+
+    parser = argparse.ArgumentParser(
+        description="Manages the vector index of a knowledge table. prune drops the indexes other than the one of "
+        "--type and --quantization."
+    )
+    parser.add_argument("action", choices=["status", "build", "rebuild", "prune", "drop"])
+    parser.add_argument("--knowledge", choices=sorted(get_knowledge_bases()), default="sage")
+    parser.add_argument("--type", choices=["hnsw", "ivfflat"], default=db_settings.knowledge_index_type)
+    parser.add_argument("--quantization", choices=QUANTIZATIONS, default=db_settings.knowledge_quantization)
+    parser.add_argument("--m", type=int, default=db_settings.knowledge_hnsw_m)
+    parser.add_argument("--ef-construction", type=int, default=db_settings.knowledge_hnsw_ef_construction)
+    parser.add_argument("--lists", type=int, default=db_settings.knowledge_ivfflat_lists, help="0 for rows / 1000")
+    parser.add_argument("--maintenance-work-mem", default=db_settings.knowledge_index_maintenance_work_mem)
+    parser.add_argument("--blocking", action="store_true", help="Build without CONCURRENTLY, faster but blocks writes")
+    args = parser.parse_args()
+
+    vector_db = get_knowledge_bases()[args.knowledge]().vector_db
+    if not isinstance(vector_db, PgVector):
+        raise SystemExit(f"The {args.knowledge} knowledge base does not use PgVector")
+    if isinstance(vector_db, KnowledgeVectorDb):
+        vector_db.quantization = args.quantization
+    elif args.quantization != "none":
+        raise SystemExit(f"The {args.knowledge} knowledge base cannot search a quantized index")
+
+    index = get_vector_index(args.type)
+    index.configuration = {"maintenance_work_mem": args.maintenance_work_mem}
+    if isinstance(index, HNSW):
+        index.m, index.ef_construction = args.m, args.ef_construction
+    else:
+        index.lists, index.dynamic_lists = args.lists or 100, args.lists == 0
+
+    if args.action == "build":
+        ensure_vector_index(vector_db, index, concurrently=not args.blocking)
+    elif args.action == "rebuild":
+        rebuild_vector_index(vector_db, index, concurrently=not args.blocking)
+    elif args.action == "prune":
+        name = get_index_name(vector_db, index)
+        if not any(info.name == name and info.valid for info in get_vector_indexes(vector_db)):
+            raise SystemExit(f"Vector index {name} is missing or invalid, build it first")
+        drop_other_vector_indexes(vector_db, name, concurrently=not args.blocking)
+    elif args.action == "drop":
+        for info in get_vector_indexes(vector_db):
+            drop_vector_index(vector_db, info.name, concurrently=not args.blocking)
+    for info in get_vector_indexes(vector_db):
+        print(", ".join(f"{field}: {value}" for field, value in asdict(info).items()))
+
+
+if __name__ == "__main__":
+    main()
@@ -2,12 +2,11 @@ from textwrap import dedent
 
 from agno.agent import Agent
 from agno.models.openai import OpenAIChat
-from agno.storage.postgres import PostgresStorage
 from agno.team.team import Team
 from agno.tools.duckduckgo import DuckDuckGoTools
 from agno.tools.yfinance import YFinanceTools
 
-from db.session import db_url
+from db.storage import get_session_storage
 from teams.settings import team_settings
 
 finance_agent = Agent(
@@ -53,7 +52,7 @@ finance_agent = Agent(
         - Note market uncertainties
         - Mention relevant regulatory concerns
     """),
-    storage=PostgresStorage(table_name="finance_agent", db_url=db_url, auto_upgrade_schema=True),
+    storage=get_session_storage(table_name="finance_agent", auto_upgrade_schema=True),
     add_history_to_messages=True,
     num_history_responses=5,
     add_datetime_to_instructions=True,
@@ -71,7 +70,7 @@ web_agent = Agent(
     ],
     show_tool_calls=True,
     markdown=True,
-    storage=PostgresStorage(table_name="web_agent", db_url=db_url, auto_upgrade_schema=True),
+    storage=get_session_storage(table_name="web_agent", auto_upgrade_schema=True),
 )
 
 
@@ -89,11 +88,6 @@ def get_finance_researcher_team(debug_mode: bool = False):
         success_criteria="A good financial research report.",
         enable_agentic_context=True,
         expected_output="A good financial research report.",
-        storage=PostgresStorage(
-            table_name="finance_researcher_team",
-            db_url=db_url,
-            mode="team",
-            auto_upgrade_schema=True,
-        ),
+        storage=get_session_storage(table_name="finance_researcher_team", mode="team", auto_upgrade_schema=True),
         debug_mode=debug_mode,
     )
@@ -1,9 +1,8 @@
 from agno.agent import Agent
 from agno.models.openai import OpenAIChat
-from agno.storage.postgres import PostgresStorage
 from agno.team.team import Team
 
-from db.session import db_url
+from db.storage import get_session_storage
 from teams.settings import team_settings
 
 japanese_agent = Agent(
@@ -64,11 +63,6 @@ def get_multi_language_team(debug_mode: bool = False):
         markdown=True,
         show_tool_calls=True,
         show_members_responses=True,
-        storage=PostgresStorage(
-            table_name="multi_language_team",
-            db_url=db_url,
-            mode="team",
-            auto_upgrade_schema=True,
-        ),
+        storage=get_session_storage(table_name="multi_language_team", mode="team", auto_upgrade_schema=True),
         debug_mode=debug_mode,
     )
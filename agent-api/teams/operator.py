@@ -0,0 +1,29 @@
+from enum import Enum
+from typing import List
+
+from agno.team.team import Team
+
+
+class TeamType(Enum):
+    FINANCE_RESEARCHER = "financial-researcher-team"
+    MULTI_LANGUAGE = "multi-language-team"
+
+
+def get_available_teams() -> List[str]:
+    """Returns a list of all available team IDs."""
+    return [team.value for team in TeamType]
+
+
+def get_team(team_id: TeamType, debug_mode: bool = False) -> Team:
+    """Returns a new team for the team_id.
+
+    Team modules create their member agents and storages on import, so they are imported on first use.
+    """
+    if team_id == TeamType.FINANCE_RESEARCHER:
+        from teams.finance_researcher_team import get_finance_researcher_team
+
+        return get_finance_researcher_team(debug_mode=debug_mode)
+    else:
+        from teams.multi_language_team import get_multi_language_team
+
+        return get_multi_language_team(debug_mode=debug_mode)
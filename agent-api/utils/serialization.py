@@ -0,0 +1,69 @@
+import json
+from typing import Any
+
+from fastapi.responses import JSONResponse
+from pydantic import BaseModel
+
+try:
+    import orjson
+except ImportError:
+    orjson = None  # type: ignore
+
+# The JSON library used by dumps(), orjson when it is installed
+json_backend: str = "orjson" if orjson is not None else "json"
+
+
+def _default_orjson(obj: Any) -> Any:
+    # Pydantic models are serialized by pydantic-core and embedded as is, without building a dict first
+    if isinstance(obj, BaseModel):
+        return orjson.Fragment(obj.model_dump_json())
+    return str(obj)
+
+
+def _default_json(obj: Any) -> Any:
+    if isinstance(obj, BaseModel):
+        return obj.model_dump(mode="json")
+    return str(obj)
+
+
+def dumps(obj: Any, indent: bool = False) -> bytes:
+    """Serializes an object to JSON bytes, with orjson when it is installed.
+
+    Handles pydantic models, dataclasses, datetimes and enums. Other unsupported types are serialized as strings.
+
+    Args:
+        obj: The object to serialize
+        indent: Indent the output with 2 spaces
+    """
+    if orjson is not None:
+        option = orjson.OPT_NON_STR_KEYS | (orjson.OPT_INDENT_2 if indent else 0)
+        return orjson.dumps(obj, default=_default_orjson, option=option)
+    return json.dumps(
+        obj,
+        default=_default_json,
+        ensure_ascii=False,
+        indent=2 if indent else None,
+        separators=None if indent else (",", ":"),
+    ).encode("utf-8")
+
+
+def dumps_str(obj: Any, indent: bool = False) -> str:
+    """Serializes an object to a JSON string. See dumps()."""
+    return dumps(obj, indent=indent).decode("utf-8")
+
+
+def loads(data: bytes) -> Any:
+    """Parses JSON bytes, with orjson when it is installed."""
+    if orjson is not None:
+        return orjson.loads(data)
+    return json.loads(data)
+
+
+class FastJSONResponse(JSONResponse):
+    """JSON response rendered with dumps().
+
+    Routes must return the response themselves, otherwise FastAPI converts the content with jsonable_encoder first.
+    """
+
+    def render(self, content: Any) -> bytes:
+        return dumps(content)
@@ -26,20 +26,19 @@ Example blog topics to try:
 Run `pip install openai duckduckgo-search newspaper4k lxml_html_clean sqlalchemy agno` to install dependencies.
 """
 
-import json
 from textwrap import dedent
 from typing import Dict, Iterator, Optional
 
 from agno.agent import Agent
 from agno.models.openai import OpenAIChat
-from agno.storage.workflow.postgres import PostgresWorkflowStorage
 from agno.tools.duckduckgo import DuckDuckGoTools
 from agno.tools.newspaper4k import Newspaper4kTools
 from agno.utils.log import logger
 from agno.workflow import RunEvent, RunResponse, Workflow
 from pydantic import BaseModel, Field
 
-from db.session import db_url
+from db.storage import get_session_storage
+from utils.serialization import dumps_str
 from workflows.settings import workflow_settings
 
 
@@ -235,11 +234,11 @@ class BlogPostGenerator(Workflow):
         # Prepare the input for the writer
         writer_input = {
             "topic": topic,
-            "articles": [v.model_dump() for v in scraped_articles.values()],
+            "articles": list(scraped_articles.values()),
         }
 
         # Run the writer and yield the response
-        yield from self.writer.run(json.dumps(writer_input, indent=4), stream=True)
+        yield from self.writer.run(dumps_str(writer_input, indent=True), stream=True)
 
         # Save the blog post in the cache
         if self.writer.run_response:
@@ -359,10 +358,10 @@ def write_blog_post(self, topic: str, scraped_articles: Dict[str, ScrapedArticle
     # Prepare the input for the writer
     writer_input = {
         "topic": topic,
-        "articles": [v.model_dump() for v in scraped_articles.values()],
+        "articles": list(scraped_articles.values()),
     }
     # Run the writer and yield the response
-    yield from self.writer.run(json.dumps(writer_input, indent=4), stream=True)
+    yield from self.writer.run(dumps_str(writer_input, indent=True), stream=True)
     # Save the blog post in the cache
     self.add_blog_post_to_cache(topic, self.writer.run_response.content)
 
@@ -370,10 +369,8 @@ def write_blog_post(self, topic: str, scraped_articles: Dict[str, ScrapedArticle
 def get_blog_post_generator(debug_mode: bool = False) -> BlogPostGenerator:
     return BlogPostGenerator(
         workflow_id="generate-blog-post-on",
-        storage=PostgresWorkflowStorage(
-            table_name="blog_post_generator_workflows",
-            db_url=db_url,
-            auto_upgrade_schema=True,
+        storage=get_session_storage(
+            table_name="blog_post_generator_workflows", mode="workflow", auto_upgrade_schema=True
         ),
         debug_mode=debug_mode,
     )
@@ -3,12 +3,11 @@ from typing import Iterator
 
 from agno.agent import Agent, RunResponse
 from agno.models.openai import OpenAIChat
-from agno.storage.workflow.postgres import PostgresWorkflowStorage
 from agno.tools.yfinance import YFinanceTools
 from agno.utils.log import logger
 from agno.workflow import Workflow
 
-from db.session import db_url
+from db.storage import get_session_storage
 from workflows.settings import workflow_settings
 
 
@@ -144,10 +143,8 @@ class InvestmentReportGenerator(Workflow):
 def get_investment_report_generator(debug_mode: bool = False) -> InvestmentReportGenerator:
     return InvestmentReportGenerator(
         workflow_id="generate-investment-report",
-        storage=PostgresWorkflowStorage(
-            table_name="investment_report_generator_workflows",
-            db_url=db_url,
-            auto_upgrade_schema=True,
+        storage=get_session_storage(
+            table_name="investment_report_generator_workflows", mode="workflow", auto_upgrade_schema=True
         ),
         debug_mode=debug_mode,
     )
@@ -0,0 +1,29 @@
+from enum import Enum
+from typing import List
+
+from agno.workflow import Workflow
+
+
+class WorkflowType(Enum):
+    BLOG_POST_GENERATOR = "generate-blog-post-on"
+    INVESTMENT_REPORT_GENERATOR = "generate-investment-report"
+
+
+def get_available_workflows() -> List[str]:
+    """Returns a list of all available workflow IDs."""
+    return [workflow.value for workflow in WorkflowType]
+
+
+def get_workflow(workflow_id: WorkflowType, debug_mode: bool = False) -> Workflow:
+    """Returns a new workflow for the workflow_id.
+
+    Workflow modules create their agents on import, so they are imported on first use.
+    """
+    if workflow_id == WorkflowType.BLOG_POST_GENERATOR:
+        from workflows.blog_post_generator import get_blog_post_generator
+
+        return get_blog_post_generator(debug_mode=debug_mode)
+    else:
+        from workflows.investment_report_generator import get_investment_report_generator
+
+        return get_investment_report_generator(debug_mode=debug_mode)